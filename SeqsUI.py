@@ -1,5 +1,10 @@
-from src import Main
+import sys
 
 
 if __name__ == '__main__':
-    Main().main()
+    if len(sys.argv) > 1:  # headless, e.g. python SeqsUI.py import -t table.csv sheet.xlsx
+        from src.cli import CommandLine
+        sys.exit(CommandLine().main(sys.argv[1:]))
+    else:
+        from src import Main
+        Main().main()
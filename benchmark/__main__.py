@@ -0,0 +1,110 @@
+import sys
+import argparse
+from os.path import dirname, join, exists
+from .run import Benchmark, OPERATIONS, compare, read_results, write_results
+from .generate import SIZES
+
+
+PROG = 'python -m benchmark'
+DESCRIPTION = 'Time model and view operations on synthetic sequencing tables, and compare with the baseline'
+BASELINE = join(dirname(__file__), 'baseline.json')
+OPTIONAL = [
+    {
+        'keys': ['-s', '--sizes'],
+        'properties': {
+            'nargs': '+',
+            'default': ['1k', '10k', '100k'],
+            'choices': list(SIZES.keys()),
+            'help': 'number of rows of the sequencing table (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['-p', '--operations'],
+        'properties': {
+            'nargs': '+',
+            'default': OPERATIONS,
+            'choices': OPERATIONS,
+            'metavar': 'OPERATION',
+            'help': f'operations to run (default: all)\n{", ".join(OPERATIONS)}',
+        }
+    },
+    {
+        'keys': ['-r', '--repeat'],
+        'properties': {
+            'type': int,
+            'default': 3,
+            'help': 'runs of each operation, the fastest is kept (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['-b', '--baseline'],
+        'properties': {
+            'type': str,
+            'default': BASELINE,
+            'help': 'JSON baseline to compare with (default: benchmark/baseline.json)',
+        }
+    },
+    {
+        'keys': ['-t', '--tolerance'],
+        'properties': {
+            'type': float,
+            'default': 2.0,
+            'help': 'flag operations this many times slower or larger than the baseline (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['-o', '--output'],
+        'properties': {
+            'type': str,
+            'default': None,
+            'help': 'save the results as JSON',
+        }
+    },
+    {
+        'keys': ['-u', '--update-baseline'],
+        'properties': {
+            'action': 'store_true',
+            'help': 'save the results as the new baseline instead of comparing',
+        }
+    },
+]
+
+
+class EntryPoint:
+
+    parser: argparse.ArgumentParser
+
+    def main(self) -> int:
+        self.set_parser()
+        args = self.parser.parse_args()
+
+        results = Benchmark().main(sizes=args.sizes, operations=args.operations, repeat=args.repeat)
+        if args.output is not None:
+            write_results(results, file=args.output, merge=False)
+
+        if args.update_baseline:
+            write_results(results, file=args.baseline)
+            print(f'Baseline updated: "{args.baseline}"', flush=True)
+            return 0
+
+        if not exists(args.baseline):
+            print(f'No baseline "{args.baseline}" to compare with', flush=True)
+            return 0
+
+        regressions = compare(results, baseline=read_results(args.baseline), tolerance=args.tolerance)
+        for r in regressions:
+            print(f'REGRESSION: {r}', flush=True)
+        print(f'{len(regressions)} regression(s) compared with "{args.baseline}"', flush=True)
+        return 1 if len(regressions) > 0 else 0
+
+    def set_parser(self):
+        self.parser = argparse.ArgumentParser(
+            prog=PROG,
+            description=DESCRIPTION,
+            formatter_class=argparse.RawTextHelpFormatter)
+        for item in OPTIONAL:
+            self.parser.add_argument(*item['keys'], **item['properties'])
+
+
+if __name__ == '__main__':
+    sys.exit(EntryPoint().main())
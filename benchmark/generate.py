@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+from os.path import join
+from typing import List
+from src.model import Model, IMPORT_DATE, SEQUENCING_BATCH_ID, LAB_SAMPLE_ID, ID, \
+    HOSPITAL_RESEARCH_CENTER, LAB, LAB_PATIENT_ID, CANCER_TYPE, TISSUE_TYPE, SEQUENCING_TYPE, VIAL, \
+    VIAL_SEQUENCING_NUMBER
+
+
+SIZES = {
+    '1k': 1000,
+    '10k': 10000,
+    '100k': 100000,
+    '1m': 1000000,
+}
+HOSPITALS = [
+    'Taipei Veterans General Hospital',
+    'National Yang Ming Chiao Tung University Hospital',
+    'Taipei Tzu Chi Hospital',
+]
+LABS = ['CCY_LAB', 'GOOD_LAB', 'ABC_LAB', 'XYZ_LAB']
+TUMOR_TYPES = ['Primary Tumor', 'Recurrent', 'Precancer']
+N_BATCHES = 50
+IMPORT_DAY = pd.Timestamp('2024-01-01')  # instead of today, so the tables are the same every run
+
+
+class GenerateData:
+    """
+    Deterministic synthetic data with the same structure as real data:
+    patients of several labs, each with one normal and one to three tumor samples,
+    sequenced in batches, with corrected Fastq names for part of the samples.
+    The files are written into outdir.
+    """
+
+    n_rows: int
+    outdir: str
+    rng: np.random.Generator
+
+    sequencing_table: pd.DataFrame
+    patient_sample_sheet: pd.DataFrame  # one tenth of the table, half of it existing patients
+    sequencing_batch_table: pd.DataFrame
+    fastq_correction_names: List[str]
+
+    sequencing_table_file: str
+    patient_sample_sheet_file: str
+    sequencing_batch_table_file: str
+    fastq_correction_file: str
+
+    def main(self, n_rows: int, outdir: str, seed: int = 0) -> 'GenerateData':
+        self.n_rows = n_rows
+        self.outdir = outdir
+        self.rng = np.random.default_rng(seed)
+        self.set_sequencing_table()
+        self.set_patient_sample_sheet()
+        self.set_sequencing_batch_table()
+        self.set_fastq_correction_names()
+        self.write_files()
+        return self
+
+    def set_sequencing_table(self):
+        sheet = self.__sheet(n_rows=self.n_rows, first_patient=0)
+        file = join(self.outdir, 'all-samples.csv')
+        sheet.to_csv(file, index=False)
+        model = Model()
+        model.import_patient_sample_sheet(file=file)  # IDs are generated as in real use
+        df = model.get_dataframe()
+        df[IMPORT_DATE] = IMPORT_DAY
+        batches = [f'SEQ_BATCH_{i:03d}' for i in range(N_BATCHES)]
+        df[SEQUENCING_BATCH_ID] = pd.Categorical(
+            np.array(batches)[np.sort(self.rng.integers(0, N_BATCHES, size=len(df)))], categories=batches)
+        self.sequencing_table = df
+
+    def set_patient_sample_sheet(self):
+        n = max(self.n_rows // 10, 1)
+        existing = self.__sheet(n_rows=n - n // 2, first_patient=0, sample_prefix='NEW')  # new samples
+        new = self.__sheet(n_rows=n // 2, first_patient=self.n_rows)  # new patients
+        self.patient_sample_sheet = pd.concat([existing, new], ignore_index=True)
+
+    def set_sequencing_batch_table(self):
+        self.sequencing_batch_table = pd.DataFrame({
+            'ID': [f'SEQ_BATCH_{i:03d}' for i in range(N_BATCHES)],
+            'BED File': [f'kit_{i % 5}.bed' for i in range(N_BATCHES)],
+        })
+
+    def set_fastq_correction_names(self):
+        ids = self.sequencing_table[ID]
+        corrected = ids[self.rng.random(len(ids)) < 0.3]
+        self.fastq_correction_names = [f'{i}_EXTRA_R{r}.fastq.gz' for i in corrected for r in (1, 2)]
+
+    def write_files(self):
+        self.sequencing_table_file = join(self.outdir, 'sequencing-table.csv')
+        self.patient_sample_sheet_file = join(self.outdir, 'patient-sample-sheet.csv')
+        self.sequencing_batch_table_file = join(self.outdir, 'sequencing-batch-table.csv')
+        self.fastq_correction_file = join(self.outdir, 'md5sum.txt')
+
+        self.sequencing_table.to_csv(self.sequencing_table_file, index=False)
+        self.patient_sample_sheet.to_csv(self.patient_sample_sheet_file, index=False)
+        self.sequencing_batch_table.to_csv(self.sequencing_batch_table_file, index=False)
+        with open(self.fastq_correction_file, 'w') as fh:
+            fh.writelines(f'{i:032x}  {name}\n' for i, name in enumerate(self.fastq_correction_names))
+
+    def __sheet(self, n_rows: int, first_patient: int, sample_prefix: str = 'S') -> pd.DataFrame:
+        samples_per_patient = self.rng.integers(2, 5, size=n_rows)  # one normal and one to three tumors
+        patients = np.repeat(np.arange(n_rows), samples_per_patient)[:n_rows]
+        nth_sample = pd.Series(patients).groupby(patients).cumcount().to_numpy()
+
+        numbers = patients + first_patient
+        labs = np.array(LABS)[numbers % len(LABS)]  # same for the same patient in every sheet
+        hospitals = np.array(HOSPITALS)[numbers // 7 % len(HOSPITALS)]
+        tumor_types = np.array(TUMOR_TYPES)[self.rng.integers(0, len(TUMOR_TYPES), size=n_rows)]
+        lab_patient_ids = np.char.add('P', numbers.astype(str))
+
+        sheet = pd.DataFrame({
+            HOSPITAL_RESEARCH_CENTER: hospitals,
+            LAB: labs,
+            LAB_PATIENT_ID: lab_patient_ids,
+            LAB_SAMPLE_ID: np.char.add(np.char.add(lab_patient_ids, f'_{sample_prefix}'), nth_sample.astype(str)),
+            CANCER_TYPE: 'HNSCC',
+            TISSUE_TYPE: np.where(nth_sample == 0, 'Normal', tumor_types),
+            SEQUENCING_TYPE: np.where(self.rng.random(n_rows) < 0.9, 'WES', 'RNA-seq'),
+            VIAL: np.where(self.rng.random(n_rows) < 0.8, 'X', 'A'),
+            VIAL_SEQUENCING_NUMBER: 1,
+        })
+        return sheet
+
@@ -0,0 +1,186 @@
+import io
+import os
+import time
+import json
+import tempfile
+import tracemalloc
+import contextlib
+import numpy as np
+from os.path import join
+from typing import List, Dict, Callable, Any
+from src.model import Model, BuildRunTable, ID, VIAL, PATIENT_ID
+from src.cache import REFERENCE_CACHE
+from .generate import GenerateData, SIZES
+
+
+OPERATIONS = [
+    'read_sequencing_table',
+    'import_patient_sample_sheet',
+    'sort_dataframe',
+    'drop',
+    'fill_in_cell_values',
+    'build_run_table',
+    'refresh_table',
+]
+
+Results = Dict[str, Dict[str, Dict[str, float]]]  # size -> operation -> {'seconds', 'peak_mb'}
+
+
+class Benchmark:
+    """
+    Times each operation on synthetic data of each size, the best of `repeat` runs,
+    and measures the peak memory allocated during one more run with tracemalloc,
+    which is separate because tracing slows down the run
+    """
+
+    sizes: List[str]
+    operations: List[str]
+    repeat: int
+
+    data: GenerateData
+    workdir: str
+    app: Any  # the QApplication of the view, created once
+    results: Results
+
+    def main(self, sizes: List[str], operations: List[str] = OPERATIONS, repeat: int = 3) -> Results:
+        for s in sizes:
+            assert s in SIZES, f'Size "{s}" must be one of {list(SIZES.keys())}'
+        for o in operations:
+            assert o in OPERATIONS, f'Operation "{o}" must be one of {OPERATIONS}'
+
+        self.sizes = sizes
+        self.operations = operations
+        self.repeat = repeat
+        self.results = {}
+
+        for size in self.sizes:
+            with tempfile.TemporaryDirectory() as self.workdir:
+                print(f'Generating {size} rows', flush=True)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    self.data = GenerateData().main(n_rows=SIZES[size], outdir=self.workdir)
+                self.results[size] = {}
+                for operation in self.operations:
+                    self.results[size][operation] = self.measure(operation)
+                    r = self.results[size][operation]
+                    print(f'{size:>5} {operation:<30}{r["seconds"]:>10.4f} s{r["peak_mb"]:>10.1f} MB', flush=True)
+
+        return self.results
+
+    def measure(self, operation: str) -> Dict[str, float]:
+        setup = getattr(self, f'setup_{operation}')
+
+        seconds = []
+        for _ in range(self.repeat):
+            run = setup()
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                run()
+                seconds.append(time.perf_counter() - start)
+
+        run = setup()
+        tracemalloc.start()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                run()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {'seconds': min(seconds), 'peak_mb': peak / 1024 ** 2}
+
+    def new_model(self) -> Model:
+        model = Model()
+        model.dataframe = self.data.sequencing_table.copy()
+        return model
+
+    def sample_rows(self, fraction: float = 0.1) -> List[int]:
+        n = len(self.data.sequencing_table)
+        rng = np.random.default_rng(0)
+        return np.sort(rng.choice(n, size=max(int(n * fraction), 1), replace=False)).tolist()
+
+    def setup_read_sequencing_table(self) -> Callable[[], Any]:
+        model = Model()
+        return lambda: model.read_sequencing_table(file=self.data.sequencing_table_file)
+
+    def setup_import_patient_sample_sheet(self) -> Callable[[], Any]:
+        model = self.new_model()
+        return lambda: model.import_patient_sample_sheet(file=self.data.patient_sample_sheet_file)
+
+    def setup_sort_dataframe(self) -> Callable[[], Any]:
+        model = self.new_model()
+        return lambda: model.sort_dataframe(by=ID, ascending=False)
+
+    def setup_drop(self) -> Callable[[], Any]:
+        model, rows = self.new_model(), self.sample_rows()
+        return lambda: model.drop(rows=rows)
+
+    def setup_fill_in_cell_values(self) -> Callable[[], Any]:
+        model, cells = self.new_model(), [(i, VIAL) for i in self.sample_rows()]
+        return lambda: model.fill_in_cell_values(cells=cells, value='B')
+
+    def setup_build_run_table(self) -> Callable[[], Any]:
+        df = self.data.sequencing_table
+        seq_ids = df.loc[df[PATIENT_ID] % 10 == 0, ID].tolist()  # all samples of one tenth of the patients
+        REFERENCE_CACHE.clear()  # reference files are parsed as in the first run after starting
+        return lambda: BuildRunTable().main(
+            seq_df=df,
+            seq_ids=seq_ids,
+            r1_suffix='_R1.fastq.gz',
+            r2_suffix='_R2.fastq.gz',
+            sequencing_batch_table_file=self.data.sequencing_batch_table_file,
+            fastq_correction_file=self.data.fastq_correction_file,
+            output_file=join(self.workdir, 'run-table.csv'),
+            use_lab_sample_id=False)
+
+    def setup_refresh_table(self) -> Callable[[], Any]:
+        """
+        Resets the table view and draws the first screen of cells, offscreen without a display
+        """
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        from PyQt5.QtWidgets import QApplication
+        from src.view import Table
+        self.app = QApplication.instance() or QApplication([])
+        table = Table(self.new_model())
+
+        def run():
+            table.refresh_table()
+            m = table.table_model
+            for i in range(min(m.rowCount(), 50)):
+                for j in range(m.columnCount()):
+                    m.data(m.index(i, j))
+
+        return run
+
+
+def compare(results: Results, baseline: Results, tolerance: float, min_seconds: float = 0.005) -> List[str]:
+    """
+    Operations slower, or allocating more memory, than the baseline times the tolerance.
+    Differences of less than min_seconds are timer noise and ignored.
+    """
+    ret = []
+    for size, operations in results.items():
+        for operation, r in operations.items():
+            b = baseline.get(size, {}).get(operation)
+            if b is None:
+                continue
+            if r['seconds'] > b['seconds'] * tolerance and r['seconds'] - b['seconds'] > min_seconds:
+                ret.append(f'{size} {operation}: {r["seconds"]:.4f} s, baseline {b["seconds"]:.4f} s')
+            if r['peak_mb'] > b['peak_mb'] * tolerance and r['peak_mb'] - b['peak_mb'] > 1:
+                ret.append(f'{size} {operation}: {r["peak_mb"]:.1f} MB, baseline {b["peak_mb"]:.1f} MB')
+    return ret
+
+
+def read_results(file: str) -> Results:
+    with open(file) as fh:
+        return json.load(fh)
+
+
+def write_results(results: Results, file: str, merge: bool = True):
+    """
+    Sizes not in the results are kept from the existing file when merging
+    """
+    ret = read_results(file) if merge and os.path.exists(file) else {}
+    ret.update(results)
+    with open(file, 'w') as fh:
+        json.dump(ret, fh, indent=2, sort_keys=True)
+        fh.write('\n')
@@ -1,10 +1,3 @@
-import sys
-from PyQt5.QtWidgets import QApplication
-from .view import View
-from .model import Model
-from .controller import Controller
-
-
 VERSION = 'v1.2.1'
 STARTING_MESSAGE = f'''\
 SeqsUI {VERSION}
@@ -13,30 +6,11 @@ Yu-Cheng Lin, DDS, MS, PhD (ylin@nycu.edu.tw)
 '''
 
 
-class Main:
-
-    APP_ID = f'NYCU.Dentistry.SeqsUI.{VERSION}'
-
-    model: Model
-    view: View
-    controller: Controller
-
-    def main(self):
-        self.config_taskbar_icon()
-
-        app = QApplication(sys.argv)
-
-        self.model = Model()
-        self.view = View(self.model)
-        self.controller = Controller(self.model, self.view)
-
-        print(STARTING_MESSAGE, flush=True)
-
-        sys.exit(app.exec_())
-
-    def config_taskbar_icon(self):
-        try:
-            from ctypes import windll  # only exists on Windows
-            windll.shell32.SetCurrentProcessExplicitAppUserModelID(self.APP_ID)
-        except ImportError as e:
-            print(e, flush=True)
+def __getattr__(name: str):
+    """
+    The GUI is imported on first use of Main, so the command line and the model never load PyQt5
+    """
+    if name == 'Main':
+        from .main import Main
+        return Main
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
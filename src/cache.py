@@ -0,0 +1,68 @@
+import os
+import threading
+from collections import OrderedDict
+from os.path import abspath
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class ReferenceCache:
+    """
+    Keeps objects parsed from reference files, e.g. the sequencing batch table and lookup dicts derived from it,
+    so a file is parsed once as long as it is not modified.
+
+    Entries are keyed by the file path, its modification time and size, and what was derived from the file.
+    The least recently used entries are evicted beyond MAX_ENTRIES.
+    Cached objects are shared between callers and must not be modified.
+    """
+
+    MAX_ENTRIES = 32
+
+    entries: 'OrderedDict[Tuple, Any]'
+    lock: threading.Lock
+    hits: int
+    misses: int
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, file: str, key: Hashable, load: Callable[[], Any]) -> Any:
+        path = abspath(file)
+        stat = os.stat(path)
+        cache_key = (path, stat.st_mtime_ns, stat.st_size, key)
+
+        with self.lock:
+            if cache_key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(cache_key)
+                return self.entries[cache_key]
+            self.misses += 1
+
+        value = load()  # outside the lock, parsing can be slow
+
+        with self.lock:
+            for k in [k for k in self.entries if k[0] == path and k[1:3] != cache_key[1:3]]:
+                del self.entries[k]  # the file was modified since
+            self.entries[cache_key] = value
+            while len(self.entries) > self.MAX_ENTRIES:
+                self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries)}
+
+    def summary(self) -> str:
+        s = self.stats()
+        return f'Reference cache: {s["hits"]} hits, {s["misses"]} misses, {s["entries"]} entries'
+
+
+REFERENCE_CACHE = ReferenceCache()
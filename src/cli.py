@@ -0,0 +1,371 @@
+import sys
+import argparse
+from os.path import exists, basename, splitext, join
+from typing import List, Any, Optional, Tuple
+from . import VERSION
+
+
+PROG = 'python SeqsUI.py'
+DESCRIPTION = f'SeqsUI {VERSION} command line, runs without a display'
+
+TABLE = {
+    'keys': ['-t', '--table'],
+    'properties': {
+        'type': str,
+        'required': True,
+        'help': 'sequencing table file (.csv, .xlsx, .feather, .parquet, .pkl, .sqlite)',
+    }
+}
+IDS_FILES = {
+    'keys': ['ids_files'],
+    'properties': {
+        'nargs': '+',
+        'metavar': 'IDS_FILE',
+        'help': 'text files of sample IDs, one per line, each is one batch',
+    }
+}
+COMMANDS = {
+    'import': {
+        'help': 'import patient sample sheets into the sequencing table, which is saved once after all sheets',
+        'arguments': [
+            TABLE,
+            {
+                'keys': ['sheets'],
+                'properties': {'nargs': '+', 'metavar': 'SHEET', 'help': 'patient sample sheets, imported in order'}
+            },
+            {
+                'keys': ['-o', '--output'],
+                'properties': {'type': str, 'default': None, 'help': 'save to this file instead of the table'}
+            },
+        ],
+    },
+    'fill': {
+        'help': 'fill in columns of the sequencing table from mapping files keyed by ID or Lab Sample ID',
+        'arguments': [
+            TABLE,
+            {
+                'keys': ['mapping_files'],
+                'properties': {'nargs': '+', 'metavar': 'MAPPING_FILE', 'help': 'mapping files, filled in in order'}
+            },
+            {
+                'keys': ['-o', '--output'],
+                'properties': {'type': str, 'default': None, 'help': 'save to this file instead of the table'}
+            },
+        ],
+    },
+    'build-run-table': {
+        'help': 'build one run table for each IDS_FILE',
+        'arguments': [
+            TABLE,
+            IDS_FILES,
+            {
+                'keys': ['-b', '--sequencing-batch-table'],
+                'properties': {'type': str, 'required': True, 'help': 'sequencing batch table file'}
+            },
+            {
+                'keys': ['-c', '--fastq-correction'],
+                'properties': {'type': str, 'default': '', 'help': 'fastq correction file (default: none)'}
+            },
+            {
+                'keys': ['--r1-suffix'],
+                'properties': {'type': str, 'default': '_R1.fastq.gz', 'help': '(default: %(default)s)'}
+            },
+            {
+                'keys': ['--r2-suffix'],
+                'properties': {'type': str, 'default': '_R2.fastq.gz', 'help': '(default: %(default)s)'}
+            },
+            {
+                'keys': ['--use-lab-sample-id'],
+                'properties': {'action': 'store_true', 'help': 'name samples by Lab Sample ID instead of ID'}
+            },
+            {
+                'keys': ['-o', '--outdir'],
+                'properties': {
+                    'type': str,
+                    'default': '.',
+                    'help': 'run tables are saved as "<IDS_FILE name>-run-table.csv" (default: %(default)s)'
+                }
+            },
+        ],
+    },
+    'copy-fastq': {
+        'help': 'copy the Fastq files of the samples in all IDS_FILEs, renamed by ID',
+        'arguments': [
+            TABLE,
+            IDS_FILES,
+            {
+                'keys': ['-f', '--fastq-dir'],
+                'properties': {'type': str, 'required': True, 'help': 'directory containing Fastq files'}
+            },
+            {
+                'keys': ['-d', '--dst-dir'],
+                'properties': {'type': str, 'required': True, 'help': 'destination directory'}
+            },
+            {
+                'keys': ['--in-r1-suffix'],
+                'properties': {'type': str, 'default': '_R1.fastq.gz', 'help': '(default: %(default)s)'}
+            },
+            {
+                'keys': ['--in-r2-suffix'],
+                'properties': {'type': str, 'default': '_R2.fastq.gz', 'help': '(default: %(default)s)'}
+            },
+            {
+                'keys': ['--out-r1-suffix'],
+                'properties': {'type': str, 'default': '_R1.fastq.gz', 'help': '(default: %(default)s)'}
+            },
+            {
+                'keys': ['--out-r2-suffix'],
+                'properties': {'type': str, 'default': '_R2.fastq.gz', 'help': '(default: %(default)s)'}
+            },
+            {
+                'keys': ['--max-workers'],
+                'properties': {'type': int, 'default': None, 'help': 'concurrent copies in total (default: 8)'}
+            },
+            {
+                'keys': ['--per-source'],
+                'properties': {
+                    'type': int,
+                    'default': None,
+                    'help': 'concurrent copies reading from the same file system (default: 4)'
+                }
+            },
+            {
+                'keys': ['--per-destination'],
+                'properties': {
+                    'type': int,
+                    'default': None,
+                    'help': 'concurrent copies writing to the same file system, e.g. 1 for a spinning disk (default: 2)'
+                }
+            },
+        ],
+    },
+    'export': {
+        'help': 'sort the sequencing table and save it, e.g. in another format',
+        'arguments': [
+            TABLE,
+            {
+                'keys': ['-o', '--output'],
+                'properties': {'type': str, 'required': True, 'help': 'output file, the format by its extension'}
+            },
+            {
+                'keys': ['--sort-by'],
+                'properties': {'type': str, 'default': None, 'metavar': 'COLUMN', 'help': 'column to sort by'}
+            },
+            {
+                'keys': ['--descending'],
+                'properties': {'action': 'store_true', 'help': 'sort in descending order'}
+            },
+        ],
+    },
+}
+
+
+class ProfileStartupAction(argparse.Action):
+
+    def __init__(self, option_strings: List[str], dest: str, **kwargs):
+        super().__init__(option_strings, dest, nargs=0, default=argparse.SUPPRESS, **kwargs)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        from .profiling import ProfileStartup
+        ProfileStartup().main()
+        parser.exit()
+
+
+class CommandLine:
+    """
+    Runs the model operations without the GUI, PyQt5 is never imported.
+    Each command takes many inputs, so the interpreter and pandas start once for all of them.
+    """
+
+    parser: argparse.ArgumentParser
+
+    def main(self, argv: Optional[List[str]] = None) -> int:
+        self.set_parser()
+        args = self.parser.parse_args(argv)
+        command = {
+            'import': ImportSheets,
+            'fill': FillInMappingFiles,
+            'build-run-table': BuildRunTables,
+            'copy-fastq': CopyFastqs,
+            'export': ExportTable,
+        }[args.command]
+        return command().main(args)
+
+    def set_parser(self):
+        self.parser = argparse.ArgumentParser(prog=PROG, description=DESCRIPTION)
+        self.parser.add_argument(
+            '--profile-startup', action=ProfileStartupAction,
+            help='report the import time of each module at startup, then exit')
+        subparsers = self.parser.add_subparsers(dest='command', required=True, metavar='COMMAND')
+        for name, command in COMMANDS.items():
+            subparser = subparsers.add_parser(name, help=command['help'], description=command['help'])
+            for item in command['arguments']:
+                subparser.add_argument(*item['keys'], **item['properties'])
+
+
+class Command:
+
+    def main(self, args: argparse.Namespace) -> int:
+        """
+        Returns the exit code, 1 if anything failed
+        """
+        raise NotImplementedError
+
+    def read_model(self, file: str, required: bool = True) -> Any:
+        from .model import Model  # pandas is loaded only when a command runs, not for --help
+        model = Model()
+        if required or exists(file):
+            model.read_sequencing_table(file=file)
+        return model
+
+    def report_missing_ids(self, dataframe: Any, ids: List[str], ids_file: str) -> int:
+        """
+        Lists the IDs not found in the table on stderr, returns how many
+        """
+        missing = get_missing_ids(dataframe=dataframe, ids=ids)
+        for i in missing:
+            print(f'ERROR: "{i}" of "{basename(ids_file)}" not found in the table', file=sys.stderr, flush=True)
+        return len(missing)
+
+
+class ImportSheets(Command):
+
+    def main(self, args: argparse.Namespace) -> int:
+        model = self.read_model(file=args.table, required=False)  # a new table is started if there is none
+
+        n_failed = 0
+        for sheet in args.sheets:
+            n = len(model.dataframe)
+            try:
+                model.import_patient_sample_sheet(file=sheet)
+            except Exception as e:  # the table is unchanged, go on with the other sheets
+                print(f'ERROR: "{sheet}": {e!r}', flush=True)
+                n_failed += 1
+                continue
+            print(f'Imported {len(model.dataframe) - n} rows from "{basename(sheet)}"', flush=True)
+
+        output = args.output or args.table
+        model.save_sequencing_table(file=output)
+        print(f'Saved {len(model.dataframe)} rows to "{output}", {n_failed} sheet(s) failed', flush=True)
+        return 1 if n_failed > 0 else 0
+
+
+class FillInMappingFiles(Command):
+
+    def main(self, args: argparse.Namespace) -> int:
+        model = self.read_model(file=args.table)
+
+        n_failed = 0
+        for mapping_file in args.mapping_files:
+            try:
+                unmatched = model.fill_in_mapping_file(file=mapping_file)
+            except Exception as e:  # the table is unchanged, go on with the other files
+                print(f'ERROR: "{mapping_file}": {e!r}', flush=True)
+                n_failed += 1
+                continue
+            for key in unmatched:
+                print(f'WARNING: "{key}" of "{basename(mapping_file)}" not found in the table', flush=True)
+
+        output = args.output or args.table
+        model.save_sequencing_table(file=output)
+        print(f'Saved {len(model.dataframe)} rows to "{output}", {n_failed} mapping file(s) failed', flush=True)
+        return 1 if n_failed > 0 else 0
+
+
+class BuildRunTables(Command):
+
+    def main(self, args: argparse.Namespace) -> int:
+        model = self.read_model(file=args.table)
+
+        n_failed = 0
+        for ids_file in args.ids_files:
+            output_file = join(args.outdir, f'{splitext(basename(ids_file))[0]}-run-table.csv')
+            try:
+                seq_ids = read_ids(ids_file)
+                if self.report_missing_ids(dataframe=model.dataframe, ids=seq_ids, ids_file=ids_file) > 0:
+                    n_failed += 1  # the run table is still built for the IDs found
+                model.build_run_table(
+                    seq_ids=seq_ids,
+                    r1_suffix=args.r1_suffix,
+                    r2_suffix=args.r2_suffix,
+                    sequencing_batch_table_file=args.sequencing_batch_table,
+                    fastq_correction_file=args.fastq_correction,
+                    output_file=output_file,
+                    use_lab_sample_id=args.use_lab_sample_id)
+            except Exception as e:
+                print(f'ERROR: "{ids_file}": {e!r}', flush=True)
+                n_failed += 1
+                continue
+            print(f'Saved "{output_file}"', flush=True)
+
+        return 1 if n_failed > 0 else 0
+
+
+class CopyFastqs(Command):
+
+    def main(self, args: argparse.Namespace) -> int:
+        from .fastq import CopyScheduler, PairFastqJobs
+
+        model = self.read_model(file=args.table)
+        ids = []
+        n_missing = 0
+        for ids_file in args.ids_files:
+            batch = read_ids(ids_file)
+            n_missing += self.report_missing_ids(dataframe=model.dataframe, ids=batch, ids_file=ids_file)
+            ids += batch
+        seq_ids, lab_sample_ids = select_samples(dataframe=model.dataframe, ids=ids)
+
+        jobs, errors = PairFastqJobs().main(
+            seq_ids=seq_ids,
+            lab_sample_ids=lab_sample_ids,
+            fq_dir=args.fastq_dir,
+            dst_dir=args.dst_dir,
+            in_r1_suffix=args.in_r1_suffix,
+            in_r2_suffix=args.in_r2_suffix,
+            out_r1_suffix=args.out_r1_suffix,
+            out_r2_suffix=args.out_r2_suffix)
+
+        limits = {
+            k: getattr(args, k) for k in ['max_workers', 'per_source', 'per_destination']
+            if getattr(args, k) is not None  # the defaults of CopyScheduler otherwise
+        }
+        scheduler = CopyScheduler()
+        scheduler.main(jobs=jobs, **limits)  # all batches share one pool of workers
+        errors += scheduler.get_errors()
+
+        for error in errors:
+            print(f'ERROR: {error}', flush=True)
+        return 1 if len(errors) > 0 or n_missing > 0 else 0
+
+
+class ExportTable(Command):
+
+    def main(self, args: argparse.Namespace) -> int:
+        model = self.read_model(file=args.table)
+        if args.sort_by is not None:
+            assert args.sort_by in model.dataframe.columns, f'Column "{args.sort_by}" not found in "{args.table}"'
+            model.sort_dataframe(by=args.sort_by, ascending=not args.descending)
+        model.save_sequencing_table(file=args.output)
+        print(f'Saved {len(model.dataframe)} rows to "{args.output}"', flush=True)
+        return 0
+
+
+def read_ids(file: str) -> List[str]:
+    with open(file) as fh:
+        return [line.strip() for line in fh if line.strip() != '']
+
+
+def select_samples(dataframe: Any, ids: List[str]) -> Tuple[List[str], List[str]]:
+    """
+    The IDs and Lab Sample IDs of the rows having the IDs, in the order of the table as selected in the GUI
+    """
+    rows = dataframe[dataframe['ID'].isin(ids)]
+    return rows['ID'].tolist(), rows['Lab Sample ID'].tolist()
+
+
+def get_missing_ids(dataframe: Any, ids: List[str]) -> List[str]:
+    """
+    The IDs not in the table, in the given order, which would otherwise be skipped silently
+    """
+    found = set(dataframe['ID'].tolist())
+    return [i for i in ids if i not in found]
@@ -1,20 +1,23 @@
-import shutil
-import hashlib
-from typing import List
-from os.path import exists, basename
+from typing import List, Tuple, Any
+from os.path import basename
 from .view import View
 from .model import Model
-from .tools import get_files
+from .tasks import Task
+from .runner import TaskRunner
+from .fastq import CopyScheduler, PairFastqJobs
+from .instrument import instrumented
 
 
 class Controller:
 
     model: Model
     view: View
+    runner: TaskRunner
 
     def __init__(self, model: Model, view: View):
         self.model = model
         self.view = view
+        self.runner = TaskRunner(view)
         self.__init_actions()
         self.__connect_button_actions()
         self.view.show()
@@ -30,6 +33,7 @@ class Controller:
         self.action_copy_selected_fastq_files = ActionCopySelectedFastqFiles(self)
         self.action_build_run_table = ActionBuildRunTable(self)
         self.action_fill_in_cell_values = ActionFillInCellValues(self)
+        self.action_fill_in_mapping_file = ActionFillInMappingFile(self)
         self.action_undo = ActionUndo(self)
         self.action_redo = ActionRedo(self)
 
@@ -47,10 +51,17 @@ class Action:
 
     model: Model
     view: View
+    runner: TaskRunner
 
     def __init__(self, controller: Controller):
         self.model = controller.model
         self.view = controller.view
+        self.runner = controller.runner
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        call = getattr(cls.__call__, '__wrapped__', cls.__call__)  # an inherited one is already named by the parent
+        cls.__call__ = instrumented(name=cls.__name__)(call)
 
 
 class ActionReadSequencingTable(Action):
@@ -60,11 +71,14 @@ class ActionReadSequencingTable(Action):
         if file == '':
             return
 
-        try:
-            self.model.read_sequencing_table(file=file)
-            self.view.refresh_table()
-        except Exception as e:
-            self.view.message_box_error(msg=repr(e))
+        n = self.model.count_recoverable_edits(file=file)
+        recover = n > 0 and self.view.message_box_yes_no(
+            msg=f'"{basename(file)}" has {n} unsaved edit(s) from a session that did not close properly. '
+                f'Recover them?\n\nOtherwise they are discarded.')
+
+        self.runner.run(
+            fn=lambda task: self.model.read_sequencing_table(file=file, recover=recover, task=task),
+            label=f'Reading {basename(file)}')
 
 
 class ActionImportPatientSampleSheet(Action):
@@ -74,11 +88,9 @@ class ActionImportPatientSampleSheet(Action):
         if file == '':
             return
 
-        try:
-            self.model.import_patient_sample_sheet(file=file)
-            self.view.refresh_table()
-        except Exception as e:
-            self.view.message_box_error(msg=repr(e))
+        self.runner.run(
+            fn=lambda task: self.model.import_patient_sample_sheet(file=file, task=task),
+            label=f'Importing {basename(file)}')
 
 
 class ActionSaveSequencingTable(Action):
@@ -87,7 +99,9 @@ class ActionSaveSequencingTable(Action):
         file = self.view.file_dialog_save_table(filename='sequencing_table.csv')
         if file == '':
             return
-        self.model.save_sequencing_table(file=file)
+        self.runner.run(
+            fn=lambda task: self.model.save_sequencing_table(file=file, task=task),
+            label=f'Saving {basename(file)}')
 
 
 class ActionSort(Action):
@@ -100,7 +114,6 @@ class ActionSort(Action):
             self.view.message_box_error(msg='Please select a column')
         elif len(columns) == 1:
             self.model.sort_dataframe(by=columns[0], ascending=self.ASCENDING)
-            self.view.refresh_table()
         else:
             self.view.message_box_error(msg='Please select only one column')
 
@@ -123,7 +136,6 @@ class ActionDeleteSelectedRows(Action):
             return
         if self.view.message_box_yes_no(msg='Are you sure you want to delete the selected rows?'):
             self.model.drop(rows=rows)
-            self.view.refresh_table()
 
 
 class ActionResetTable(Action):
@@ -134,7 +146,6 @@ class ActionResetTable(Action):
 
         if self.view.message_box_yes_no(msg='Are you sure you want to reset the table?'):
             self.model.reset_dataframe()
-            self.view.refresh_table()
 
 
 class ActionCopySelectedFastqFiles(Action):
@@ -148,6 +159,10 @@ class ActionCopySelectedFastqFiles(Action):
     out_r1_suffix: str
     out_r2_suffix: str
 
+    jobs: List[Tuple[str, str]]
+    errors: List[str]
+    summary: str
+
     def __call__(self):
         self.set_seq_ids_and_lab_sample_ids()
         if len(self.seq_ids) == 0:
@@ -170,8 +185,17 @@ class ActionCopySelectedFastqFiles(Action):
         if self.out_r1_suffix == '' or self.out_r2_suffix == '':
             return
 
-        for seq_id, lab_sample_id in zip(self.seq_ids, self.lab_sample_ids):
-            self.copy_paired_fastq(seq_id=seq_id, lab_sample_id=lab_sample_id)
+        self.jobs, self.errors = PairFastqJobs().main(
+            seq_ids=self.seq_ids,
+            lab_sample_ids=self.lab_sample_ids,
+            fq_dir=self.fq_dir,
+            dst_dir=self.dst_dir,
+            in_r1_suffix=self.in_r1_suffix,
+            in_r2_suffix=self.in_r2_suffix,
+            out_r1_suffix=self.out_r1_suffix,
+            out_r2_suffix=self.out_r2_suffix)
+
+        self.runner.run(fn=self.copy, label='Copying Fastq Files', on_finished=self.report)
 
     def set_seq_ids_and_lab_sample_ids(self):
         rows = self.view.get_selected_rows()
@@ -190,70 +214,18 @@ class ActionCopySelectedFastqFiles(Action):
     def set_out_r1_r2_suffix(self):
         self.out_r1_suffix, self.out_r2_suffix = self.view.dialog_output_read1_read2_suffix()
 
-    def copy_paired_fastq(self, seq_id: str, lab_sample_id: str):
-        fq1 = self.__get_src_fastq(lab_sample_id=lab_sample_id, suffix=self.in_r1_suffix)
-        fq2 = self.__get_src_fastq(lab_sample_id=lab_sample_id, suffix=self.in_r2_suffix)
-
-        if fq1 == '' or fq2 == '':
-            self.view.message_box_error(f'Skip {seq_id} due to missing or multiple Fastq files for {lab_sample_id}')
-            return
+    def copy(self, task: Task):
+        scheduler = CopyScheduler()
+        scheduler.main(jobs=self.jobs, task=task)
+        self.errors += scheduler.get_errors()
+        self.summary = scheduler.summary()
 
-        self.__copy(src=fq1, dst=f'{self.dst_dir}/{seq_id}{self.out_r1_suffix}')
-        self.__copy(src=fq2, dst=f'{self.dst_dir}/{seq_id}{self.out_r2_suffix}')
-
-    def __get_src_fastq(self, lab_sample_id: str, suffix: str) -> str:
-        files = get_files(
-            source=self.fq_dir,
-            startswith=lab_sample_id,
-            endswith=suffix,
-            isfullpath=True
-        )
-        if len(files) == 0:
-            self.view.message_box_error(f'No Fastq file found for {lab_sample_id}*{suffix}')
-            return ''
-        elif len(files) > 1:
-            self.view.message_box_error(f'Multiple Fastq files found for {lab_sample_id}*{suffix}: {files}')
-            return ''
+    def report(self, *args):
+        if len(self.errors) == 0:
+            self.view.message_box_info(msg=self.summary)
         else:
-            return files[0]
-
-    def __copy(self, src: str, dst: str):
-
-        if not exists(src):
-            self.view.message_box_error(f'The source file "{basename(src)}" does not exist')
-            return
-
-        if exists(dst):
-            self.view.message_box_error(f'The destination file "{basename(dst)}" already exists, skip')
-            return
-
-        print(f'Copying {src} -> {dst}', flush=True)
-        shutil.copyfile(src=src, dst=dst)
-
-        if not md5(src) == md5(dst):
-            self.view.message_box_error(f'Copy failed for {basename(src)}, delete "{basename(dst)}"')
-            shutil.rmtree(dst)
-
-
-def md5(file_path: str, buffer_size: int = 8192) -> str:
-    """
-    Compute the MD5 hash of a file. Written by ChatGPT.
-
-    Args:
-    - file_path (str): Path to the file.
-    - buffer_size (int, optional): Size of the buffer to read in bytes. Default is 8192.
-
-    Returns:
-    - str: MD5 hash of the file.
-    """
-    md5_hash = hashlib.md5()
-
-    with open(file_path, 'rb') as f:
-        # Read the file in chunks
-        for chunk in iter(lambda: f.read(buffer_size), b''):
-            md5_hash.update(chunk)
-
-    return md5_hash.hexdigest()
+            msg = '\n'.join([self.summary, f'{len(self.errors)} error(s):'] + self.errors)
+            self.view.message_box_error(msg=msg)
 
 
 class ActionBuildRunTable(Action):
@@ -281,16 +253,18 @@ class ActionBuildRunTable(Action):
 
         use_lab_sample_id = self.view.message_box_yes_no(msg='Use Lab Sample ID instead of ID?')
 
-        self.model.build_run_table(
-            seq_ids=seq_ids,
-            r1_suffix=r1_suffix,
-            r2_suffix=r2_suffix,
-            sequencing_batch_table_file=sequencing_batch_table_file,
-            fastq_correction_file=fastq_correction_file,
-            output_file=output_file,
-            use_lab_sample_id=use_lab_sample_id)
-
-        self.view.message_box_info(msg='Run table build complete')
+        self.runner.run(
+            fn=lambda task: self.model.build_run_table(
+                seq_ids=seq_ids,
+                r1_suffix=r1_suffix,
+                r2_suffix=r2_suffix,
+                sequencing_batch_table_file=sequencing_batch_table_file,
+                fastq_correction_file=fastq_correction_file,
+                output_file=output_file,
+                use_lab_sample_id=use_lab_sample_id,
+                task=task),
+            label='Building Run Table',
+            on_finished=lambda _: self.view.message_box_info(msg='Run table build complete'))
 
 
 class ActionFillInCellValues(Action):
@@ -308,17 +282,39 @@ class ActionFillInCellValues(Action):
 
         try:
             self.model.fill_in_cell_values(cells=selected_cells, value=value)
-            self.view.refresh_table()
         except Exception as e:
             self.view.message_box_error(msg=repr(e))
 
 
+class ActionFillInMappingFile(Action):
+
+    MAX_SHOWN = 50  # unmatched keys listed in the message box
+
+    def __call__(self):
+        file = self.view.file_dialog_open_table(caption='Open Mapping File')
+        if file == '':
+            return
+
+        self.runner.run(
+            fn=lambda task: self.model.fill_in_mapping_file(file=file, task=task),
+            label=f'Filling in {basename(file)}',
+            on_finished=self.report)
+
+    def report(self, unmatched: List[Any]):
+        if len(unmatched) == 0:
+            return
+        lines = [str(k) for k in unmatched[:self.MAX_SHOWN]]
+        if len(unmatched) > self.MAX_SHOWN:
+            lines.append(f'... and {len(unmatched) - self.MAX_SHOWN} more')
+        header = f'{len(unmatched)} key(s) not found in the sequencing table:'
+        self.view.message_box_error(msg='\n'.join([header] + lines))
+
+
 class ActionUndo(Action):
 
     def __call__(self):
         try:
             self.model.undo()
-            self.view.refresh_table()
         except Exception as e:
             self.view.message_box_error(msg=repr(e))
 
@@ -328,6 +324,5 @@ class ActionRedo(Action):
     def __call__(self):
         try:
             self.model.redo()
-            self.view.refresh_table()
         except Exception as e:
             self.view.message_box_error(msg=repr(e))
@@ -0,0 +1,441 @@
+import os
+import time
+import hashlib
+import threading
+from bisect import bisect_left
+from os.path import basename, dirname, abspath, join, exists
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, List, Tuple, Dict, Any, Iterable, Iterator
+from .tasks import Task, Cancelled
+
+
+class CopyFile:
+
+    BLOCK_SIZE = 8 * 1024 ** 2
+    VERIFY_MODES = [
+        'read-back',  # re-read the destination once and compare its hash with the source
+        'fsync',  # flush the destination to disk and drop it from the page cache before reading it back
+    ]
+
+    src: str
+    dst: str
+    algorithm: str
+    verify: str
+    progress: Optional[Callable[[int], None]]
+
+    created: bool  # dst was created by this copy, only then it is removed on failure
+    src_hash: str
+    dst_hash: str
+
+    def main(
+            self,
+            src: str,
+            dst: str,
+            algorithm: str = 'blake2b',
+            verify: str = 'read-back',
+            progress: Optional[Callable[[int], None]] = None) -> str:
+        """
+        Copies src to dst, hashing the source while it is being copied,
+        so the source is read only once. Returns the hash of the file.
+
+        The progress callback receives the number of bytes of each block copied.
+        """
+        assert verify in self.VERIFY_MODES, f'Verify mode "{verify}" must be one of {self.VERIFY_MODES}'
+
+        self.src = src
+        self.dst = dst
+        self.algorithm = algorithm
+        self.verify = verify
+        self.progress = progress
+        self.created = False
+
+        try:
+            self.copy_and_hash_src()
+            self.hash_dst()
+        except BaseException:
+            if self.created and os.path.exists(self.dst):
+                os.remove(self.dst)  # never leave a partial file behind
+            raise
+
+        if self.src_hash != self.dst_hash:
+            os.remove(self.dst)
+            raise AssertionError(f'Copy failed for {basename(self.src)}, delete "{basename(self.dst)}"')
+
+        return self.src_hash
+
+    def copy_and_hash_src(self):
+        h = hashlib.new(self.algorithm)
+        buffer = bytearray(self.BLOCK_SIZE)
+        view = memoryview(buffer)
+
+        with open(self.src, 'rb') as reader, open(self.dst, 'xb') as writer:  # 'x' never overwrites an existing file
+            self.created = True
+            while True:
+                n = reader.readinto(buffer)
+                if n == 0:
+                    break
+                h.update(view[:n])
+                writer.write(view[:n])
+                if self.progress is not None:
+                    self.progress(n)
+
+            if self.verify == 'fsync':
+                writer.flush()
+                os.fsync(writer.fileno())
+                drop_page_cache(writer.fileno())
+
+        self.src_hash = h.hexdigest()
+
+    def hash_dst(self):
+        self.dst_hash = file_hash(self.dst, algorithm=self.algorithm, buffer_size=self.BLOCK_SIZE)
+
+
+class CopyJob:
+
+    src: str
+    dst: str
+    size: int
+    hash: Optional[str]
+    error: Optional[str]
+
+    def __init__(self, src: str, dst: str):
+        self.src = src
+        self.dst = dst
+        self.size = os.path.getsize(src) if os.path.exists(src) else 0
+        self.hash = None
+        self.error = None
+
+
+class CopyScheduler:
+
+    MAX_WORKERS = 8
+    PER_SOURCE = 4  # concurrent copies reading from the same file system
+    PER_DESTINATION = 2  # concurrent copies writing to the same file system
+    PRINT_INTERVAL = 10  # seconds
+
+    jobs: List[CopyJob]
+    algorithm: str
+    verify: str
+    progress: Optional[Callable[[int, int, float], None]]
+    task: Task
+    max_workers: int
+    per_source: int
+    per_destination: int
+
+    total_bytes: int
+    copied_bytes: int
+    start: float
+    seconds: float
+    last_print: float
+    lock: threading.Lock
+    semaphores: Dict[Any, threading.Semaphore]
+
+    def main(
+            self,
+            jobs: List[Tuple[str, str]],
+            algorithm: str = 'blake2b',
+            verify: str = 'read-back',
+            progress: Optional[Callable[[int, int, float], None]] = None,
+            task: Optional[Task] = None,
+            max_workers: int = MAX_WORKERS,
+            per_source: int = PER_SOURCE,
+            per_destination: int = PER_DESTINATION) -> List[CopyJob]:
+        """
+        Copies (src, dst) pairs with a pool of workers, the largest files first.
+        Errors do not stop the other copies, they are kept in CopyJob.error.
+        At most per_source copies read from one file system and per_destination write to one,
+        e.g. per_destination=1 for a spinning disk.
+
+        The progress callback receives copied bytes, total bytes and elapsed seconds,
+        it is called from the worker threads. Cancelling the task stops the copies
+        at the next block, and their partial files are removed.
+        """
+        self.jobs = [CopyJob(src=src, dst=dst) for src, dst in jobs]
+        self.algorithm = algorithm
+        self.verify = verify
+        self.progress = progress
+        self.task = task or Task()
+        limits = {'max_workers': max_workers, 'per_source': per_source, 'per_destination': per_destination}
+        for name, value in limits.items():
+            assert value >= 1, f'{name} must be at least 1, got {value}'
+        self.max_workers = max_workers
+        self.per_source = per_source
+        self.per_destination = per_destination
+
+        self.total_bytes = sum(job.size for job in self.jobs)
+        self.copied_bytes = 0
+        self.lock = threading.Lock()
+        self.semaphores = {}
+
+        self.start = self.last_print = time.time()
+        largest_first = sorted(self.jobs, key=lambda job: job.size, reverse=True)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(self.copy, largest_first))
+        self.seconds = time.time() - self.start
+
+        print(self.summary(), flush=True)
+
+        return self.jobs
+
+    def copy(self, job: CopyJob):
+        src_lock = self.__get_semaphore(key=('src', file_system(job.src)), value=self.per_source)
+        dst_lock = self.__get_semaphore(key=('dst', file_system(job.dst)), value=self.per_destination)
+        with src_lock, dst_lock:  # always in the same order, so workers cannot deadlock
+            if self.task.is_cancelled():
+                job.error = f'Cancelled copying {basename(job.src)}'
+                return
+            print(f'Copying {job.src} -> {job.dst}', flush=True)
+            try:
+                job.hash = CopyFile().main(
+                    src=job.src,
+                    dst=job.dst,
+                    algorithm=self.algorithm,
+                    verify=self.verify,
+                    progress=self.__add_copied_bytes)
+            except Cancelled:
+                job.error = f'Cancelled copying {basename(job.src)}'
+            except Exception as e:
+                job.error = repr(e)
+
+    def __get_semaphore(self, key: Any, value: int) -> threading.Semaphore:
+        with self.lock:
+            if key not in self.semaphores:
+                self.semaphores[key] = threading.Semaphore(value)
+            return self.semaphores[key]
+
+    def __add_copied_bytes(self, n: int):
+        with self.lock:
+            self.copied_bytes += n
+            copied, now = self.copied_bytes, time.time()
+            print_now = now - self.last_print >= self.PRINT_INTERVAL
+            if print_now:
+                self.last_print = now
+
+        if print_now:
+            print(self.summary(), flush=True)
+        if self.progress is not None:
+            self.progress(copied, self.total_bytes, now - self.start)
+        self.task.update(copied / max(self.total_bytes, 1), self.summary())
+
+    def summary(self) -> str:
+        seconds = max(time.time() - self.start, 1e-9)
+        n_done = sum(job.hash is not None for job in self.jobs)
+        return (
+            f'Copied {n_done}/{len(self.jobs)} files, '
+            f'{self.copied_bytes / 1024 ** 3:.2f}/{self.total_bytes / 1024 ** 3:.2f} GB '
+            f'in {seconds:.0f} s ({self.copied_bytes / 1024 ** 2 / seconds:.1f} MB/s)'
+        )
+
+    def get_errors(self) -> List[str]:
+        return [job.error for job in self.jobs if job.error is not None]
+
+
+class PairFastqJobs:
+    """
+    Finds the R1 and R2 Fastq files of each sample by its Lab Sample ID,
+    and names the copies by the sample ID
+    """
+
+    fq_index: 'DirectoryIndex'
+    dst_dir: str
+    in_r1_suffix: str
+    in_r2_suffix: str
+    out_r1_suffix: str
+    out_r2_suffix: str
+
+    jobs: List[Tuple[str, str]]
+    errors: List[str]
+
+    def main(
+            self,
+            seq_ids: List[str],
+            lab_sample_ids: List[str],
+            fq_dir: str,
+            dst_dir: str,
+            in_r1_suffix: str,
+            in_r2_suffix: str,
+            out_r1_suffix: str,
+            out_r2_suffix: str) -> Tuple[List[Tuple[str, str]], List[str]]:
+
+        self.fq_index = get_directory_index(fq_dir)  # scan the directory once for all samples
+        self.dst_dir = dst_dir
+        self.in_r1_suffix = in_r1_suffix
+        self.in_r2_suffix = in_r2_suffix
+        self.out_r1_suffix = out_r1_suffix
+        self.out_r2_suffix = out_r2_suffix
+
+        self.jobs, self.errors = [], []
+        for seq_id, lab_sample_id in zip(seq_ids, lab_sample_ids):
+            self.add_paired_fastq_jobs(seq_id=seq_id, lab_sample_id=lab_sample_id)
+
+        return self.jobs, self.errors
+
+    def add_paired_fastq_jobs(self, seq_id: str, lab_sample_id: str):
+        fq1 = self.__get_src_fastq(lab_sample_id=lab_sample_id, suffix=self.in_r1_suffix)
+        fq2 = self.__get_src_fastq(lab_sample_id=lab_sample_id, suffix=self.in_r2_suffix)
+
+        if fq1 == '' or fq2 == '':
+            self.errors.append(f'Skip {seq_id} due to missing or multiple Fastq files for {lab_sample_id}')
+            return
+
+        self.__add_job(src=fq1, dst=f'{self.dst_dir}/{seq_id}{self.out_r1_suffix}')
+        self.__add_job(src=fq2, dst=f'{self.dst_dir}/{seq_id}{self.out_r2_suffix}')
+
+    def __get_src_fastq(self, lab_sample_id: str, suffix: str) -> str:
+        files = self.fq_index.find(
+            startswith=lab_sample_id,
+            endswith=suffix,
+            isfullpath=True
+        )
+        if len(files) == 0:
+            self.errors.append(f'No Fastq file found for {lab_sample_id}*{suffix}')
+            return ''
+        elif len(files) > 1:
+            self.errors.append(f'Multiple Fastq files found for {lab_sample_id}*{suffix}: {files}')
+            return ''
+        else:
+            return files[0]
+
+    def __add_job(self, src: str, dst: str):
+
+        if not exists(src):
+            self.errors.append(f'The source file "{basename(src)}" does not exist')
+            return
+
+        if exists(dst):
+            self.errors.append(f'The destination file "{basename(dst)}" already exists, skip')
+            return
+
+        self.jobs.append((src, dst))
+
+
+def file_system(path: str) -> Any:
+    d = dirname(abspath(path))
+    try:
+        return os.stat(d).st_dev
+    except OSError:
+        return d
+
+
+class DirectoryIndex:
+
+    directory: str
+    mtime_ns: int  # changes when files are added, removed or renamed in the directory
+    names: List[str]  # sorted names of the files, not sub-directories, directly in the directory
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.mtime_ns = os.stat(directory).st_mtime_ns
+        with os.scandir(directory) as entries:
+            self.names = sorted(e.name for e in entries if not e.is_dir())
+
+    def find(self, startswith: str = '', endswith: str = '', isfullpath: bool = False) -> List[str]:
+        ret = []
+        for i in range(bisect_left(self.names, startswith), len(self.names)):
+            name = self.names[i]
+            if not name.startswith(startswith):
+                break  # past the names sharing the prefix
+            if name.endswith(endswith):
+                ret.append(join(self.directory, name) if isfullpath else name)
+        return ret
+
+    def is_outdated(self) -> bool:
+        return os.stat(self.directory).st_mtime_ns != self.mtime_ns
+
+
+class CorrectionIndex:
+    """
+    Indexes the corrected Fastq file names by suffix, each group sorted for bisect on the prefix.
+    find() returns the same match as scanning the names in their original order.
+    """
+
+    suffix_to_names: Dict[str, List[str]]  # sorted names ending with the suffix
+    suffix_to_orders: Dict[str, List[int]]  # original positions of the sorted names
+
+    def __init__(self, names: Iterable[str], suffixes: List[str]):
+        groups = {suffix: [] for suffix in suffixes}
+        for i, name in enumerate(names):
+            for suffix in suffixes:
+                if name.endswith(suffix):
+                    groups[suffix].append((name, i))
+
+        self.suffix_to_names, self.suffix_to_orders = {}, {}
+        for suffix, group in groups.items():
+            group.sort()
+            self.suffix_to_names[suffix] = [name for name, _ in group]
+            self.suffix_to_orders[suffix] = [i for _, i in group]
+
+    def find(self, prefix: str, suffix: str) -> Tuple[Optional[str], int]:
+        """
+        Returns the first name starting with the prefix, None if not found,
+        and the number of distinct names matched, more than one is ambiguous
+        """
+        assert suffix in self.suffix_to_names, f'Suffix "{suffix}" was not indexed'
+        names, orders = self.suffix_to_names[suffix], self.suffix_to_orders[suffix]
+
+        first, first_order, previous, n = None, -1, None, 0
+        for i in range(bisect_left(names, prefix), len(names)):
+            name = names[i]
+            if not name.startswith(prefix):
+                break  # past the names sharing the prefix
+            if name != previous:
+                n += 1  # identical names listed more than once are not ambiguous
+                previous = name
+            if first is None or orders[i] < first_order:
+                first, first_order = name, orders[i]
+        return first, n
+
+
+READ_CHUNK_SIZE = 4 * 1024 ** 2  # characters
+
+
+def read_file_names(file: str, suffixes: Tuple[str, ...] = ('',), chunk_size: int = READ_CHUNK_SIZE) -> Iterator[str]:
+    """
+    Yields the names separated by spaces, tabs or new lines in the file, e.g. the output of md5sum or ls,
+    keeping only those ending with one of the suffixes. The file is read in chunks, never held in memory at once.
+    """
+    rest = ''
+    with open(file) as fh:  # text mode reads \r\n and \r as \n
+        while True:
+            chunk = fh.read(chunk_size)
+            if chunk == '':
+                break
+            names = (rest + chunk).replace('\t', ' ').replace('\n', ' ').split(' ')
+            rest = names.pop()  # may continue in the next chunk
+            yield from [name for name in names if name.endswith(suffixes) and name != '']
+    if rest != '' and rest.endswith(suffixes):
+        yield rest
+
+
+DIRECTORY_INDEXES: Dict[str, DirectoryIndex] = {}
+DIRECTORY_INDEXES_LOCK = threading.Lock()
+
+
+def get_directory_index(directory: str) -> DirectoryIndex:
+    """
+    Returns the cached index of the directory, re-scanned only if the directory was modified
+    """
+    with DIRECTORY_INDEXES_LOCK:
+        index = DIRECTORY_INDEXES.get(directory)
+        if index is None or index.is_outdated():
+            index = DirectoryIndex(directory)
+            DIRECTORY_INDEXES[directory] = index
+        return index
+
+
+def file_hash(file_path: str, algorithm: str = 'blake2b', buffer_size: int = 8 * 1024 ** 2) -> str:
+    h = hashlib.new(algorithm)
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    with open(file_path, 'rb') as f:
+        while True:
+            n = f.readinto(buffer)
+            if n == 0:
+                break
+            h.update(view[:n])
+    return h.hexdigest()
+
+
+def drop_page_cache(fd: int):
+    if hasattr(os, 'posix_fadvise'):  # not available on Windows and macOS
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
@@ -0,0 +1,317 @@
+import sys
+import numpy as np
+import pandas as pd
+from typing import List, Tuple, Any, Optional
+
+
+class Delta:
+    """
+    A change of the sequencing table that can be undone.
+
+    Applying a delta returns the changed dataframe together with the inverse delta,
+    so undo and redo both just apply whatever delta is on top of the stack.
+    """
+
+    nbytes: int  # memory held by the delta, used to keep the undo/redo history within a budget
+
+    def apply(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, 'Delta']:
+        raise NotImplementedError
+
+    def events(self) -> List['ChangeEvent']:
+        return [TableReset()]
+
+
+class CellPatch(Delta):
+
+    rows: np.ndarray  # row positions
+    column: str
+    values: Any  # a scalar or one value per row
+    dtype: Optional[Any]  # the column dtype to restore after patching, None to keep whatever results
+
+    def __init__(self, rows: np.ndarray, column: str, values: Any, dtype: Optional[Any] = None):
+        self.rows = np.asarray(rows, dtype='int64')
+        self.column = column
+        self.values = values
+        self.dtype = dtype
+        if isinstance(values, np.ndarray):
+            self.nbytes = self.rows.nbytes + int(pd.Series(values).memory_usage(index=False, deep=True))
+        else:
+            self.nbytes = self.rows.nbytes + sys.getsizeof(values)
+
+    def apply(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, Delta]:
+        j = df.columns.get_loc(self.column)
+        old_dtype = df[self.column].dtype
+        old_values = df.iloc[self.rows, j].to_numpy(copy=True)
+
+        if isinstance(old_dtype, pd.CategoricalDtype):
+            df[self.column] = add_categories(df[self.column], new=self.values)
+
+        try:
+            df.iloc[self.rows, j] = self.values
+        except (TypeError, ValueError):  # the value does not fit the dtype, e.g. text in an integer column
+            column = df[self.column].astype(object)
+            column.iloc[self.rows] = self.values
+            df[self.column] = column
+
+        if self.dtype is not None and df[self.column].dtype != self.dtype:
+            df[self.column] = astype(df[self.column], dtype=self.dtype)
+
+        return df, CellPatch(rows=self.rows, column=self.column, values=old_values, dtype=old_dtype)
+
+    def events(self) -> List['ChangeEvent']:
+        return [CellsChanged(rows=self.rows, column=self.column)]
+
+
+class RowInsert(Delta):
+
+    positions: np.ndarray  # sorted row positions of the inserted rows in the resulting dataframe
+    rows: pd.DataFrame
+    dtypes: Optional[pd.Series]  # the columns and dtypes to restore after inserting
+
+    def __init__(self, positions: np.ndarray, rows: pd.DataFrame, dtypes: Optional[pd.Series] = None):
+        self.positions = np.asarray(positions, dtype='int64')
+        self.rows = rows.reset_index(drop=True)
+        self.dtypes = dtypes
+        self.nbytes = self.positions.nbytes + int(self.rows.memory_usage(index=False, deep=True).sum())
+
+    def apply(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, Delta]:
+        n = len(df) + len(self.rows)
+        new = concat(df=df, rows=self.rows)
+
+        if not np.array_equal(self.positions, np.arange(len(df), n)):  # not appended at the end
+            inserted = np.zeros(n, dtype=bool)
+            inserted[self.positions] = True
+            order = np.empty(n, dtype='int64')
+            order[~inserted] = np.arange(len(df))
+            order[inserted] = np.arange(len(df), n)
+            new = new.take(order).reset_index(drop=True)
+
+        new = restore_dtypes(df=new, dtypes=self.dtypes)
+
+        return new, RowDelete(positions=self.positions, dtypes=df.dtypes)
+
+    def events(self) -> List['ChangeEvent']:
+        return [RowsInserted(positions=self.positions)]
+
+
+class RowDelete(Delta):
+
+    positions: np.ndarray  # sorted row positions to delete
+    dtypes: Optional[pd.Series]
+
+    def __init__(self, positions: np.ndarray, dtypes: Optional[pd.Series] = None):
+        self.positions = np.unique(np.asarray(positions, dtype='int64'))
+        self.dtypes = dtypes
+        self.nbytes = self.positions.nbytes
+
+    def apply(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, Delta]:
+        rows = df.take(self.positions)
+
+        kept = np.ones(len(df), dtype=bool)
+        kept[self.positions] = False
+        new = df[kept].reset_index(drop=True)
+        new = restore_dtypes(df=new, dtypes=self.dtypes)
+
+        return new, RowInsert(positions=self.positions, rows=rows, dtypes=df.dtypes)
+
+    def events(self) -> List['ChangeEvent']:
+        return [RowsRemoved(positions=self.positions)]
+
+
+class Permutation(Delta):
+
+    order: np.ndarray  # the i-th row of the result is the order[i]-th row of the original
+
+    def __init__(self, order: np.ndarray):
+        self.order = np.asarray(order, dtype='int64')
+        self.nbytes = self.order.nbytes
+
+    def apply(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, Delta]:
+        new = df.take(self.order).reset_index(drop=True)
+        return new, Permutation(order=np.argsort(self.order, kind='stable'))
+
+    def events(self) -> List['ChangeEvent']:
+        return [RowsPermuted(order=self.order)]
+
+
+class ColumnDelete(Delta):
+
+    columns: List[str]
+
+    def __init__(self, columns: List[str]):
+        self.columns = list(columns)
+        self.nbytes = sum(sys.getsizeof(c) for c in self.columns)
+
+    def apply(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, Delta]:
+        positions = [df.columns.get_loc(c) for c in self.columns]
+        data = df[self.columns]
+        new = df.drop(columns=self.columns)
+        return new, ColumnInsert(positions=positions, data=data)
+
+
+class ColumnInsert(Delta):
+
+    positions: List[int]  # column positions in the resulting dataframe
+    data: pd.DataFrame
+
+    def __init__(self, positions: List[int], data: pd.DataFrame):
+        self.positions = list(positions)
+        self.data = data
+        self.nbytes = int(data.memory_usage(index=False, deep=True).sum())
+
+    def apply(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, Delta]:
+        new = df.copy(deep=False)
+        for pos, column in sorted(zip(self.positions, self.data.columns)):
+            new.insert(pos, column, self.data[column].set_axis(new.index))
+        return new, ColumnDelete(columns=list(self.data.columns))
+
+
+class Replace(Delta):
+    """
+    A full checkpoint, only used when the whole table changes, e.g. reading or resetting the table
+    """
+
+    dataframe: pd.DataFrame
+
+    def __init__(self, dataframe: pd.DataFrame):
+        self.dataframe = dataframe
+        self.nbytes = int(dataframe.memory_usage(index=True, deep=True).sum())
+
+    def apply(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, Delta]:
+        return self.dataframe, Replace(dataframe=df)
+
+
+class Compound(Delta):
+
+    deltas: List[Delta]
+
+    def __init__(self, deltas: List[Delta]):
+        self.deltas = list(deltas)
+        self.nbytes = sum(d.nbytes for d in self.deltas)
+
+    def apply(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, Delta]:
+        inverses = []
+        try:
+            for delta in self.deltas:
+                df, inverse = delta.apply(df)
+                inverses.append(inverse)
+        except Exception:
+            for inverse in reversed(inverses):  # roll back, all or nothing
+                df, _ = inverse.apply(df)
+            raise
+        return df, Compound(deltas=inverses[::-1])
+
+    def events(self) -> List['ChangeEvent']:
+        return [e for d in self.deltas for e in d.events()]
+
+
+class ChangeEvent:
+    """
+    Tells the view which part of the sequencing table has changed, so it only redraws that part
+    """
+    pass
+
+
+class CellsChanged(ChangeEvent):
+
+    rows: np.ndarray
+    column: str
+
+    def __init__(self, rows: np.ndarray, column: str):
+        self.rows = rows
+        self.column = column
+
+
+class RowsInserted(ChangeEvent):
+
+    positions: np.ndarray  # sorted row positions after inserting
+
+    def __init__(self, positions: np.ndarray):
+        self.positions = positions
+
+
+class RowsRemoved(ChangeEvent):
+
+    positions: np.ndarray  # sorted row positions before removing
+
+    def __init__(self, positions: np.ndarray):
+        self.positions = positions
+
+
+class RowsPermuted(ChangeEvent):
+
+    order: np.ndarray
+
+    def __init__(self, order: np.ndarray):
+        self.order = order
+
+
+class TableReset(ChangeEvent):
+    pass
+
+
+def count_touched_rows(delta: Delta, n_before: int, n_after: int) -> int:
+    """
+    Rows changed by the delta, given the number of rows of the table before and after applying it
+    """
+    if isinstance(delta, Compound):
+        return sum(count_touched_rows(d, n_before=n_before, n_after=n_after) for d in delta.deltas)
+    elif isinstance(delta, CellPatch):
+        return len(delta.rows)
+    elif isinstance(delta, (RowInsert, RowDelete)):
+        return len(delta.positions)
+    elif isinstance(delta, Permutation):
+        return int(np.count_nonzero(delta.order != np.arange(len(delta.order))))
+    else:  # whole columns or the whole table
+        return max(n_before, n_after)
+
+
+def restore_dtypes(df: pd.DataFrame, dtypes: Optional[pd.Series]) -> pd.DataFrame:
+    if dtypes is None:
+        return df
+    if list(df.columns) != list(dtypes.index):
+        df = df.reindex(columns=dtypes.index)
+    for column, dtype in dtypes.items():
+        if df[column].dtype != dtype:
+            df[column] = astype(df[column], dtype=dtype)
+    return df
+
+
+def astype(values: pd.Series, dtype: Any) -> pd.Series:
+    """
+    Same as Series.astype, except that values missing from the categories of a categorical dtype
+    are added to the categories instead of becoming nan
+    """
+    if isinstance(dtype, pd.CategoricalDtype):
+        dtype = pd.CategoricalDtype(categories=union_categories(dtype.categories, values=values))
+    return values.astype(dtype)
+
+
+def add_categories(values: pd.Series, new: Any) -> pd.Series:
+    categories = union_categories(values.cat.categories, values=new)
+    if len(categories) == len(values.cat.categories):
+        return values
+    return values.cat.set_categories(categories)
+
+
+def union_categories(categories: pd.Index, values: Any) -> pd.Index:
+    if isinstance(values, pd.Series) and isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.cat.remove_unused_categories().cat.categories
+    values = pd.Index(np.ravel(np.asarray(values, dtype=object)))
+    new = values[~values.isin(categories) & values.notna()].unique()
+    return categories if len(new) == 0 else categories.append(new)
+
+
+def concat(df: pd.DataFrame, rows: pd.DataFrame) -> pd.DataFrame:
+    """
+    pd.concat turns categorical columns into objects unless both sides have the same categories
+    """
+    rows = rows.copy(deep=False)
+    df = df.copy(deep=False)
+    for column in df.columns.intersection(rows.columns):
+        a, b = df[column], rows[column]
+        if isinstance(a.dtype, pd.CategoricalDtype) and a.dtype != b.dtype:
+            dtype = pd.CategoricalDtype(categories=union_categories(a.cat.categories, values=b))
+            df[column] = a.cat.set_categories(dtype.categories)
+            rows[column] = b.astype(dtype)
+    return pd.concat([df, rows], ignore_index=True)
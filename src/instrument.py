@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import inspect
+import cProfile
+import functools
+import threading
+from collections import deque
+from os.path import join, getsize, isfile
+from typing import List, Dict, Any, Optional, Callable, Tuple
+
+
+class Instrumentation:
+    """
+    Records each call of the instrumented functions, i.e. the controller actions and the Model operations,
+    in a ring buffer of the latest MAX_RECORDS, and optionally in a JSON-lines log.
+
+    Set by environment variables:
+        SEQSUI_LOG: the JSON-lines log, appended with every record
+        SEQSUI_PROFILE: the name of one instrumented function, e.g. "Model.sort_dataframe" or "ActionUndo",
+            each call of it is profiled with cProfile and dumped as a pstats file into SEQSUI_PROFILE_DIR
+    """
+
+    MAX_RECORDS = 10000
+
+    records: deque
+    log_file: Optional[str]
+    profile_name: Optional[str]
+    profile_dir: str
+    profiling: bool  # only one profiler can be active
+    lock: threading.Lock
+
+    def __init__(self, log_file: Optional[str] = None, profile_name: Optional[str] = None, profile_dir: str = '.'):
+        self.records = deque(maxlen=self.MAX_RECORDS)
+        self.log_file = log_file
+        self.profile_name = profile_name
+        self.profile_dir = profile_dir
+        self.profiling = False
+        self.lock = threading.Lock()
+
+    def call(
+            self,
+            name: str,
+            fn: Callable,
+            signature: inspect.Signature,
+            reads: Tuple[str, ...],
+            writes: Tuple[str, ...],
+            args: tuple,
+            kwargs: dict) -> Any:
+
+        arguments = signature.bind(*args, **kwargs).arguments
+        model = get_model(args[0]) if len(args) > 0 else None
+        version, rows_touched = (model.version, model.rows_touched) if model is not None else (0, 0)
+        bytes_read = sum(file_size(arguments.get(a)) for a in reads)
+
+        error = None
+        start = time.time()
+        try:
+            return self.__run(name=name, fn=fn, args=args, kwargs=kwargs)
+        except BaseException as e:
+            error = repr(e)
+            raise
+        finally:
+            record = {
+                'name': name,
+                'start': start,
+                'seconds': time.time() - start,
+                'thread': threading.current_thread().name,
+                'bytes_read': bytes_read,
+                'bytes_written': sum(file_size(arguments.get(a)) for a in writes),
+                'error': error,
+            }
+            if model is not None:
+                record.update({
+                    'rows': len(model.dataframe),
+                    'rows_touched': model.rows_touched - rows_touched if model.version != version else 0,
+                    'undo_steps': len(model.undo_cache),
+                    'undo_bytes': model.undo_bytes + model.redo_bytes,
+                })
+            self.record(record)
+
+    def __run(self, name: str, fn: Callable, args: tuple, kwargs: dict) -> Any:
+        if name != self.profile_name or self.profiling:
+            return fn(*args, **kwargs)
+
+        self.profiling = True
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(fn, *args, **kwargs)
+        finally:
+            self.profiling = False
+            file = join(self.profile_dir, f'{name}-{time.strftime("%Y%m%d-%H%M%S")}.prof')
+            profiler.dump_stats(file)
+            print(f'Profile of "{name}" saved to "{file}", view it with: python -m pstats {file}', flush=True)
+
+    def record(self, record: Dict[str, Any]):
+        self.records.append(record)
+        if self.log_file is None:
+            return
+        line = json.dumps(record, default=str) + '\n'
+        with self.lock:
+            with open(self.log_file, 'a') as fh:
+                fh.write(line)
+
+    def get_records(self, name: Optional[str] = None) -> List[Dict[str, Any]]:
+        return [r for r in list(self.records) if name is None or r['name'] == name]
+
+    def clear(self):
+        self.records.clear()
+
+    def summary(self) -> str:
+        name_to_seconds = {}
+        for r in self.get_records():
+            name_to_seconds.setdefault(r['name'], []).append(r['seconds'])
+        lines = [f'{"name":<40}{"calls":>8}{"total (s)":>12}{"max (s)":>12}']
+        for name, seconds in sorted(name_to_seconds.items(), key=lambda x: -sum(x[1])):
+            lines.append(f'{name:<40}{len(seconds):>8}{sum(seconds):>12.3f}{max(seconds):>12.3f}')
+        return '\n'.join(lines)
+
+
+def instrumented(
+        name: Optional[str] = None,
+        reads: Tuple[str, ...] = (),
+        writes: Tuple[str, ...] = ()) -> Callable[[Callable], Callable]:
+    """
+    Records the calls of the decorated function, named by its qualified name by default.
+    reads and writes name the arguments that are file paths, whose sizes are recorded as bytes read and written.
+    """
+    def decorator(fn: Callable) -> Callable:
+        signature = inspect.signature(fn)
+        n = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            return INSTRUMENTATION.call(
+                name=n, fn=fn, signature=signature, reads=reads, writes=writes, args=args, kwargs=kwargs)
+
+        wrapper.instrumented = True
+        return wrapper
+
+    return decorator
+
+
+def get_model(obj: Any) -> Optional[Any]:
+    """
+    The Model itself, or the Model of an action
+    """
+    model = getattr(obj, 'model', obj)
+    return model if hasattr(model, 'undo_cache') and hasattr(model, 'rows_touched') else None
+
+
+def file_size(file: Any) -> int:
+    return getsize(file) if isinstance(file, str) and isfile(file) else 0
+
+
+INSTRUMENTATION = Instrumentation(
+    log_file=os.environ.get('SEQSUI_LOG'),
+    profile_name=os.environ.get('SEQSUI_PROFILE'),
+    profile_dir=os.environ.get('SEQSUI_PROFILE_DIR', '.'))
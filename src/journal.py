@@ -0,0 +1,274 @@
+import os
+import hmac
+import time
+import pickle
+import struct
+import hashlib
+import threading
+import pandas as pd
+from os.path import exists, basename, expanduser, join, dirname
+from typing import List, Tuple, Optional, Dict, Any, BinaryIO
+from .history import Delta
+
+
+class Journal:
+    """
+    An append-only file of the deltas applied to the table since it was last read or saved,
+    kept next to the table file, e.g. "sequencing_table.csv.journal",
+    so unsaved edits can be replayed after a crash.
+
+    The first record is a header naming the base file the deltas apply to, i.e. the table file itself,
+    or a snapshot written by compaction. Each record is its length, an HMAC of the pickled object and the object.
+    The HMAC key is private to the user, so a journal written by anyone else, e.g. next to a shared table,
+    is never unpickled. A journal that cannot be decoded is ignored and dropped.
+    """
+
+    FSYNC_POLICIES = [
+        'always',  # fsync every record, nothing is lost but each edit waits for the disk
+        'interval',  # fsync at most once per FSYNC_INTERVAL, a crash loses up to that many seconds
+        'never',  # only flush, the OS decides when to write
+    ]
+    FSYNC_INTERVAL = 1.0  # seconds
+    COMPACT_BYTES = 64 * 1024 ** 2  # the journal is compacted into a snapshot beyond this size
+    LENGTH = struct.Struct('<Q')
+    KEY_FILE = join(expanduser('~'), '.seqsui', 'journal.key')
+    DIGEST = hashlib.sha256
+
+    table_file: str
+    file: str
+    fsync: str
+
+    handle: Optional[BinaryIO]
+    nbytes: int  # size of the journal file
+    generation: int  # number of snapshots written, snapshot files are never overwritten
+    last_fsync: float
+    compacting: bool
+    lock: threading.Lock  # the handle is shared with the compaction thread
+
+    def __init__(self, table_file: str, fsync: str = 'interval'):
+        assert fsync in self.FSYNC_POLICIES, f'fsync must be one of {self.FSYNC_POLICIES}, got "{fsync}"'
+        self.table_file = table_file
+        self.file = f'{table_file}.journal'
+        self.fsync = fsync
+        self.handle = None
+        self.nbytes = 0
+        self.generation = 0
+        self.last_fsync = 0.
+        self.compacting = False
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts a new journal over the table file as it is now, previous records and snapshots are dropped
+        """
+        with self.lock:
+            old_snapshot = self.__read_base()
+            self.__write(header=self.__header(base=self.table_file), tail=b'')
+            self.__remove_snapshot(old_snapshot)
+
+    def resume(self):
+        """
+        Keeps appending to the existing journal, after its records were replayed.
+        Starts a new one if the journal cannot be decoded.
+        """
+        with self.lock:
+            header, _, end = self.__read_records()
+            if len(header) == 0:
+                print(f'WARNING: "{basename(self.file)}" cannot be decoded, started again', flush=True)
+                self.__write(header=self.__header(base=self.table_file), tail=b'')
+                return
+            self.generation = header.get('generation', 0)
+            with open(self.file, 'rb') as fh:
+                head = fh.read(end)
+            self.__write(header=None, tail=head)  # drops a record truncated by a crash
+
+    def load(self) -> Optional[Tuple[str, List[Delta]]]:
+        """
+        The base file and the deltas to replay over it, None if there is no usable journal,
+        i.e. none, one that cannot be decoded or read, or one whose base was modified since
+        """
+        if not exists(self.file):
+            return None
+        try:
+            header, deltas, _ = self.__read_records()
+        except OSError as e:
+            print(f'WARNING: "{basename(self.file)}" cannot be read, ignored: {e!r}', flush=True)
+            return None
+        if len(header) == 0:
+            print(f'WARNING: "{basename(self.file)}" cannot be decoded, ignored', flush=True)
+            return None
+        base = header.get('base')
+        if base is None or not exists(base) or stamp(base) != header.get('stamp') \
+                or (base != self.table_file and file_digest(base) != header.get('digest')):
+            print(f'WARNING: "{basename(self.file)}" does not match "{basename(str(base))}", ignored', flush=True)
+            return None
+        return base, deltas
+
+    def append(self, delta: Delta):
+        record = self.__record(delta)
+        with self.lock:
+            assert self.handle is not None, f'Journal "{self.file}" is not started'
+            self.handle.write(record)
+            self.handle.flush()
+            self.nbytes += len(record)
+            self.__fsync(force=self.fsync == 'always')
+
+    def needs_compaction(self) -> bool:
+        return not self.compacting and self.nbytes > self.COMPACT_BYTES
+
+    def tell(self) -> int:
+        with self.lock:
+            return self.nbytes
+
+    def compact_in_background(self, dataframe: pd.DataFrame):
+        """
+        The dataframe must be the table after the last appended record, and not be modified afterwards
+        """
+        self.compacting = True
+        threading.Thread(target=self.compact, args=(dataframe, self.tell()), daemon=True).start()
+
+    def compact(self, dataframe: pd.DataFrame, offset: int):
+        """
+        Writes the dataframe, which is the table at the given journal offset, as the new base,
+        and keeps only the records after the offset. Meant to run in a background thread.
+        """
+        try:
+            self.generation += 1
+            snapshot = f'{self.file}.{self.generation}.pkl'
+            dataframe.to_pickle(snapshot)
+            with self.lock:
+                if self.handle is None:  # closed or restarted meanwhile
+                    remove(snapshot)
+                    return
+                old_snapshot = self.__read_base()
+                with open(self.file, 'rb') as fh:
+                    fh.seek(offset)
+                    tail = fh.read()
+                self.__write(header=self.__header(base=snapshot), tail=tail)
+                self.__remove_snapshot(old_snapshot)
+            print(f'Compacted "{basename(self.file)}" into "{basename(snapshot)}"', flush=True)
+        finally:
+            self.compacting = False
+
+    def close(self, delete: bool = False):
+        with self.lock:
+            snapshot = self.__read_base()
+            if self.handle is not None:
+                self.handle.close()
+                self.handle = None
+            if delete:
+                remove(self.file)
+                self.__remove_snapshot(snapshot)
+
+    def __header(self, base: str) -> Dict[str, Any]:
+        ret = {'base': base, 'stamp': stamp(base), 'generation': self.generation}
+        if base != self.table_file:
+            ret['digest'] = file_digest(base)  # snapshots are unpickled too, so they are authenticated by the header
+        return ret
+
+    def __record(self, obj: Any) -> bytes:
+        data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+        mac = hmac.new(get_key(self.KEY_FILE), data, self.DIGEST).digest()
+        return self.LENGTH.pack(len(data)) + mac + data
+
+    def __remove_snapshot(self, snapshot: Optional[str]):
+        if snapshot is not None and snapshot.startswith(f'{self.file}.'):  # never anything else named by a header
+            remove(snapshot)
+
+    def __write(self, header: Optional[Dict[str, Any]], tail: bytes):
+        """
+        Replaces the journal file atomically, the header is already in the tail if None
+        """
+        if self.handle is not None:
+            self.handle.close()
+        temp = f'{self.file}.tmp'
+        with open(temp, 'wb') as fh:
+            if header is not None:
+                fh.write(self.__record(header))
+            fh.write(tail)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(temp, self.file)
+        self.handle = open(self.file, 'ab')
+        self.nbytes = self.handle.tell()
+        self.last_fsync = time.time()
+
+    def __fsync(self, force: bool):
+        now = time.time()
+        if force or (self.fsync == 'interval' and now - self.last_fsync > self.FSYNC_INTERVAL):
+            os.fsync(self.handle.fileno())
+            self.last_fsync = now
+
+    def __read_base(self) -> Optional[str]:
+        if not exists(self.file):
+            return None
+        header, _, _ = self.__read_records(header_only=True)
+        return header.get('base')
+
+    def __read_records(self, header_only: bool = False) -> Tuple[Dict[str, Any], List[Delta], int]:
+        """
+        The header, the deltas and the end of the last valid record. Reading stops at the first record
+        cut short or garbled by a crash, or not authenticated, and the header is {} if it is not valid.
+        """
+        key = get_key(self.KEY_FILE)
+        mac_size = self.DIGEST().digest_size
+        objects = []
+        end = 0
+        with open(self.file, 'rb') as fh:
+            size = os.fstat(fh.fileno()).st_size
+            while not (header_only and len(objects) == 1):
+                prefix = fh.read(self.LENGTH.size)
+                if len(prefix) < self.LENGTH.size:
+                    break
+                n = self.LENGTH.unpack(prefix)[0]
+                if n > size - fh.tell() - mac_size:  # cut short, or a garbage length
+                    break
+                mac, data = fh.read(mac_size), fh.read(n)
+                if not hmac.compare_digest(mac, hmac.new(key, data, self.DIGEST).digest()):
+                    break
+                try:
+                    obj = pickle.loads(data)
+                except Exception:  # e.g. written by an incompatible version
+                    break
+                if len(objects) == 0 and not isinstance(obj, dict):
+                    break
+                objects.append(obj)
+                end = fh.tell()
+        if len(objects) == 0:
+            return {}, [], 0
+        return objects[0], objects[1:], end
+
+
+def get_key(file: str) -> bytes:
+    """
+    The HMAC key of the user, created on first use and readable only by the user
+    """
+    if not exists(file):
+        os.makedirs(dirname(file), exist_ok=True)
+        try:
+            fd = os.open(file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:  # created by another process meanwhile
+            pass
+        else:
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(os.urandom(32))
+    with open(file, 'rb') as fh:
+        return fh.read()
+
+
+def file_digest(file: str) -> str:
+    h = hashlib.sha256()
+    with open(file, 'rb') as fh:
+        for block in iter(lambda: fh.read(1024 ** 2), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def stamp(file: str) -> Tuple[int, int]:
+    s = os.stat(file)
+    return s.st_mtime_ns, s.st_size
+
+
+def remove(file: str):
+    if exists(file):
+        os.remove(file)
@@ -0,0 +1,41 @@
+import os
+import sys
+from PyQt5.QtWidgets import QApplication
+from .view import View
+from .model import Model
+from .controller import Controller
+from . import VERSION, STARTING_MESSAGE
+
+
+class Main:
+
+    APP_ID = f'NYCU.Dentistry.SeqsUI.{VERSION}'
+
+    model: Model
+    view: View
+    controller: Controller
+
+    def main(self):
+        self.config_taskbar_icon()
+
+        app = QApplication(sys.argv)
+
+        max_memory_mb = os.environ.get('SEQSUI_MAX_MEMORY_MB')
+        self.model = Model(
+            journal_fsync='interval',
+            max_memory_bytes=int(max_memory_mb) * 1024 ** 2 if max_memory_mb else Model.MAX_MEMORY_BYTES)
+        self.view = View(self.model)
+        self.controller = Controller(self.model, self.view)
+
+        print(STARTING_MESSAGE, flush=True)
+
+        exit_code = app.exec_()
+        self.model.close_journal()  # unsaved edits are recovered only after a crash
+        sys.exit(exit_code)
+
+    def config_taskbar_icon(self):
+        try:
+            from ctypes import windll  # only exists on Windows
+            windll.shell32.SetCurrentProcessExplicitAppUserModelID(self.APP_ID)
+        except ImportError as e:
+            print(e, flush=True)
@@ -1,7 +1,20 @@
+import sys
+import time
+import threading
+import numpy as np
 import pandas as pd
 from datetime import date
-from os.path import basename
-from typing import List, Optional, Tuple, Any
+from collections import Counter
+from operator import itemgetter
+from os.path import basename, abspath, exists
+from importlib.util import find_spec
+from typing import List, Optional, Tuple, Any, Dict, Callable
+from .history import Delta, CellPatch, RowInsert, RowDelete, Permutation, ColumnDelete, Replace, Compound, \
+    ChangeEvent, count_touched_rows
+from .tasks import Task
+from .cache import REFERENCE_CACHE
+from .fastq import CorrectionIndex, read_file_names
+from .instrument import instrumented
 
 
 HOSPITAL_RESEARCH_CENTER_TO_CODE = {
@@ -76,107 +89,489 @@ SEQUENCING_TABLE_COLUMNS = [
     VIAL_SEQUENCING_NUMBER,
     SEQUENCING_BATCH_ID,
 ]
+SEQUENCING_TABLE_DTYPES = {
+    ID: 'str',
+    PATIENT_ID: 'Int64',
+    PATIENT_SEQUENCING_NUMBER: 'Int64',
+    IMPORT_DATE: 'datetime64[ns]',
+    HOSPITAL_RESEARCH_CENTER: 'category',  # a handful of distinct values repeated over all rows
+    LAB: 'category',
+    LAB_PATIENT_ID: 'str',
+    LAB_SAMPLE_ID: 'str',
+    CANCER_TYPE: 'category',
+    TISSUE_TYPE: 'category',
+    SEQUENCING_TYPE: 'category',
+    VIAL: 'category',
+    VIAL_SEQUENCING_NUMBER: 'Int64',
+    SEQUENCING_BATCH_ID: 'category',
+}
+
+
+CSV_ENGINES = (['pyarrow'] if find_spec('pyarrow') else []) + ['c']  # fastest first
+EXCEL_ENGINES = (['calamine'] if find_spec('python_calamine') else []) + ['openpyxl']
+PARSE_DTYPES = ['str', 'category']  # can be given to the parser, any text fits them
+SNAPSHOT_EXTENSIONS = [
+    '.feather',  # uncompressed Arrow, memory-mapped when read, needs pyarrow
+    '.parquet',  # compressed, needs pyarrow
+    '.pkl',  # pickle, no extra dependency, only open pickle files saved by yourself
+]
+MAPPING_KEYS = [ID, LAB_SAMPLE_ID]  # a mapping file is keyed by the first of them it has
+STORE_EXTENSIONS = ['.sqlite', '.db']  # SQLite, saving after imports only inserts the new rows
+SEQUENCING_TABLE_INDEXES = {
+    'idx_id': [ID],
+    'idx_sample_key': [LAB, LAB_PATIENT_ID, LAB_SAMPLE_ID],
+    'idx_patient_id': [PATIENT_ID],
+}
 
 
 class Model:
 
-    MAX_UNDO = 100
+    MAX_UNDO_BYTES = 512 * 1024 ** 2  # default memory budget of the undo and redo history
+    MAX_MEMORY_BYTES = 4 * 1024 ** 3  # default ceiling of the table, its index and the history together
 
     dataframe: pd.DataFrame  # this is the main sequencing table
 
-    undo_cache: List[pd.DataFrame]
-    redo_cache: List[pd.DataFrame]
+    undo_cache: List[Delta]  # each delta undoes one edit
+    redo_cache: List[Delta]
+    undo_bytes: int  # sum of nbytes of the undo_cache, kept as deltas are pushed and popped
+    redo_bytes: int
+
+    max_undo_bytes: int  # the oldest history is evicted first when the history is above
+    max_memory_bytes: int  # or when the memory usage is above
+    column_bytes: Dict[str, int]  # deep memory of each column, measured again only after the column changed
+
+    index: Optional['SequencingTableIndex']  # None when it needs to be rebuilt from the dataframe
+
+    listeners: List[Callable[[ChangeEvent], None]]
+
+    lock: threading.RLock  # held only while an edit is committed, so the view can keep reading during long tasks
+
+    version: int  # incremented by every change of the dataframe
+    rows_touched: int  # rows changed by all edits, undo and redo so far
+    store_file: Optional[str]  # the SQLite file the table was last read from or saved to
+    store_rows: Optional[int]  # number of leading rows of the dataframe same as in the store, None if unknown
 
-    def __init__(self):
-        self.dataframe = pd.DataFrame(columns=SEQUENCING_TABLE_COLUMNS)
+    journal_fsync: Optional[str]  # one of Journal.FSYNC_POLICIES, None to keep no journal
+    journal: Optional['Journal']  # edits since the table file was read or saved
+
+    def __init__(
+            self,
+            journal_fsync: Optional[str] = None,
+            max_undo_bytes: int = MAX_UNDO_BYTES,
+            max_memory_bytes: int = MAX_MEMORY_BYTES):
+        self.dataframe = empty_sequencing_table()
         self.undo_cache = []
         self.redo_cache = []
-
+        self.undo_bytes = 0
+        self.redo_bytes = 0
+        self.max_undo_bytes = max_undo_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self.column_bytes = {}
+        self.index = None
+        self.listeners = []
+        self.lock = threading.RLock()
+        self.version = 0
+        self.rows_touched = 0
+        self.store_file = None
+        self.store_rows = None
+        self.journal_fsync = journal_fsync
+        self.journal = None
+
+    def add_listener(self, listener: Callable[[ChangeEvent], None]):
+        self.listeners.append(listener)
+
+    @instrumented()
     def undo(self):
-        if len(self.undo_cache) == 0:
+        with self.lock:
+            if len(self.undo_cache) == 0:
+                return
+            inverse = self.__apply(self.undo_cache[-1])
+            self.undo_bytes -= self.undo_cache.pop().nbytes
+            self.redo_cache.append(inverse)
+            self.redo_bytes += inverse.nbytes
+            self.__trim_history()
+
+    @instrumented()
+    def redo(self):
+        with self.lock:
+            if len(self.redo_cache) == 0:
+                return
+            inverse = self.__apply(self.redo_cache[-1])
+            self.redo_bytes -= self.redo_cache.pop().nbytes
+            self.undo_cache.append(inverse)
+            self.undo_bytes += inverse.nbytes
+            self.__trim_history()
+
+    def __edit(self, delta: Delta):
+        with self.lock:
+            inverse = self.__apply(delta)
+            self.undo_cache.append(inverse)
+            self.undo_bytes += inverse.nbytes
+            self.redo_cache = []  # clear redo cache
+            self.redo_bytes = 0
+            self.__trim_history()
+
+    def __apply(self, delta: Delta) -> Delta:
+        n = len(self.dataframe)
+        patched = self.__get_patched_index_rows(delta=delta)
+        old_keys = None if patched is None else self.dataframe.iloc[patched][SequencingTableIndex.COLUMNS]
+        self.dataframe, inverse = delta.apply(self.dataframe)
+        self.version += 1
+        self.rows_touched += count_touched_rows(delta, n_before=n, n_after=len(self.dataframe))
+        self.__update_index(delta=delta, inverse=inverse)
+        if self.index is not None and patched is not None:
+            self.index.remove(rows=old_keys)
+            self.index.add(rows=self.dataframe.iloc[patched][SequencingTableIndex.COLUMNS])
+        self.__update_column_bytes(delta=delta)
+        self.__update_store_rows(delta=delta)
+        self.__append_journal(delta=delta)
+        for event in delta.events():
+            for listener in self.listeners:
+                listener(event)
+        return inverse
+
+    def __trim_history(self):
+        """
+        Evicts the oldest undo steps, then the redo steps farthest from the current table,
+        while the history is above max_undo_bytes or everything is above max_memory_bytes.
+        The latest step each way is always kept.
+        """
+        def over() -> bool:
+            history = self.undo_bytes + self.redo_bytes
+            return history > self.max_undo_bytes or self.__get_memory_usage()['total'] > self.max_memory_bytes
+
+        while len(self.undo_cache) > 1 and over():
+            self.undo_bytes -= self.undo_cache.pop(0).nbytes
+        while len(self.redo_cache) > 1 and over():
+            self.redo_bytes -= self.redo_cache.pop(0).nbytes
+
+    def __update_column_bytes(self, delta: Delta):
+        if isinstance(delta, Compound):
+            for d in delta.deltas:
+                self.__update_column_bytes(delta=d)
+        elif isinstance(delta, CellPatch):
+            self.column_bytes.pop(delta.column, None)
+        elif isinstance(delta, Permutation):
+            pass  # the same values in another order
+        else:
+            self.column_bytes = {}
+
+    def __get_memory_usage(self) -> Dict[str, int]:
+        with self.lock:
+            for column in self.dataframe.columns:
+                if column not in self.column_bytes:
+                    self.column_bytes[column] = int(self.dataframe[column].memory_usage(index=False, deep=True))
+            ret = {
+                'table': sum(self.column_bytes.values()) + int(self.dataframe.index.memory_usage()),
+                'index': 0 if self.index is None else self.index.get_nbytes(),
+                'undo': self.undo_bytes,
+                'redo': self.redo_bytes,
+            }
+        ret['total'] = sum(ret.values())
+        return ret
+
+    def __get_patched_index_rows(self, delta: Delta) -> Optional[np.ndarray]:
+        """
+        The rows whose index keys the delta patches, None if there are none.
+        Patches mixed with row changes would need the table in between, so the index is rebuilt instead.
+        """
+        if self.index is None:
+            return None
+        deltas = flatten(delta)
+        patches = [d for d in deltas if isinstance(d, CellPatch) and d.column in SequencingTableIndex.COLUMNS]
+        if len(patches) == 0:
+            return None
+        if not all(isinstance(d, CellPatch) for d in deltas):
+            self.index = None
+            return None
+        return np.unique(np.concatenate([d.rows for d in patches]))
+
+    def __update_index(self, delta: Delta, inverse: Delta):
+        """
+        Rows are added and removed by their keys, so rows inserted or deleted anywhere
+        and reordered rows keep the index. Patched keys are updated by __apply.
+        """
+        if self.index is None:
             return
-        self.redo_cache.append(self.dataframe)
-        self.dataframe = self.undo_cache.pop()
+        if isinstance(delta, Compound):
+            for d, i in zip(delta.deltas, reversed(inverse.deltas)):
+                self.__update_index(delta=d, inverse=i)
+        elif isinstance(delta, RowInsert):
+            self.index.add(rows=delta.rows)
+        elif isinstance(delta, RowDelete):
+            self.index.remove(rows=inverse.rows)  # the deleted rows
+        elif isinstance(delta, (CellPatch, Permutation)):
+            pass
+        else:
+            self.index = None
 
-    def redo(self):
-        if len(self.redo_cache) == 0:
+    def __update_store_rows(self, delta: Delta):
+        if self.store_rows is None:
+            return
+        if isinstance(delta, Compound):
+            for d in delta.deltas:
+                self.__update_store_rows(delta=d)
+        elif isinstance(delta, (CellPatch, RowInsert, RowDelete)):
+            positions = delta.rows if isinstance(delta, CellPatch) else delta.positions
+            if len(positions) > 0:  # rows before the first changed one are still the same
+                self.store_rows = min(self.store_rows, int(positions.min()))
+        elif isinstance(delta, Permutation):
+            moved = np.flatnonzero(delta.order != np.arange(len(delta.order)))
+            if len(moved) > 0:
+                self.store_rows = min(self.store_rows, int(moved[0]))
+        else:
+            self.store_rows = None
+
+    def __append_journal(self, delta: Delta):
+        if self.journal is None:
+            return
+        try:
+            self.journal.append(delta)
+        except OSError as e:  # the edit is already applied, keep editing without a journal
+            print(f'WARNING: journal of "{basename(self.journal.table_file)}" stopped: {e!r}', flush=True)
+            self.journal = None
             return
-        self.undo_cache.append(self.dataframe)
-        self.dataframe = self.redo_cache.pop()
+        if self.journal.needs_compaction():
+            self.journal.compact_in_background(self.dataframe.copy())  # CellPatch modifies the dataframe in place
 
-    def __add_to_undo_cache(self):
-        self.undo_cache.append(self.dataframe.copy())
-        if len(self.undo_cache) > self.MAX_UNDO:
-            self.undo_cache.pop(0)
-        self.redo_cache = []  # clear redo cache
+    def __start_journal(self, file: str, resume: bool = False):
+        """
+        Edits go on without a journal if it cannot be written, e.g. the table is in a read-only folder
+        """
+        from .journal import Journal  # optional backends are imported on first use
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        journal = Journal(table_file=file, fsync=self.journal_fsync)
+        try:
+            if resume:
+                journal.resume()
+            else:
+                journal.start()
+        except OSError as e:
+            print(f'WARNING: edits of "{basename(file)}" are not journaled: {e!r}', flush=True)
+            return
+        self.journal = journal
 
+    @instrumented()
     def reset_dataframe(self):
-        new = pd.DataFrame(columns=SEQUENCING_TABLE_COLUMNS)
-        self.__add_to_undo_cache()
-        self.dataframe = new
-
-    def read_sequencing_table(self, file: str):
-        new = ReadTable().main(file=file, columns=SEQUENCING_TABLE_COLUMNS)
-        self.__add_to_undo_cache()
-        self.dataframe = new
-
-    def save_sequencing_table(self, file: str):
-        if file.endswith('.xlsx'):
-            self.dataframe.to_excel(file, index=False)
+        self.__edit(Replace(dataframe=empty_sequencing_table()))
+
+    def count_recoverable_edits(self, file: str) -> int:
+        """
+        Unsaved edits in the journal of the file left by a session that did not close, e.g. a crash.
+        The journal of this session is not counted, re-reading the file drops it.
+        """
+        if self.journal_fsync is None or (self.journal is not None and self.journal.table_file == file):
+            return 0
+        from .journal import Journal
+        _, deltas = Journal(table_file=file).load() or (file, [])
+        return len(deltas)
+
+    @instrumented(reads=('file', ))
+    def read_sequencing_table(self, file: str, recover: bool = False, task: Optional[Task] = None):
+        """
+        recover: replays the unsaved edits in the journal of the file, see count_recoverable_edits(),
+            otherwise the journal is dropped
+        """
+        task = task or Task()
+        task.update(0, f'Reading "{basename(file)}"')
+
+        base, deltas = file, []
+        if self.journal_fsync is not None and recover:
+            from .journal import Journal
+            base, deltas = Journal(table_file=file).load() or (file, [])
+
+        new = ReadTable().main(
+            file=base,
+            columns=SEQUENCING_TABLE_COLUMNS,
+            dtypes=SEQUENCING_TABLE_DTYPES).reset_index(drop=True)
+        task.update(1)
+        with self.lock:
+            if self.journal is not None:
+                self.journal.close(delete=True)  # the edits are abandoned by reading a table
+                self.journal = None
+            self.__edit(Replace(dataframe=new))
+            if is_store_file(file) and base == file:
+                self.store_file, self.store_rows = abspath(file), len(new)
+            for delta in deltas:  # each replayed edit can be undone
+                self.__edit(delta)
+            if self.journal_fsync is not None:
+                self.__start_journal(file=file, resume=base != file or len(deltas) > 0)
+        if len(deltas) > 0:
+            print(f'Recovered {len(deltas)} unsaved edits of "{basename(file)}"', flush=True)
+
+    @instrumented()
+    def close_journal(self):
+        """
+        At a clean shutdown, so only a journal left by a crash is found by count_recoverable_edits()
+        """
+        with self.lock:
+            if self.journal is not None:
+                self.journal.close(delete=True)
+                self.journal = None
+
+    @instrumented(writes=('file', ))
+    def save_sequencing_table(self, file: str, task: Optional[Task] = None):
+        task = task or Task()
+        task.update(0, f'Saving "{basename(file)}"')
+        with self.lock:
+            version = self.version
+            n = len(self.dataframe)
+            same_store = self.store_file == abspath(file) and exists(file)
+            store_rows = self.store_rows if same_store else None
+            # CellPatch modifies the dataframe in place, so the rows written are copied before the lock is released,
+            # only the rows after the store when appending to it
+            dataframe = self.dataframe.copy() if store_rows is None else self.dataframe.iloc[store_rows:].copy()
+
+        if store_rows is None:
+            write_table(dataframe, file=file)
         else:
-            self.dataframe.to_csv(file, index=False)
+            from .store import SqliteStore
+            with SqliteStore(file, indexes=SEQUENCING_TABLE_INDEXES) as store:
+                store.append(dataframe, keep=store_rows)
+            print(f'Saved {n - store_rows} new rows to "{basename(file)}"', flush=True)
+
+        with self.lock:
+            if is_store_file(file):
+                self.store_file = abspath(file)
+                self.store_rows = n if self.version == version else None  # edited while saving
+            if self.journal_fsync is not None and self.version == version:
+                if self.journal is not None:
+                    self.journal.close(delete=True)  # the edits are saved
+                    self.journal = None
+                self.__start_journal(file=file)
 
     def get_dataframe(self) -> pd.DataFrame:
         return self.dataframe.copy()
 
+    def get_index(self) -> 'SequencingTableIndex':
+        if self.index is None:
+            self.index = SequencingTableIndex().build(self.dataframe)
+        return self.index
+
+    def get_memory_usage(self) -> Dict[str, int]:
+        """
+        Bytes of the table, its index, the undo and redo history, and the total.
+        Only the columns changed since the last call are measured.
+        """
+        return self.__get_memory_usage()
+
+    @instrumented()
     def sort_dataframe(self, by: str, ascending: bool):
-        new = self.dataframe.sort_values(
-            by=by,
+        values = self.dataframe[by]
+        if isinstance(values.dtype, pd.CategoricalDtype):  # categories are sorted by value, not by order added
+            values = values.cat.reorder_categories(values.cat.categories.sort_values())
+        order = values.sort_values(
             ascending=ascending,
             kind='mergesort'  # deterministic, keep the original order when tied
-        ).reset_index(
-            drop=True
-        )
-        self.__add_to_undo_cache()
-        self.dataframe = new
+        ).index.to_numpy()
+        self.__edit(Permutation(order=order))
 
+    @instrumented()
     def drop(self, rows: Optional[List[int]] = None, columns: Optional[List[str]] = None):
-        new = self.dataframe.drop(
-            index=rows,
-            columns=columns
-        ).reset_index(
-            drop=True
-        )
-        self.__add_to_undo_cache()
-        self.dataframe = new
-
-    def import_patient_sample_sheet(self, file: str):
-        dataframe = self.dataframe.copy()
-
-        patient_sample_df = ReadTable().main(file=file, columns=IMPORT_COLUMNS)
-
-        for i, in_row in patient_sample_df.iterrows():
-
-            out_row = GenerateSequencingTableRow().main(
-                dataframe=dataframe,
-                in_row=in_row)
-
-            if out_row is not None:
-                dataframe = append(dataframe, out_row)
-
-        # update self.dataframe only after all rows succeed
-        self.__add_to_undo_cache()
-        self.dataframe = dataframe
-
+        deltas = []
+        if rows is not None:
+            deltas.append(RowDelete(positions=np.array(rows, dtype='int64')))
+        if columns is not None:
+            deltas.append(ColumnDelete(columns=columns))
+        self.__edit(Compound(deltas=deltas))
+
+    @instrumented(reads=('file', ))
+    def import_patient_sample_sheet(self, file: str, task: Optional[Task] = None):
+        task = task or Task()
+        task.update(0, f'Reading "{basename(file)}"')
+        patient_sample_df = ReadTable().main(file=file, columns=IMPORT_COLUMNS, dtypes=SEQUENCING_TABLE_DTYPES)
+
+        task.update(0.5, 'Generating IDs')
+        new_rows = GenerateSequencingTableRows().main(
+            index=self.get_index(),
+            in_df=patient_sample_df)
+
+        task.update(1)
+        with self.lock:
+            n = len(self.dataframe)
+            self.__edit(RowInsert(positions=np.arange(n, n + len(new_rows)), rows=new_rows))
+
+    @instrumented()
     def fill_in_cell_values(self, cells: List[Tuple[int, str]], value: Any):
-        new = self.dataframe.copy()
-        for idx, column in cells:
-            new.loc[idx, column] = value
-
-        # update self.dataframe only after all cells succeed
-        self.__add_to_undo_cache()
-        self.dataframe = new
-
+        """
+        One bulk assignment per column, the value is cast once for each column
+        """
+        if len(cells) == 0:
+            return
+        rows = np.fromiter(map(itemgetter(0), cells), dtype='int64', count=len(cells))
+        codes, columns = pd.factorize(pd.Index(list(map(itemgetter(1), cells)), dtype=object))
+
+        n = len(self.dataframe)
+        unknown = [c for c in columns if c not in self.dataframe.columns]
+        assert len(unknown) == 0, f'Columns not found in the sequencing table: {unknown}'
+        assert rows.min() >= 0 and rows.max() < n, f'Rows must be within 0 and {n - 1}'
+
+        column_to_value = {}
+        for column in columns:
+            dtype = SEQUENCING_TABLE_DTYPES.get(column)
+            try:
+                column_to_value[column] = cast_value(value, dtype=dtype)
+            except ValueError:  # the column would become objects
+                raise ValueError(f'Value "{value}" does not fit column "{column}" of dtype {dtype}') from None
+
+        deltas = [
+            CellPatch(rows=rows[codes == j], column=column, values=column_to_value[column])
+            for j, column in enumerate(columns)
+        ]
+
+        # the compound delta is all or nothing, the table is unchanged if any cell fails
+        self.__edit(Compound(deltas=deltas))
+
+    @instrumented(reads=('file', ))
+    def fill_in_mapping_file(self, file: str, task: Optional[Task] = None) -> List[Any]:
+        """
+        Fills in the columns of a mapping file keyed by ID or Lab Sample ID, e.g. the Sequencing Batch ID of
+        each sample, with one hash join as one undo step. Empty cells of the mapping file are left unchanged.
+        Returns the keys not found in the sequencing table.
+        """
+        task = task or Task()
+        task.update(0, f'Reading "{basename(file)}"')
+        mapping = ReadTable().main(
+            file=file, columns=SEQUENCING_TABLE_COLUMNS, dtypes=SEQUENCING_TABLE_DTYPES, required=[])
+
+        keys = [c for c in MAPPING_KEYS if c in mapping.columns]
+        assert len(keys) > 0, f'Column {" or ".join(MAPPING_KEYS)} not found in "{basename(file)}"'
+        key = keys[0]
+        columns = [c for c in mapping.columns if c != key]
+        assert len(columns) > 0, f'No column to fill in from "{basename(file)}"'
+
+        mapping = mapping[mapping[key].notna()].reset_index(drop=True)
+        duplicated = mapping.loc[mapping[key].duplicated(), key].unique().tolist()
+        assert len(duplicated) == 0, f'Duplicated {key} in "{basename(file)}": {duplicated}'
+
+        task.update(0.5, 'Joining')
+        with self.lock:
+            matches = pd.Index(mapping[key]).get_indexer(self.dataframe[key])  # -1 if a row is not in the mapping
+            rows = np.flatnonzero(matches >= 0)
+            matches = matches[rows]
+
+            deltas = []
+            for column in columns:
+                values = mapping[column].take(matches)
+                filled = values.notna().to_numpy()
+                if filled.any():
+                    deltas.append(CellPatch(rows=rows[filled], column=column, values=values[filled].to_numpy()))
+            if len(deltas) > 0:
+                self.__edit(Compound(deltas=deltas))
+
+        matched = np.zeros(len(mapping), dtype=bool)
+        matched[matches] = True
+        unmatched = mapping.loc[~matched, key].tolist()
+
+        n_cells = sum(len(d.rows) for d in deltas)
+        print(f'Filled in {n_cells} cells of {len(rows)} rows from "{basename(file)}", '
+              f'{len(unmatched)} {key}(s) not found', flush=True)
+        task.update(1)
+        return unmatched
+
+    @instrumented(reads=('sequencing_batch_table_file', 'fastq_correction_file'), writes=('output_file', ))
     def build_run_table(
             self,
             seq_ids: List[str],
@@ -185,92 +580,423 @@ class Model:
             sequencing_batch_table_file: str,
             fastq_correction_file: str,
             output_file: str,
-            use_lab_sample_id: bool):
+            use_lab_sample_id: bool,
+            task: Optional[Task] = None):
+
+        with self.lock:
+            seq_df = self.dataframe
+            in_store = self.store_rows is not None and self.store_rows == len(seq_df)
+            store_file = self.store_file if in_store else None
 
         return BuildRunTable().main(
-            seq_df=self.dataframe,
+            seq_df=seq_df,
             seq_ids=seq_ids,
             r1_suffix=r1_suffix,
             r2_suffix=r2_suffix,
             sequencing_batch_table_file=sequencing_batch_table_file,
             fastq_correction_file=fastq_correction_file,
             output_file=output_file,
-            use_lab_sample_id=use_lab_sample_id)
+            use_lab_sample_id=use_lab_sample_id,
+            store_file=store_file,
+            task=task)
+
+
+class SequencingTableIndex:
+    """
+    Counts of the keys of the sequencing table, so rows can be added and removed in any order
+    """
+
+    COLUMNS = [LAB, LAB_PATIENT_ID, LAB_SAMPLE_ID, PATIENT_ID]
+
+    patient_key_to_patient_ids: Dict[Tuple[Any, Any], Dict[Any, int]]  # (Lab, Lab Patient ID) -> Patient ID -> rows
+    sample_key_to_count: Dict[Tuple[Any, Any, Any], int]  # (Lab, Lab Patient ID, Lab Sample ID) -> rows
+    patient_id_to_count: Dict[Any, int]  # Patient ID -> number of sequencings
+    max_patient_id: int  # 0 for an empty table
+
+    def build(self, dataframe: pd.DataFrame) -> 'SequencingTableIndex':
+        self.patient_key_to_patient_ids = {}
+        self.sample_key_to_count = {}
+        self.patient_id_to_count = {}
+        self.max_patient_id = 0
+        self.add(rows=dataframe)
+        return self
+
+    def add(self, rows: pd.DataFrame):
+        labs, lab_patient_ids, lab_sample_ids, patient_ids = get_keys(rows)
+
+        for key, count in Counter(zip(labs, lab_patient_ids, patient_ids)).items():
+            patient_id_to_count = self.patient_key_to_patient_ids.setdefault(key[:2], {})
+            patient_id_to_count[key[2]] = patient_id_to_count.get(key[2], 0) + count
+
+        for key, count in Counter(zip(labs, lab_patient_ids, lab_sample_ids)).items():
+            self.sample_key_to_count[key] = self.sample_key_to_count.get(key, 0) + count
+
+        for patient_id, count in Counter(patient_ids).items():
+            self.patient_id_to_count[patient_id] = self.patient_id_to_count.get(patient_id, 0) + count
+
+        max_patient_id = pd.to_numeric(rows[PATIENT_ID], errors='coerce').max()
+        if pd.notna(max_patient_id):
+            self.max_patient_id = max(self.max_patient_id, int(max_patient_id))
+
+    def remove(self, rows: pd.DataFrame):
+        labs, lab_patient_ids, lab_sample_ids, patient_ids = get_keys(rows)
+
+        for key, count in Counter(zip(labs, lab_patient_ids, patient_ids)).items():
+            patient_id_to_count = self.patient_key_to_patient_ids[key[:2]]
+            decrement(patient_id_to_count, key=key[2], count=count)
+            if len(patient_id_to_count) == 0:
+                del self.patient_key_to_patient_ids[key[:2]]
+
+        for key, count in Counter(zip(labs, lab_patient_ids, lab_sample_ids)).items():
+            decrement(self.sample_key_to_count, key=key, count=count)
+
+        for patient_id, count in Counter(patient_ids).items():
+            decrement(self.patient_id_to_count, key=patient_id, count=count)
+
+        max_patient_id = pd.to_numeric(rows[PATIENT_ID], errors='coerce').max()
+        if pd.notna(max_patient_id) and int(max_patient_id) == self.max_patient_id:  # the max may be gone
+            max_patient_id = pd.to_numeric(pd.Series(list(self.patient_id_to_count), dtype=object), errors='coerce').max()
+            self.max_patient_id = int(max_patient_id) if pd.notna(max_patient_id) else 0
+
+    def has_sample(self, lab: Any, lab_patient_id: Any, lab_sample_id: Any) -> bool:
+        return (lab, lab_patient_id, lab_sample_id) in self.sample_key_to_count
+
+    def get_patient_id(self, lab: Any, lab_patient_id: Any) -> Optional[Any]:
+        """
+        The Patient ID added first for the patient
+        """
+        patient_id_to_count = self.patient_key_to_patient_ids.get((lab, lab_patient_id))
+        return None if patient_id_to_count is None else next(iter(patient_id_to_count))
+
+    def get_sequencing_count(self, patient_id: Any) -> int:
+        return self.patient_id_to_count.get(patient_id, 0)
+
+    def get_nbytes(self) -> int:
+        """
+        Estimated from the first entry of each dict, measuring every key would take as long as building the index
+        """
+        ret = 0
+        for d in [self.patient_key_to_patient_ids, self.sample_key_to_count, self.patient_id_to_count]:
+            ret += sys.getsizeof(d)
+            if len(d) > 0:
+                key, value = next(iter(d.items()))
+                items = key if isinstance(key, tuple) else ()
+                ret += len(d) * (sys.getsizeof(key) + sum(sys.getsizeof(i) for i in items) + sys.getsizeof(value))
+        return ret
+
+
+def flatten(delta: Delta) -> List[Delta]:
+    if isinstance(delta, Compound):
+        return [d for c in delta.deltas for d in flatten(c)]
+    return [delta]
+
+
+def get_keys(rows: pd.DataFrame) -> List[List[Any]]:
+    """
+    The index columns as lists, missing values as None, as NaN is not equal to itself and would never be removed
+    """
+    ret = []
+    for column in SequencingTableIndex.COLUMNS:
+        values = rows[column]
+        ret.append(values.astype(object).where(values.notna(), None).tolist())
+    return ret
+
+
+def decrement(d: Dict[Any, int], key: Any, count: int):
+    d[key] -= count
+    if d[key] == 0:
+        del d[key]
 
 
 class ReadTable:
 
     file: str
     columns: List[str]
+    dtypes: Dict[str, str]
+    required: List[str]
 
     df: pd.DataFrame
+    engine: str
+    timings: Dict[str, float]  # seconds
 
     def main(
             self,
             file: str,
-            columns: List[str]) -> pd.DataFrame:
-
+            columns: List[str],
+            dtypes: Optional[Dict[str, str]] = None,
+            required: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        required: columns that must be in the file, all columns by default, the others are read if present
+        """
         self.file = file
         self.columns = columns
+        self.dtypes = dtypes or {}
+        self.required = columns if required is None else required
 
+        start = time.time()
         self.read_file()
+        parsed = time.time()
         self.assert_columns()
-        self.df = self.df[self.columns]
+        self.df = self.df[[c for c in self.columns if c in self.df.columns]]
         self.df.dropna(how='all', inplace=True)
+        self.df = apply_dtypes(self.df, dtypes=self.dtypes)
+        self.timings = {'parse': parsed - start, 'cast': time.time() - parsed}
+
+        print(f'Read {len(self.df)} rows from "{basename(self.file)}" with {self.engine}: '
+              f'parse {self.timings["parse"]:.3f} s, cast {self.timings["cast"]:.3f} s', flush=True)
 
         return self.df
 
     def read_file(self):
         if self.file.endswith('.xlsx'):
-            self.df = pd.read_excel(self.file)
+            self.read_excel()
         elif self.file.endswith('.csv'):
-            self.df = pd.read_csv(self.file)
+            self.read_csv()
+        elif self.file.endswith(tuple(SNAPSHOT_EXTENSIONS)):
+            self.read_snapshot()
+        elif is_store_file(self.file):
+            self.read_store()
         else:
-            raise ValueError(f'File "{self.file}" must be .xlsx or .csv')
+            extensions = ', '.join(SNAPSHOT_EXTENSIONS + STORE_EXTENSIONS)
+            raise ValueError(f'File "{self.file}" must be .xlsx, .csv or {extensions}')
+
+    def read_csv(self):
+        header = pd.read_csv(self.file, nrows=0).columns
+        usecols = [c for c in header if c in self.columns]  # missing columns are reported by assert_columns()
+        for engine in CSV_ENGINES:
+            try:
+                if engine == 'pyarrow':
+                    self.df = self.__read_csv_pyarrow(usecols=usecols)
+                else:
+                    self.df = pd.read_csv(self.file, usecols=usecols, dtype=self.__parse_dtypes(), engine=engine)
+                self.engine = engine
+                return
+            except (ValueError, TypeError):  # e.g. a malformed row, the C engine is the most lenient
+                if engine == CSV_ENGINES[-1]:
+                    raise
+
+    def __read_csv_pyarrow(self, usecols: List[str]) -> pd.DataFrame:
+        """
+        pd.read_csv(engine='pyarrow') infers the types before applying dtype, e.g. '007' becomes '7',
+        so text columns are declared to pyarrow directly
+        """
+        import pyarrow
+        import pyarrow.csv
+        table = pyarrow.csv.read_csv(self.file, convert_options=pyarrow.csv.ConvertOptions(
+            include_columns=usecols,
+            column_types={c: pyarrow.string() for c in self.__parse_dtypes().keys() if c in usecols},
+            strings_can_be_null=True))  # empty cells are nan as with pandas
+        return table.to_pandas()
+
+    def read_excel(self):
+        wanted = set(self.columns)
+        for engine in EXCEL_ENGINES:
+            try:
+                self.df = pd.read_excel(
+                    self.file, usecols=lambda c: c in wanted, dtype=self.__parse_dtypes(), engine=engine)
+                self.engine = engine
+                return
+            except (ValueError, TypeError):
+                if engine == EXCEL_ENGINES[-1]:
+                    raise
+
+    def read_snapshot(self):
+        """
+        Snapshots keep the dtypes, so nothing is parsed or inferred
+        """
+        if self.file.endswith('.pkl'):
+            self.df = pd.read_pickle(self.file)
+            self.engine = 'pickle'
+            return
 
-    def assert_columns(self):
-        for c in self.columns:
-            assert c in self.df.columns, f'Column "{c}" not found in "{basename(self.file)}"'
+        assert find_spec('pyarrow') is not None, f'pyarrow is required to read "{basename(self.file)}"'
+        if self.file.endswith('.feather'):
+            import pyarrow.feather
+            table = pyarrow.feather.read_table(self.file, memory_map=True)
+        else:
+            import pyarrow.parquet
+            names = pyarrow.parquet.read_schema(self.file).names
+            table = pyarrow.parquet.read_table(self.file, columns=[c for c in names if c in self.columns])
+        self.df = table.select([c for c in table.column_names if c in self.columns]).to_pandas()
+        self.engine = 'pyarrow'
 
+    def read_store(self):
+        """
+        The whole table is read, the view and the index need every row.
+        The store only makes saves incremental and BuildRunTable selections indexed.
+        """
+        from .store import SqliteStore
+        assert exists(self.file), f'File "{self.file}" not found'
+        with SqliteStore(self.file) as store:
+            self.df = store.read(columns=[c for c in store.get_columns() if c in self.columns])
+        self.engine = 'sqlite'
 
-class GenerateSequencingTableRow:
+    def __parse_dtypes(self) -> Dict[str, Any]:
+        """
+        Text columns are parsed as text, e.g. a Lab Patient ID '007' stays '007' instead of becoming 7.
+        Numbers and dates are inferred by the parser and cast afterwards, so text in them is not lost.
+        """
+        return {
+            c: (str if d == 'str' else d)
+            for c, d in self.dtypes.items() if c in self.columns and d in PARSE_DTYPES
+        }
 
-    dataframe: pd.DataFrame
-    in_row: pd.Series
+    def assert_columns(self):
+        for c in self.required:
+            assert c in self.df.columns, f'Column "{c}" not found in "{basename(self.file)}"'
 
-    not_sequenced: bool
-    existing_patient: bool
-    existing_sample: bool
-    patient_id: int
-    patient_sequencing_number: int
-    seq_id: str
 
-    out_row: pd.Series
+def write_table(df: pd.DataFrame, file: str):
+    if file.endswith('.xlsx'):
+        df.to_excel(file, index=False)
+    elif file.endswith('.pkl'):
+        df.reset_index(drop=True).to_pickle(file)
+    elif file.endswith(('.feather', '.parquet')):
+        assert find_spec('pyarrow') is not None, f'pyarrow is required to save "{basename(file)}"'
+        df = to_arrow_compatible(df.reset_index(drop=True))
+        if file.endswith('.feather'):
+            df.to_feather(file, compression='uncompressed')
+        else:
+            df.to_parquet(file, index=False)
+    elif is_store_file(file):
+        from .store import SqliteStore
+        with SqliteStore(file, indexes=SEQUENCING_TABLE_INDEXES) as store:
+            store.replace(df)
+    else:
+        df.to_csv(file, index=False)
+
+
+def is_store_file(file: str) -> bool:
+    return file.endswith(tuple(STORE_EXTENSIONS))
+
+
+def to_arrow_compatible(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Arrow columns have one type, so object columns of mixed types, e.g. text filled into a number column,
+    are saved as text
+    """
+    df = df.copy(deep=False)
+    for c in df.columns:
+        if df[c].dtype == object and pd.api.types.infer_dtype(df[c], skipna=True).startswith('mixed'):
+            df[c] = df[c].map(lambda v: v if pd.isna(v) else str(v))
+    return df
+
+
+def empty_sequencing_table() -> pd.DataFrame:
+    return pd.DataFrame({c: pd.Series(dtype=SEQUENCING_TABLE_DTYPES[c]) for c in SEQUENCING_TABLE_COLUMNS})
+
+
+def apply_dtypes(df: pd.DataFrame, dtypes: Dict[str, str]) -> pd.DataFrame:
+    df = df.copy(deep=False)
+    for c in df.columns:
+        if c in dtypes:
+            df[c] = cast_column(df[c], dtype=dtypes[c])
+    return df
+
+
+def cast_column(values: pd.Series, dtype: str) -> pd.Series:
+    """
+    Casts to the dtype of the schema, the column is kept as it is if any value does not fit,
+    e.g. text in a number column, so nothing is lost
+    """
+    try:
+        if dtype == 'Int64':
+            return pd.to_numeric(values).astype('Int64')  # raises for fractions
+        elif dtype == 'datetime64[ns]' and not pd.api.types.is_numeric_dtype(values.dtype):
+            return pd.to_datetime(values, format='mixed').astype(dtype)
+        elif dtype == 'category':
+            return values.astype('category')
+        elif dtype == 'str' and pd.api.types.is_numeric_dtype(values.dtype):
+            return pd.to_numeric(values).astype('Int64').astype(str).where(values.notna(), None)  # 1.0 -> '1'
+        else:
+            return values
+    except (ValueError, TypeError):
+        return values
+
+
+def cast_value(value: Any, dtype: Optional[str]) -> Any:
+    """
+    Casts text entered by the user, e.g. '3' for an integer column, raises ValueError if it does not fit the dtype
+    """
+    if dtype is None or not isinstance(value, str):
+        return value
+    values = pd.Series([value], dtype=object)
+    ret = cast_column(values, dtype=dtype)
+    if ret is values and dtype in ['Int64', 'datetime64[ns]']:  # any text fits a text or category column
+        raise ValueError(f'"{value}" does not fit dtype {dtype}')
+    return value if ret is values else ret.iloc[0]
+
+
+def to_text(values: pd.Series) -> pd.Series:
+    """
+    Numbers as text keys without a decimal point, e.g. 20230101.0 in a column with nan becomes '20230101',
+    text is kept as it is, e.g. '007'
+    """
+    def convert(v: Any) -> Any:
+        if isinstance(v, (int, float, np.number)) and not isinstance(v, bool) and pd.notna(v) and float(v) % 1 == 0:
+            return str(int(v))
+        return v
+    return values.astype(object).map(convert).astype('str')
+
+
+def read_reference_table(
+        file: str,
+        columns: List[str],
+        dtypes: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+    """
+    ReadTable for reference files which are read but never edited, parsed once until the file is modified.
+    The returned dataframe is shared and must not be modified.
+    """
+    return REFERENCE_CACHE.get(
+        file=file,
+        key=('table', tuple(columns), tuple(sorted((dtypes or {}).items()))),
+        load=lambda: ReadTable().main(file=file, columns=columns, dtypes=dtypes))
+
+
+def read_reference_lookup(file: str, key_column: str, value_column: str) -> Dict[str, Any]:
+    """
+    Keys are read as text, e.g. '20230101', to match the text columns of the sequencing table
+    """
+    return REFERENCE_CACHE.get(
+        file=file,
+        key=('lookup', key_column, value_column),
+        load=lambda: read_reference_table(
+            file=file,
+            columns=[key_column, value_column],
+            dtypes={key_column: 'str'}).set_index(key_column)[value_column].to_dict())
+
+
+class GenerateSequencingTableRows:
+
+    index: SequencingTableIndex
+    in_df: pd.DataFrame
+
+    patient_ids: pd.Series
+    patient_sequencing_numbers: pd.Series
+    seq_ids: pd.Series
+
+    out_df: pd.DataFrame
 
     def main(
             self,
-            dataframe: pd.DataFrame,
-            in_row: pd.Series) -> Optional[pd.Series]:
+            index: SequencingTableIndex,
+            in_df: pd.DataFrame) -> pd.DataFrame:
 
-        self.dataframe = dataframe.copy()
-        self.in_row = in_row.copy()
+        self.index = index
+        self.in_df = in_df.reset_index(drop=True)
 
         self.assert_no_nan()
-        self.tell_if_patient_or_sample_exist()
-
-        if self.existing_sample:
-            return None
-
+        self.drop_existing_samples()
         self.cast_datatype()
-        self.set_patient_id()
-        self.set_patient_sequencing_number()
-        self.set_seq_id()
-        self.set_out_row()
+        self.set_patient_ids()
+        self.set_patient_sequencing_numbers()
+        self.set_seq_ids()
+        self.set_out_df()
 
-        return self.out_row
+        return self.out_df
 
     def assert_no_nan(self):
-        for key in [
+        keys = [
             HOSPITAL_RESEARCH_CENTER,
             LAB,             #
             LAB_PATIENT_ID,  # these three are required to identify a patient and a sample
@@ -280,62 +1006,91 @@ class GenerateSequencingTableRow:
             SEQUENCING_TYPE,
             VIAL,
             VIAL_SEQUENCING_NUMBER
-        ]:
-            assert pd.notna(self.in_row[key]), f'Lab Sample ID "{self.in_row[LAB_SAMPLE_ID]}": "{key}" is empty.'
-
-    def tell_if_patient_or_sample_exist(self):
-        a = self.dataframe[LAB] == self.in_row[LAB]
-        b = self.dataframe[LAB_PATIENT_ID] == self.in_row[LAB_PATIENT_ID]
-        c = self.dataframe[LAB_SAMPLE_ID] == self.in_row[LAB_SAMPLE_ID]
-
-        self.existing_patient = any(a & b)
-        self.existing_sample = any(a & b & c)
+        ]
+        is_nan = self.in_df[keys].isna()
+        nan_rows = is_nan.any(axis=1)
+        if nan_rows.any():
+            i = nan_rows.idxmax()  # the first row containing nan
+            key = is_nan.loc[i].idxmax()  # the first empty key of that row
+            assert False, f'Lab Sample ID "{self.in_df.loc[i, LAB_SAMPLE_ID]}": "{key}" is empty.'
+
+    def drop_existing_samples(self):
+        keys = [LAB, LAB_PATIENT_ID, LAB_SAMPLE_ID]
+        in_table = [self.index.has_sample(*key) for key in self.__keys(keys)]
+        in_sheet = self.in_df.duplicated(subset=keys, keep='first')  # repeated within the same sheet
+        self.in_df = self.in_df[~(np.array(in_table, dtype=bool) | in_sheet)].reset_index(drop=True)
 
     def cast_datatype(self):
-        self.in_row[VIAL_SEQUENCING_NUMBER] = int(self.in_row[VIAL_SEQUENCING_NUMBER])
-
-    def set_patient_id(self):
-        if len(self.dataframe) == 0:  # empty sequencing table
-            self.patient_id = 1
-            return
-
-        if self.existing_patient:
-            self.patient_id = self.__get_existing_patient_id()
-        else:
-            self.patient_id = self.dataframe[PATIENT_ID].max() + 1
-
-    def __get_existing_patient_id(self):
-        a = self.dataframe[LAB] == self.in_row[LAB]
-        b = self.dataframe[LAB_PATIENT_ID] == self.in_row[LAB_PATIENT_ID]
-        return self.dataframe.loc[a & b, PATIENT_ID].iloc[0]
-
-    def set_patient_sequencing_number(self):
-        self.patient_sequencing_number = (self.dataframe[PATIENT_ID] == self.patient_id).sum() + 1
-
-    def set_seq_id(self):
-        a = HOSPITAL_RESEARCH_CENTER_TO_CODE[self.in_row[HOSPITAL_RESEARCH_CENTER]]
-        b = f'{self.patient_id:05d}'
-        c = CANCER_TYPE_TO_CODE[self.in_row[CANCER_TYPE]]
-        d = TISSUE_TYPE_TO_CODE[self.in_row[TISSUE_TYPE]]
-        e = SEQUENCING_TYPE_TO_CODE[self.in_row[SEQUENCING_TYPE]]
-        f = f'{self.in_row[VIAL_SEQUENCING_NUMBER]:02d}'  # sometimes vial sequencing number can be float because of nan
-        g = f'{self.patient_sequencing_number:02d}'
-        self.seq_id = f'{a}-{b}-{c}{d}-{e}-{self.in_row[VIAL]}{f}-{g}'
-
-    def set_out_row(self):
-        self.out_row = pd.Series({
-            ID: self.seq_id,
-            PATIENT_ID: self.patient_id,
-            PATIENT_SEQUENCING_NUMBER: self.patient_sequencing_number,
-            IMPORT_DATE: date.today(),
-        })
-        common_columns = set(IMPORT_COLUMNS).intersection(SEQUENCING_TABLE_COLUMNS)
-        for c in common_columns:
-            self.out_row[c] = self.in_row[c]
+        self.in_df[VIAL_SEQUENCING_NUMBER] = self.in_df[VIAL_SEQUENCING_NUMBER].astype(int)
+
+    def set_patient_ids(self):
+        keys = [LAB, LAB_PATIENT_ID]
+
+        existing_patient_ids = [self.index.get_patient_id(*key) for key in self.__keys(keys)]
+        existing_patient = np.array([i is not None for i in existing_patient_ids], dtype=bool)
+
+        # new patients are numbered in the order they first appear in the sheet
+        new_patient_numbers = self.in_df[~existing_patient].groupby(keys, sort=False).ngroup()
+
+        patient_ids = np.zeros(len(self.in_df), dtype='int64')
+        patient_ids[existing_patient] = [i for i in existing_patient_ids if i is not None]
+        patient_ids[~existing_patient] = self.index.max_patient_id + new_patient_numbers.to_numpy() + 1
+        self.patient_ids = pd.Series(patient_ids, index=self.in_df.index)
+
+    def set_patient_sequencing_numbers(self):
+        existing_counts = self.patient_ids.map(self.index.get_sequencing_count)
+        counts_within_sheet = self.patient_ids.groupby(self.patient_ids).cumcount()
+        self.patient_sequencing_numbers = existing_counts + counts_within_sheet + 1
+
+    def __keys(self, columns: List[str]) -> List[Tuple[Any, ...]]:
+        return list(zip(*[self.in_df[c].tolist() for c in columns]))
+
+    def set_seq_ids(self):
+        a = map_codes(self.in_df[HOSPITAL_RESEARCH_CENTER], HOSPITAL_RESEARCH_CENTER_TO_CODE)
+        b = self.patient_ids.astype(str).str.zfill(5)
+        c = map_codes(self.in_df[CANCER_TYPE], CANCER_TYPE_TO_CODE)
+        d = map_codes(self.in_df[TISSUE_TYPE], TISSUE_TYPE_TO_CODE)
+        e = map_codes(self.in_df[SEQUENCING_TYPE], SEQUENCING_TYPE_TO_CODE)
+        f = self.in_df[VIAL_SEQUENCING_NUMBER].astype(str).str.zfill(2)
+        g = self.patient_sequencing_numbers.astype(str).str.zfill(2)
+        vial = self.in_df[VIAL].astype(str)
+        self.seq_ids = a + '-' + b + '-' + c + d + '-' + e + '-' + vial + f + '-' + g
+
+    def set_out_df(self):
+        self.out_df = pd.DataFrame({
+            ID: self.seq_ids,
+            PATIENT_ID: self.patient_ids,
+            PATIENT_SEQUENCING_NUMBER: self.patient_sequencing_numbers,
+            IMPORT_DATE: pd.Timestamp(date.today()),
+        }, index=self.in_df.index)
+        for c in IMPORT_COLUMNS:
+            if c in SEQUENCING_TABLE_COLUMNS:
+                self.out_df[c] = self.in_df[c]
+        self.out_df = apply_dtypes(self.out_df, dtypes=SEQUENCING_TABLE_DTYPES)
+
+
+def map_codes(values: pd.Series, value_to_code: Dict[str, str]) -> pd.Series:
+    codes = values.map(value_to_code)
+    unknown = codes.isna()
+    if unknown.any():
+        raise KeyError(values[unknown].iloc[0])
+    return codes.astype(str)
 
 
 class BuildRunTable:
 
+    COLUMNS = [
+        'Tumor Sample Name',
+        'Tumor Fastq R1',
+        'Tumor Fastq R2',
+        'Normal Sample Name',
+        'Normal Fastq R1',
+        'Normal Fastq R2',
+        'Output Name',
+        'Sequencing Batch ID',
+        'BED File',
+    ]
+
     seq_df: pd.DataFrame
     seq_ids: List[str]
     r1_suffix: str
@@ -344,10 +1099,14 @@ class BuildRunTable:
     fastq_correction_file: str
     output_file: str
     use_lab_sample_id: bool
+    store_file: Optional[str]  # the SQLite file same as seq_df, rows are selected through its index
 
-    tumor_ids: List[str]
+    tumor_df: pd.DataFrame
     normal_ids: List[str]
-    correct_fastqs: List[str]
+    correction_index: CorrectionIndex
+    sequencing_batch_id_to_bed_file: Dict[str, str]
+
+    task: Task
 
     run_df: pd.DataFrame
 
@@ -360,9 +1119,11 @@ class BuildRunTable:
             sequencing_batch_table_file: str,
             fastq_correction_file: str,
             output_file: str,
-            use_lab_sample_id: bool):
+            use_lab_sample_id: bool,
+            store_file: Optional[str] = None,
+            task: Optional[Task] = None):
 
-        self.seq_df = seq_df.copy()
+        self.seq_df = seq_df  # not modified, subset_seq_df() makes a new dataframe
         self.seq_ids = seq_ids
         self.r1_suffix = r1_suffix
         self.r2_suffix = r2_suffix
@@ -370,23 +1131,48 @@ class BuildRunTable:
         self.fastq_correction_file = fastq_correction_file
         self.output_file = output_file
         self.use_lab_sample_id = use_lab_sample_id
+        self.store_file = store_file
+        self.task = task or Task()
 
+        self.task.update(0, 'Reading reference files')
         self.subset_seq_df()
-        self.set_tumor_ids()
+        self.set_tumor_df()
         self.set_normal_ids()
         self.set_correct_fastqs()
+        self.set_sequencing_batch_id_to_bed_file()
 
-        self.run_df = pd.DataFrame()
-        for tumor_id in self.tumor_ids:
-            self.generate_one_row(tumor_id=tumor_id)
+        self.task.update(0.25, 'Matching tumor and normal samples')
+        self.set_matched_normal_ids()
+        self.set_bed_files()
+        self.set_sample_names()
+
+        self.task.update(0.5, 'Building run table')
+        self.set_run_df()
+        self.task.update(0.75, f'Saving "{basename(self.output_file)}"')
         self.save_output_file()
+        print(REFERENCE_CACHE.summary(), flush=True)
 
     def subset_seq_df(self):
-        self.seq_df = self.seq_df[self.seq_df[ID].isin(self.seq_ids)]
+        if self.store_file is None:
+            self.seq_df = self.seq_df[self.seq_df[ID].isin(self.seq_ids)]
+            return
+        from .store import SqliteStore
+        with SqliteStore(self.store_file) as store:
+            df = store.select(column=ID, values=self.seq_ids, columns=list(self.seq_df.columns))
+        self.seq_df = apply_dtypes(df, dtypes=SEQUENCING_TABLE_DTYPES)
 
-    def set_tumor_ids(self):
+    def set_tumor_df(self):
+        """
+        One row per tumor, in the order of the sequencing table,
+        with the sequencing batch ID of the first row having the same ID
+        """
         not_normal = self.seq_df[TISSUE_TYPE] != 'Normal'
-        self.tumor_ids = self.seq_df.loc[not_normal, ID].tolist()
+        first_batch_ids = self.seq_df.drop_duplicates(subset=ID, keep='first').set_index(ID)[SEQUENCING_BATCH_ID]
+        tumor_ids = self.seq_df.loc[not_normal, ID].reset_index(drop=True)
+        self.tumor_df = pd.DataFrame({
+            'tumor_id': tumor_ids,
+            SEQUENCING_BATCH_ID: tumor_ids.map(first_batch_ids),
+        })
 
     def set_normal_ids(self):
         normal_df = self.seq_df[self.seq_df[TISSUE_TYPE] == 'Normal']
@@ -402,98 +1188,98 @@ class BuildRunTable:
         self.normal_ids = normal_df[ID].tolist()
 
     def set_correct_fastqs(self):
+        suffixes = [self.r1_suffix, self.r2_suffix]
         if self.fastq_correction_file == '':
-            self.correct_fastqs = []
-            return
-
-        with open(self.fastq_correction_file) as fh:
-            text = fh.read()
-        self.correct_fastqs = []
-        text = text.replace('\t', ' ').replace('\n', ' ')
-        for item in text.split(' '):
-            if item != '':
-                self.correct_fastqs.append(item)
-
-    def generate_one_row(self, tumor_id: str):
-        normal_id = self.__get_matched_normal_id(tumor_id=tumor_id)
-        sequencing_batch_id = self.__get_sequencing_batch_id(seq_id=tumor_id)
-        bed_file = self.__get_bed_file(seq_id=tumor_id)
-
-        if bed_file == '':
-            print(f'WARNING: BED file not found for "{tumor_id}"', flush=True)
-
-        if self.use_lab_sample_id:
-            tumor_id = self.__get_lab_sample_id(sample_id=tumor_id)
-            if normal_id is not None:
-                normal_id = self.__get_lab_sample_id(sample_id=normal_id)
-
-        tumor_fq1 = self.__get_correct_fastq(prefix=tumor_id, suffix=self.r1_suffix)
-        tumor_fq2 = self.__get_correct_fastq(prefix=tumor_id, suffix=self.r2_suffix)
-        if normal_id is not None:
-            normal_fq1 = self.__get_correct_fastq(prefix=normal_id, suffix=self.r1_suffix)
-            normal_fq2 = self.__get_correct_fastq(prefix=normal_id, suffix=self.r2_suffix)
+            correct_fastqs = []
         else:
-            normal_id, normal_fq1, normal_fq2 = '', '', ''
-
-        row = pd.Series({
-            'Tumor Sample Name': tumor_id,
-            'Tumor Fastq R1': tumor_fq1,
-            'Tumor Fastq R2': tumor_fq2,
-            'Normal Sample Name': normal_id,
-            'Normal Fastq R1': normal_fq1,
-            'Normal Fastq R2': normal_fq2,
-            'Output Name': tumor_id,
-            'Sequencing Batch ID': sequencing_batch_id,
-            'BED File': bed_file,
-        })
+            correct_fastqs = read_file_names(file=self.fastq_correction_file, suffixes=tuple(suffixes))
+        self.correction_index = CorrectionIndex(names=correct_fastqs, suffixes=suffixes)
 
-        self.run_df = append(self.run_df, row)
+    def set_sequencing_batch_id_to_bed_file(self):
+        self.sequencing_batch_id_to_bed_file = read_reference_lookup(
+            file=self.sequencing_batch_table_file,
+            key_column='ID',
+            value_column='BED File')
 
-    def __get_matched_normal_id(self, tumor_id: str) -> Optional[str]:
+    def set_matched_normal_ids(self):
         """
         Example:
             If tumor_id is                   '001-00001-0102-E-X01-02'
             then normal_id should start with '001-00001-0101'
-        """
-        matched_normal_prefix = tumor_id[:12] + '01'
-        for seq_id in self.normal_ids:
-            if seq_id.startswith(matched_normal_prefix):
-                return seq_id
-        return None
 
-    def __get_sequencing_batch_id(self, seq_id: str) -> str:
-        return self.seq_df.loc[self.seq_df[ID] == seq_id, SEQUENCING_BATCH_ID].iloc[0]
-
-    def __get_bed_file(self, seq_id: str) -> str:
-        sequencing_batch_id = self.seq_df.loc[self.seq_df[ID] == seq_id, SEQUENCING_BATCH_ID].iloc[0]
-
-        seq_batch_df = ReadTable().main(
-            file=self.sequencing_batch_table_file,
-            columns=['ID', 'BED File']
-        ).set_index('ID')
-
-        sequencing_batch_id_to_bed_file = seq_batch_df['BED File'].to_dict()
+        The first normal starting with the prefix is matched,
+        i.e. the latest sequenced normal of the patient.
+        """
+        prefixes = self.tumor_df['tumor_id'].str[:12] + '01'
+        normal_ids = pd.Series(self.normal_ids, dtype=object)
+        matched = pd.Series(None, index=self.tumor_df.index, dtype=object)
+        for length in prefixes.str.len().dropna().unique():  # IDs share one format, so usually only one length
+            length = int(length)
+            normal_prefixes = normal_ids[normal_ids.str.len() >= length].str[:length]
+            normal_prefixes = normal_prefixes.drop_duplicates(keep='first')
+            prefix_to_normal_id = dict(zip(normal_prefixes, normal_ids[normal_prefixes.index]))
+            rows = prefixes.str.len() == length
+            matched[rows] = prefixes[rows].map(prefix_to_normal_id)
+        self.tumor_df['normal_id'] = matched
+
+    def set_bed_files(self):
+        lookup = self.sequencing_batch_id_to_bed_file
+        batch_ids = to_text(self.tumor_df[SEQUENCING_BATCH_ID])  # numbers in a seq_df not read as text
+        found = batch_ids.isin(list(lookup.keys()))
+        self.tumor_df['bed_file'] = batch_ids.map(lookup).astype(object).where(found, '')
+
+        for tumor_id in self.tumor_df.loc[~found, 'tumor_id']:
+            print(f'WARNING: BED file not found for "{tumor_id}"', flush=True)
 
-        return sequencing_batch_id_to_bed_file.get(sequencing_batch_id, '')
+    def set_sample_names(self):
+        tumor_ids, normal_ids = self.tumor_df['tumor_id'], self.tumor_df['normal_id']
+        if not self.use_lab_sample_id:
+            self.tumor_df['tumor_name'] = tumor_ids
+            self.tumor_df['normal_name'] = normal_ids
+            return
 
-    def __get_lab_sample_id(self, sample_id: str) -> str:
-        df = self.seq_df
-        lab_sample_ids = df.loc[df[ID] == sample_id, LAB_SAMPLE_ID].to_list()
-        assert len(lab_sample_ids) == 1, f'More than one Lab Sample ID were found for {sample_id}'
-        return lab_sample_ids[0]
+        counts = self.seq_df[ID].value_counts()
+        has_normal = normal_ids.notna()
+        bad_tumor = tumor_ids.map(counts) != 1
+        bad_normal = has_normal & (normal_ids.map(counts) != 1)
+        bad = bad_tumor | bad_normal
+        if bad.any():
+            i = bad.idxmax()
+            sample_id = tumor_ids[i] if bad_tumor[i] else normal_ids[i]
+            raise AssertionError(f'More than one Lab Sample ID were found for {sample_id}')
+
+        id_to_lab_sample_id = self.seq_df.drop_duplicates(subset=ID).set_index(ID)[LAB_SAMPLE_ID]
+        self.tumor_df['tumor_name'] = tumor_ids.map(id_to_lab_sample_id)
+        self.tumor_df['normal_name'] = normal_ids.map(id_to_lab_sample_id).where(has_normal, None)
+
+    def set_run_df(self):
+        df = self.tumor_df
+        tumor_names = df['tumor_name'].tolist()
+        normal_names = [None if pd.isna(n) else n for n in df['normal_name']]
+
+        self.run_df = pd.DataFrame({
+            'Tumor Sample Name': tumor_names,
+            'Tumor Fastq R1': self.__get_correct_fastqs(prefixes=tumor_names, suffix=self.r1_suffix),
+            'Tumor Fastq R2': self.__get_correct_fastqs(prefixes=tumor_names, suffix=self.r2_suffix),
+            'Normal Sample Name': ['' if n is None else n for n in normal_names],
+            'Normal Fastq R1': self.__get_correct_fastqs(prefixes=normal_names, suffix=self.r1_suffix),
+            'Normal Fastq R2': self.__get_correct_fastqs(prefixes=normal_names, suffix=self.r2_suffix),
+            'Output Name': tumor_names,
+            'Sequencing Batch ID': df[SEQUENCING_BATCH_ID].tolist(),
+            'BED File': df['bed_file'].tolist(),
+        }, columns=self.COLUMNS, dtype=object)
+
+    def __get_correct_fastqs(self, prefixes: List[Optional[str]], suffix: str) -> List[str]:
+        return ['' if p is None else self.__get_correct_fastq(prefix=p, suffix=suffix) for p in prefixes]
 
     def __get_correct_fastq(self, prefix: str, suffix: str) -> str:
-        for f in self.correct_fastqs:
-            if f.startswith(prefix) and f.endswith(suffix):
-                return f
-        return prefix + suffix
+        f, n = self.correction_index.find(prefix=prefix, suffix=suffix)
+        if n > 1:
+            print(f'WARNING: {n} corrected Fastq files found for "{prefix}*{suffix}", use "{f}"', flush=True)
+        return prefix + suffix if f is None else f
 
     def save_output_file(self):
         if self.output_file.endswith('.xlsx'):
             self.run_df.to_excel(self.output_file, index=False)
         else:
             self.run_df.to_csv(self.output_file, index=False)
-
-
-def append(df: pd.DataFrame, s: pd.Series) -> pd.DataFrame:
-    return pd.concat([df, pd.DataFrame([s])], ignore_index=True)
@@ -0,0 +1,82 @@
+import sys
+import time
+import subprocess
+from os.path import dirname, abspath
+from typing import List, Dict, Tuple
+
+
+STARTUP_TARGETS = {
+    'GUI': 'src.main',  # what SeqsUI.py imports before the window shows
+    'command line': 'src.cli',  # before the arguments are parsed
+    'command': 'src.model',  # what every command loads to run
+}
+
+
+class ProfileStartup:
+    """
+    Imports each target in a fresh interpreter with -X importtime, and reports the import time
+    of the slowest modules and of each top-level package, so startup regressions are visible
+    """
+
+    TOP_N = 15
+
+    modules: List[Tuple[str, int, int]]  # name, self and cumulative microseconds, in import order
+    wall_seconds: float
+
+    def main(self, targets: Dict[str, str] = STARTUP_TARGETS) -> str:
+        reports = []
+        for label, module in targets.items():
+            try:
+                self.import_module(module)
+                reports.append(self.report(label=label, module=module))
+            except ImportError as e:  # e.g. no PyQt5 on a server
+                reports.append(f'Startup of {label} (import {module}): {e}')
+        ret = '\n\n'.join(reports)
+        print(ret, flush=True)
+        return ret
+
+    def import_module(self, module: str):
+        start = time.time()
+        p = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            cwd=dirname(dirname(abspath(__file__))),  # where the src package is
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        self.wall_seconds = time.time() - start
+        if p.returncode != 0:
+            raise ImportError(p.stderr.strip().splitlines()[-1])
+        self.modules = parse_importtime(p.stderr)
+
+    def report(self, label: str, module: str) -> str:
+        total = sum(s for _, s, _ in self.modules)
+        package_to_us = {}
+        for name, s, _ in self.modules:
+            package = name.split('.')[0]
+            package_to_us[package] = package_to_us.get(package, 0) + s
+
+        lines = [
+            f'Startup of {label} (import {module}): {total / 1e6:.3f} s importing {len(self.modules)} modules, '
+            f'{self.wall_seconds:.3f} s in total including the interpreter',
+            f'{"package":<40}{"self (ms)":>12}',
+        ]
+        for package, s in sorted(package_to_us.items(), key=lambda x: -x[1])[:self.TOP_N]:
+            lines.append(f'{package:<40}{s / 1e3:>12.1f}')
+
+        lines.append(f'{"module":<40}{"self (ms)":>12}{"cumulative (ms)":>18}')
+        for name, s, c in sorted(self.modules, key=lambda x: -x[1])[:self.TOP_N]:
+            lines.append(f'{name:<40}{s / 1e3:>12.1f}{c / 1e3:>18.1f}')
+        return '\n'.join(lines)
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """
+    Lines look like "import time:       535 |       1342 |   pandas.io"
+    """
+    ret = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # the header
+        ret.append((fields[2].strip(), int(fields[0]), int(fields[1])))
+    return ret
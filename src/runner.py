@@ -0,0 +1,97 @@
+from typing import Callable, Any, Optional
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from .view import View
+from .tasks import Task, Cancelled
+
+
+class WorkerSignals(QObject):
+
+    progress = pyqtSignal(float, str)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(object)
+
+
+class Worker(QRunnable):
+
+    fn: Callable[[Task], Any]
+    task: Task
+    signals: WorkerSignals
+
+    def __init__(self, fn: Callable[[Task], Any]):
+        super().__init__()
+        self.fn = fn
+        self.signals = WorkerSignals()
+        self.task = Task(callback=self.signals.progress.emit)
+
+    def run(self):
+        try:
+            result = self.fn(self.task)
+        except Exception as e:
+            self.signals.failed.emit(e)
+        else:
+            self.signals.finished.emit(result)
+
+
+class TaskRunner(QObject):
+    """
+    Runs one long operation at a time off the GUI thread.
+    The buttons are disabled meanwhile, but the table can still be scrolled and selected.
+    """
+
+    view: View
+    pool: QThreadPool
+
+    worker: Optional[Worker]
+    on_finished: Optional[Callable[[Any], None]]
+
+    def __init__(self, view: View):
+        super().__init__()
+        self.view = view
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(1)
+        self.worker = None
+        self.on_finished = None
+
+    def is_busy(self) -> bool:
+        return self.worker is not None
+
+    def run(self, fn: Callable[[Task], Any], label: str, on_finished: Optional[Callable[[Any], None]] = None):
+        if self.is_busy():
+            self.view.message_box_error(msg='Another task is running, please wait')
+            return
+
+        self.worker = Worker(fn)
+        self.on_finished = on_finished
+        self.worker.signals.progress.connect(self.__progress)
+        self.worker.signals.finished.connect(self.__finished)
+        self.worker.signals.failed.connect(self.__failed)
+
+        self.view.set_buttons_enabled(False)
+        self.view.dialog_progress.start(label=label, on_cancel=self.cancel)
+        self.pool.start(self.worker)
+
+    def cancel(self):
+        if self.worker is not None:
+            self.worker.task.cancel()
+
+    def __progress(self, fraction: float, message: str):
+        self.view.dialog_progress.update(fraction=fraction, message=message)
+
+    def __finished(self, result: Any):
+        on_finished = self.on_finished
+        self.__done()
+        if on_finished is not None:
+            on_finished(result)
+
+    def __failed(self, e: Exception):
+        self.__done()
+        if isinstance(e, Cancelled):
+            self.view.message_box_info(msg='Cancelled')
+        else:
+            self.view.message_box_error(msg=repr(e))
+
+    def __done(self):
+        self.worker = None
+        self.on_finished = None
+        self.view.dialog_progress.finish()
+        self.view.set_buttons_enabled(True)
@@ -0,0 +1,126 @@
+import sqlite3
+import numpy as np
+import pandas as pd
+from typing import List, Dict, Optional, Any
+
+
+class SqliteStore:
+    """
+    A table kept in an SQLite file, in the order of its rows, with indexes for looking up subsets of rows
+    """
+
+    TABLE = 'sequencing_table'
+    BATCH_SIZE = 10000  # rows per executemany()
+
+    file: str
+    indexes: Dict[str, List[str]]  # index name -> columns
+    connection: sqlite3.Connection
+
+    def __init__(self, file: str, indexes: Optional[Dict[str, List[str]]] = None):
+        self.file = file
+        self.indexes = indexes or {}
+        self.connection = sqlite3.connect(file, check_same_thread=False)  # used by background tasks
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self) -> 'SqliteStore':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_columns(self) -> List[str]:
+        rows = self.connection.execute(f'PRAGMA table_info({self.TABLE})').fetchall()
+        return [r[1] for r in rows]
+
+    def count(self) -> int:
+        if len(self.get_columns()) == 0:
+            return 0
+        return self.connection.execute(f'SELECT COUNT(*) FROM {self.TABLE}').fetchone()[0]
+
+    def replace(self, df: pd.DataFrame):
+        """
+        Rewrites the whole table in one transaction, the indexes are built after inserting
+        """
+        with self.connection:
+            self.connection.execute(f'DROP TABLE IF EXISTS {self.TABLE}')
+            columns = ', '.join(quote(c) for c in df.columns)
+            self.connection.execute(f'CREATE TABLE {self.TABLE} ({columns})')
+            self.__insert(df)
+            for name, index_columns in self.indexes.items():
+                if all(c in df.columns for c in index_columns):
+                    on = ', '.join(quote(c) for c in index_columns)
+                    self.connection.execute(f'CREATE INDEX {name} ON {self.TABLE} ({on})')
+
+    def append(self, df: pd.DataFrame, keep: Optional[int] = None):
+        """
+        Inserts the rows after the first `keep` rows, all rows are kept if None.
+        Rows after them are deleted in the same transaction, all or nothing.
+        """
+        assert list(df.columns) == self.get_columns(), f'Columns do not match the table in "{self.file}"'
+        with self.connection:
+            if keep is not None:
+                self.connection.execute(
+                    f'DELETE FROM {self.TABLE} WHERE rowid NOT IN '
+                    f'(SELECT rowid FROM {self.TABLE} ORDER BY rowid LIMIT ?)', (keep, ))
+            self.__insert(df)
+
+    def __insert(self, df: pd.DataFrame):
+        columns = [to_sql_values(df[c]) for c in df.columns]
+        placeholders = ', '.join('?' for _ in df.columns)
+        sql = f'INSERT INTO {self.TABLE} VALUES ({placeholders})'
+        for start in range(0, len(df), self.BATCH_SIZE):
+            batch = [c[start:start + self.BATCH_SIZE] for c in columns]
+            self.connection.executemany(sql, zip(*batch))
+
+    def read(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        select = self.__select_columns(columns)
+        return pd.read_sql_query(f'SELECT {select} FROM {self.TABLE} ORDER BY rowid', self.connection)
+
+    def select(self, column: str, values: List[Any], columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Rows where the column is one of the values, in the order of the table, looked up through the index
+        """
+        select = self.__select_columns(columns, prefix='t.')
+        with self.connection:
+            self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS selected (value PRIMARY KEY)')
+            self.connection.execute('DELETE FROM selected')
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO selected VALUES (?)', ((v, ) for v in to_sql_values(pd.Series(values))))
+        return pd.read_sql_query(
+            f'SELECT {select} FROM selected s JOIN {self.TABLE} t ON t.{quote(column)} = s.value ORDER BY t.rowid',
+            self.connection)
+
+    def __select_columns(self, columns: Optional[List[str]], prefix: str = '') -> str:
+        if columns is None:
+            columns = self.get_columns()
+        missing = [c for c in columns if c not in self.get_columns()]
+        assert len(missing) == 0, f'Column "{missing[0]}" not found in "{self.file}"'
+        return ', '.join(prefix + quote(c) for c in columns)
+
+
+def quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+SQL_TYPES = (int, float, str, bytes)
+
+
+def to_sql_values(values: pd.Series) -> List[Any]:
+    """
+    Python objects sqlite3 can bind, numpy and pandas scalars cannot be bound, e.g. timestamps are saved as text
+    """
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        values = values.dt.strftime('%Y-%m-%d %H:%M:%S')
+    isna = values.isna().to_numpy()
+    return [
+        None if na else to_sql_value(v)
+        for v, na in zip(values.tolist(), isna)
+    ]
+
+
+def to_sql_value(value: Any) -> Any:
+    if isinstance(value, np.generic):
+        value = value.item()
+    return value if isinstance(value, SQL_TYPES) else str(value)
@@ -0,0 +1,35 @@
+import threading
+from typing import Callable, Optional
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Task:
+    """
+    Passed into long operations, which report their progress through it
+    and stop at the next update() once the task is cancelled
+    """
+
+    callback: Optional[Callable[[float, str], None]]
+    cancelled: threading.Event
+
+    def __init__(self, callback: Optional[Callable[[float, str], None]] = None):
+        self.callback = callback
+        self.cancelled = threading.Event()
+
+    def update(self, fraction: float, message: str = ''):
+        self.check()
+        if self.callback is not None:
+            self.callback(fraction, message)
+
+    def check(self):
+        if self.cancelled.is_set():
+            raise Cancelled()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def is_cancelled(self) -> bool:
+        return self.cancelled.is_set()
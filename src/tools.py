@@ -9,11 +9,12 @@ def get_files(
         endswith: str = '',
         isfullpath: bool = False) -> List[str]:
 
-    ret = []
+    if not os.path.isdir(source):
+        return []
+
     s, e = startswith, endswith
-    for path, dirs, files in os.walk(source):
-        if path == source:
-            ret = [f for f in files if (f.startswith(s) and f.endswith(e))]
+    with os.scandir(source) as entries:  # only the top level, no need to walk the whole tree
+        ret = [x.name for x in entries if not x.is_dir() and x.name.startswith(s) and x.name.endswith(e)]
 
     if isfullpath:
         ret = [join(source, f) for f in ret]
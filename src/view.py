@@ -1,62 +1,184 @@
+import numpy as np
 import pandas as pd
 from os.path import dirname
 from PyQt5.QtGui import QIcon
-from PyQt5.QtCore import Qt
-from PyQt5.QtWidgets import QVBoxLayout, QWidget, QTableWidget, QTableWidgetItem, QPushButton, \
-    QFileDialog, QMessageBox, QGridLayout, QDialog, QFormLayout, QLineEdit, QDialogButtonBox, QApplication
-from typing import List, Union, Any, Tuple
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, pyqtSignal
+from PyQt5.QtWidgets import QVBoxLayout, QWidget, QTableView, QHeaderView, QPushButton, QProgressDialog, \
+    QFileDialog, QMessageBox, QGridLayout, QDialog, QFormLayout, QLineEdit, QDialogButtonBox, QApplication, QLabel
+from typing import List, Union, Any, Tuple, Dict, Callable, Optional
 from .model import Model
+from .history import ChangeEvent, CellsChanged, RowsInserted, RowsRemoved, RowsPermuted
 
 
-class Table(QTableWidget):
+class TableModel(QAbstractTableModel):
+
+    BLOCK_SIZE = 1000  # rows are formatted into strings one block at a time, only when drawn
+
+    changed = pyqtSignal(object)  # queued to the GUI thread when the model is edited by a background task
 
     model: Model
+    blocks: Dict[Tuple[int, int], np.ndarray]  # (column, block) -> formatted strings
+    n_rows: int  # follows the row insertions and removals announced to the view
 
     def __init__(self, model: Model):
         super().__init__()
         self.model = model
-        self.refresh_table()
-
-    def refresh_table(self):
-        df = self.model.get_dataframe()
+        self.blocks = {}
+        self.n_rows = len(model.dataframe.index)
+        self.changed.connect(self.on_change)
+        self.model.add_listener(self.changed.emit)
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else self.n_rows
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.model.dataframe.columns)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole) -> Any:
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        i, j = index.row(), index.column()
+        block = self.get_block(column=j, block=i // self.BLOCK_SIZE)
+        k = i % self.BLOCK_SIZE
+        return block[k] if k < len(block) else None
+
+    def headerData(self, section: int, orientation: Qt.Orientation, role: int = Qt.DisplayRole) -> Any:
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return str(self.model.dataframe.columns[section])
+        return super().headerData(section, orientation, role)
+
+    def flags(self, index: QModelIndex) -> Qt.ItemFlags:
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable  # makes the item immutable, i.e. user cannot edit it
+
+    def get_block(self, column: int, block: int) -> np.ndarray:
+        key = (column, block)
+        if key not in self.blocks:
+            start = block * self.BLOCK_SIZE
+            with self.model.lock:
+                values = self.model.dataframe.iloc[start:start + self.BLOCK_SIZE, column]
+            self.blocks[key] = format_column(values)
+        return self.blocks[key]
+
+    def refresh(self):
+        self.beginResetModel()
+        self.blocks = {}
+        self.n_rows = len(self.model.dataframe.index)
+        self.endResetModel()
+
+    def on_change(self, event: ChangeEvent):
+        if isinstance(event, CellsChanged):
+            self.on_cells_changed(event)
+        elif isinstance(event, RowsInserted):
+            self.on_rows_inserted(event)
+        elif isinstance(event, RowsRemoved):
+            self.on_rows_removed(event)
+        elif isinstance(event, RowsPermuted):
+            self.on_rows_permuted()
+        else:
+            self.refresh()
+
+    def on_cells_changed(self, event: CellsChanged):
+        if len(event.rows) == 0:
+            return
+        j = self.model.dataframe.columns.get_loc(event.column)
+        for block in np.unique(event.rows // self.BLOCK_SIZE):
+            self.blocks.pop((j, block), None)
+        top, bottom = event.rows.min(), event.rows.max()
+        self.dataChanged.emit(self.index(top, j), self.index(bottom, j), [Qt.DisplayRole])
+
+    def on_rows_inserted(self, event: RowsInserted):
+        if len(event.positions) == 0:
+            return
+        self.drop_blocks(from_row=event.positions[0])
+        for start, end in contiguous_runs(event.positions):  # ascending, so positions are final when inserted
+            self.beginInsertRows(QModelIndex(), start, end)
+            self.n_rows += end - start + 1
+            self.endInsertRows()
+
+    def on_rows_removed(self, event: RowsRemoved):
+        if len(event.positions) == 0:
+            return
+        self.drop_blocks(from_row=event.positions[0])
+        for start, end in reversed(contiguous_runs(event.positions)):  # descending, so positions stay valid
+            self.beginRemoveRows(QModelIndex(), start, end)
+            self.n_rows -= end - start + 1
+            self.endRemoveRows()
+
+    def on_rows_permuted(self):
+        self.layoutAboutToBeChanged.emit()
+        self.blocks = {}
+        self.layoutChanged.emit()
+
+    def drop_blocks(self, from_row: int):
+        first = from_row // self.BLOCK_SIZE
+        for key in [k for k in self.blocks if k[1] >= first]:
+            del self.blocks[key]
+
+
+def contiguous_runs(positions: np.ndarray) -> List[Tuple[int, int]]:
+    breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+    return [(int(run[0]), int(run[-1])) for run in np.split(positions, breaks)]
+
+
+class Table(QTableView):
+
+    SAMPLE_ROWS = 200  # column widths are estimated from this many rows
+    MAX_COLUMN_WIDTH = 400
 
-        self.setRowCount(len(df.index))
-        self.setColumnCount(len(df.columns))
+    model: Model
+    table_model: TableModel
 
-        self.setHorizontalHeaderLabels(df.columns)
-        for i in range(len(df.index)):
-            for j in range(len(df.columns)):
-                value = df.iloc[i, j]
-                item = QTableWidgetItem(to_str(value))
-                item.setFlags(item.flags() & ~Qt.ItemIsEditable)  # makes the item immutable, i.e. user cannot edit it
-                self.setItem(i, j, item)
+    def __init__(self, model: Model):
+        super().__init__()
+        self.model = model
+        self.table_model = TableModel(model)
+        self.setModel(self.table_model)
+        self.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)  # no per-row height calculation
+        self.table_model.modelReset.connect(self.resize_columns)
+        self.table_model.rowsInserted.connect(self.on_rows_inserted)
+        self.refresh_table()
 
-        self.resizeColumnsToContents()
+    def refresh_table(self):
+        self.table_model.refresh()
+
+    def on_rows_inserted(self, parent: QModelIndex, first: int, last: int):
+        if self.table_model.rowCount() == last - first + 1:  # the first rows, e.g. imported into an empty table
+            self.resize_columns()
+
+    def resize_columns(self):
+        df = self.model.dataframe
+        rows = np.unique(np.linspace(0, len(df.index) - 1, num=min(len(df.index), self.SAMPLE_ROWS), dtype=int))
+        metrics = self.fontMetrics()
+        padding = 2 * metrics.horizontalAdvance('  ')
+        for j, column in enumerate(df.columns):
+            texts = [str(column)] + format_column(df.iloc[rows, j]).tolist()
+            width = max(metrics.horizontalAdvance(t) for t in texts) + padding
+            self.setColumnWidth(j, min(width, self.MAX_COLUMN_WIDTH))
 
     def get_selected_rows(self) -> List[int]:
-        ret = []
-        for item in self.selectedItems():
-            ith_row = item.row()
-            if ith_row not in ret:
-                ret.append(ith_row)
-        return ret
+        ret = {}  # ordered and unique
+        for r in self.selectionModel().selection():
+            for ith_row in range(r.top(), r.bottom() + 1):
+                ret[ith_row] = None
+        return list(ret.keys())
 
     def get_selected_columns(self) -> List[str]:
-        ret = []
-        for item in self.selectedItems():
-            ith_col = item.column()
-            column = self.horizontalHeaderItem(ith_col).text()
-            if column not in ret:
-                ret.append(column)
-        return ret
+        ret = {}
+        columns = self.model.dataframe.columns
+        for r in self.selectionModel().selection():
+            for ith_col in range(r.left(), r.right() + 1):
+                ret[columns[ith_col]] = None
+        return list(ret.keys())
 
     def get_selected_cells(self) -> List[Tuple[int, str]]:
         ret = []
-        for item in self.selectedItems():
-            ith_row = item.row()
-            ith_col = item.column()
-            column = self.horizontalHeaderItem(ith_col).text()
-            ret.append((ith_row, column))
+        columns = self.model.dataframe.columns
+        for r in self.selectionModel().selection():
+            for ith_row in range(r.top(), r.bottom() + 1):
+                for ith_col in range(r.left(), r.right() + 1):
+                    ret.append((ith_row, columns[ith_col]))
         return ret
 
 
@@ -69,6 +191,33 @@ def to_str(value: Any) -> str:
         return str(value)
 
 
+def format_column(values: pd.Series) -> np.ndarray:
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        ret = values.dt.strftime('%Y-%m-%d')
+    elif isinstance(values.dtype, pd.CategoricalDtype):
+        categories = format_column(pd.Series(values.cat.categories))  # each distinct value is formatted only once
+        ret = np.append(categories, '')[values.cat.codes.to_numpy()]  # code -1 is nan
+    elif values.dtype == object:
+        ret = values.map(to_str)  # python objects of mixed types, e.g. dates and timestamps
+    else:
+        ret = values.astype(str)
+    ret = np.array(ret, dtype=object)
+    ret[values.isna().to_numpy()] = ''
+    return ret
+
+
+def format_status(n_rows: int, n_undo: int, n_redo: int, usage: Dict[str, int], max_bytes: int) -> str:
+    mb = {k: v / 1024 ** 2 for k, v in usage.items()}
+    return ' | '.join([
+        f'{n_rows:,} rows',
+        f'Table {mb["table"]:,.1f} MB',
+        f'Index {mb["index"]:,.1f} MB',
+        f'Undo {n_undo} steps {mb["undo"]:,.1f} MB',
+        f'Redo {n_redo} steps {mb["redo"]:,.1f} MB',
+        f'Memory {mb["total"]:,.1f} of {max_bytes / 1024 ** 2:,.0f} MB',
+    ])
+
+
 class View(QWidget):
 
     TITLE = 'SeqsUI'
@@ -89,6 +238,7 @@ class View(QWidget):
         'copy_selected_fastq_files': 'Copy Selected Fastq Files',
         'build_run_table': 'Build Run Table',
         'fill_in_cell_values': 'Fill In Cell Values',
+        'fill_in_mapping_file': 'Fill In From Mapping File',
     }
     BUTTON_NAME_TO_POSITION = {
         'read_sequencing_table': (0, 0),
@@ -105,12 +255,16 @@ class View(QWidget):
         'copy_selected_fastq_files': (0, 2),
         'build_run_table': (1, 2),
         'fill_in_cell_values': (2, 2),
+        'fill_in_mapping_file': (3, 2),
     }
 
+    changed = pyqtSignal(object)  # the model is edited, always queued
+
     model: Model
     vertical_layout: QVBoxLayout
     table: Table
     button_grid: QGridLayout
+    status: QLabel  # rows and memory usage
 
     def __init__(self, model: Model):
         super().__init__()
@@ -123,6 +277,7 @@ class View(QWidget):
         self.__init__vertical_layout()
         self.__init__main_table()
         self.__init__buttons()
+        self.__init__status()
         self.__init__methods()
 
     def __init__vertical_layout(self):
@@ -143,6 +298,13 @@ class View(QWidget):
             pos = self.BUTTON_NAME_TO_POSITION[name]
             self.button_grid.addWidget(button, *pos)
 
+    def __init__status(self):
+        self.status = QLabel()
+        self.vertical_layout.addWidget(self.status)
+        self.changed.connect(self.refresh_status, Qt.QueuedConnection)  # after the edit is pushed to the history
+        self.model.add_listener(self.changed.emit)
+        self.refresh_status()
+
     def __init__methods(self):
         self.file_dialog_open_table = FileDialogOpenTable(self)
         self.file_dialog_open_txt = FileDialogOpenTxt(self)
@@ -155,10 +317,23 @@ class View(QWidget):
         self.dialog_output_read1_read2_suffix = DialogOutputRead1Read2Suffix(self)
         self.dialog_bed_file = DialogBedFile(self)
         self.dialog_fill_in_cell_values = DialogFillInCellValues(self)
+        self.dialog_progress = DialogProgress(self)
 
     def refresh_table(self):
         self.table.refresh_table()
 
+    def refresh_status(self, event: Optional[ChangeEvent] = None):
+        self.status.setText(format_status(
+            n_rows=len(self.model.dataframe),
+            n_undo=len(self.model.undo_cache),
+            n_redo=len(self.model.redo_cache),
+            usage=self.model.get_memory_usage(),
+            max_bytes=self.model.max_memory_bytes))
+
+    def set_buttons_enabled(self, enabled: bool):
+        for name in self.BUTTON_NAME_TO_LABEL.keys():
+            getattr(self, f'button_{name}').setEnabled(enabled)
+
     def get_selected_rows(self) -> List[int]:
         return self.table.get_selected_rows()
 
@@ -172,6 +347,15 @@ class View(QWidget):
 #
 
 
+TABLE_NAME_FILTER = ';;'.join([
+    'All Files (*.*)',
+    'CSV files (*.csv)',
+    'Excel files (*.xlsx)',
+    'Snapshot files (*.feather *.parquet *.pkl)',  # keep the dtypes, fast to read back
+    'SQLite files (*.sqlite *.db)',
+])
+
+
 class FileDialog:
 
     parent: QWidget
@@ -186,7 +370,7 @@ class FileDialogOpenTable(FileDialog):
         d = QFileDialog(self.parent)
         d.resize(1200, 800)
         d.setWindowTitle(caption)
-        d.setNameFilter('All Files (*.*);;CSV files (*.csv);;Excel files (*.xlsx)')
+        d.setNameFilter(TABLE_NAME_FILTER)
         d.selectNameFilter('CSV files (*.csv)')
         d.setOptions(QFileDialog.DontUseNativeDialog)
         d.setFileMode(QFileDialog.ExistingFile)  # only one existing file can be selected
@@ -227,7 +411,7 @@ class FileDialogSaveTable(FileDialog):
         d.resize(1200, 800)
         d.setWindowTitle('Save As')
         d.selectFile(filename)
-        d.setNameFilter('All Files (*.*);;CSV files (*.csv);;Excel files (*.xlsx)')
+        d.setNameFilter(TABLE_NAME_FILTER)
         d.selectNameFilter('CSV files (*.csv)')
         d.setOptions(QFileDialog.DontUseNativeDialog)
         d.setAcceptMode(QFileDialog.AcceptSave)
@@ -402,3 +586,44 @@ class DialogFillInCellValues(DialogLineEdits):
     LINE_DEFAULTS = [
         '',
     ]
+
+
+#
+
+
+class DialogProgress:
+
+    STEPS = 1000
+
+    parent: QWidget
+    dialog: QProgressDialog
+    on_cancel: Callable[[], None]
+
+    def __init__(self, parent: QWidget):
+        self.parent = parent
+        self.dialog = QProgressDialog(parent=self.parent)
+        self.dialog.setWindowModality(Qt.NonModal)  # the table can still be browsed
+        self.dialog.setRange(0, self.STEPS)
+        self.dialog.setMinimumWidth(480)
+        self.dialog.setAutoReset(False)  # stays at 100% until the task has finished
+        self.dialog.canceled.connect(self.cancel)
+        self.dialog.reset()  # hidden, and not shown until started
+        self.on_cancel = lambda: None
+
+    def start(self, label: str, on_cancel: Callable[[], None]):
+        self.on_cancel = on_cancel
+        self.dialog.setWindowTitle(label)
+        self.dialog.setLabelText(label)
+        self.dialog.setValue(0)  # shown only if the task takes longer than the minimum duration
+
+    def update(self, fraction: float, message: str):
+        self.dialog.setValue(int(min(max(fraction, 0.), 1.) * self.STEPS))
+        if message != '':
+            self.dialog.setLabelText(message)
+
+    def cancel(self):
+        self.on_cancel()
+
+    def finish(self):
+        self.on_cancel = lambda: None
+        self.dialog.reset()
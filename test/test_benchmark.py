@@ -0,0 +1,29 @@
+import pandas as pd
+from benchmark.generate import GenerateData
+from benchmark.run import Benchmark, compare
+from .setup import TestCase
+
+
+class TestBenchmark(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_generate_data(self):
+        a = GenerateData().main(n_rows=500, outdir=self.workdir)
+        b = GenerateData().main(n_rows=500, outdir=self.outdir)
+        pd.testing.assert_frame_equal(a.sequencing_table, b.sequencing_table)  # deterministic
+        self.assertEqual(500, len(a.sequencing_table))
+        self.assertEqual(50, len(a.patient_sample_sheet))
+        self.assertTrue(a.sequencing_table['ID'].is_unique)
+
+    def test_main(self):
+        results = Benchmark().main(sizes=['1k'], operations=['sort_dataframe', 'build_run_table'], repeat=1)
+        self.assertListEqual(['sort_dataframe', 'build_run_table'], list(results['1k'].keys()))
+
+        baseline = {'1k': {'sort_dataframe': {'seconds': 1e-6, 'peak_mb': 1e6}}}
+        regressions = compare(results, baseline=baseline, tolerance=2.0, min_seconds=0)
+        self.assertEqual(1, len(regressions))  # slower but smaller
@@ -0,0 +1,41 @@
+from src.cache import ReferenceCache
+from .setup import TestCase
+
+
+class TestReferenceCache(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.file = f'{self.workdir}/sequencing-batch-table.csv'
+        with open(self.file, 'w') as fh:
+            fh.write('ID,BED File\nSEQ_BATCH_001,a.bed\n')
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_get(self):
+        cache = ReferenceCache()
+        loads = []
+
+        def load():
+            loads.append(1)
+            return len(loads)
+
+        self.assertEqual(1, cache.get(self.file, key='table', load=load))
+        self.assertEqual(1, cache.get(self.file, key='table', load=load))
+        self.assertEqual(2, cache.get(self.file, key='lookup', load=load))
+        self.assertDictEqual({'hits': 1, 'misses': 2, 'entries': 2}, cache.stats())
+
+        with open(self.file, 'a') as fh:
+            fh.write('SEQ_BATCH_002,b.bed\n')  # the size changes
+        self.assertEqual(3, cache.get(self.file, key='table', load=load))
+        self.assertEqual(1, cache.stats()['entries'])  # entries of the old file are dropped
+
+    def test_lru(self):
+        cache = ReferenceCache()
+        cache.MAX_ENTRIES = 2
+        for key in ['a', 'b', 'a', 'c']:
+            cache.get(self.file, key=key, load=lambda: key)
+        cache.get(self.file, key='a', load=lambda: 'reloaded')
+        self.assertEqual('b', cache.get(self.file, key='b', load=lambda: 'b'))
+        self.assertEqual(2, cache.stats()['hits'])  # 'a' twice, 'b' was evicted
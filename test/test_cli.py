@@ -0,0 +1,143 @@
+import io
+import sys
+import shutil
+import subprocess
+import pandas as pd
+from os.path import exists
+from contextlib import redirect_stderr
+from src.cli import CommandLine
+from src.profiling import ProfileStartup
+from .setup import TestCase
+
+
+class TestCommandLine(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.table = f'{self.workdir}/sequencing-table.csv'
+        shutil.copy(f'{self.indir}/sequencing-table.csv', self.table)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_import(self):
+        exit_code = CommandLine().main([
+            'import',
+            '--table', self.table,
+            f'{self.indir}/patient-sample-sheet-nan.csv',  # fails, the other sheets are still imported
+            f'{self.indir}/patient-sample-sheet-batch.csv',
+            '--output', f'{self.outdir}/sequencing-table.csv',
+        ])
+        self.assertEqual(1, exit_code)
+        self.assertEqual(5, len(pd.read_csv(f'{self.outdir}/sequencing-table.csv')))
+
+    def test_fill(self):
+        exit_code = CommandLine().main([
+            'fill',
+            '--table', self.table,
+            f'{self.indir}/mapping-id.csv',
+            '--output', f'{self.outdir}/sequencing-table.csv',
+        ])
+        self.assertEqual(0, exit_code)  # unmatched IDs are only warned
+        df = pd.read_csv(f'{self.outdir}/sequencing-table.csv')
+        self.assertEqual(['SEQ_BATCH_010'], df['Sequencing Batch ID'].tolist())
+
+    def test_build_run_table(self):
+        exit_code = CommandLine().main([
+            'build-run-table',
+            '--table', f'{self.indir}/seq-df.csv',
+            '--sequencing-batch-table', f'{self.indir}/sequencing-batch-table.csv',
+            '--use-lab-sample-id',
+            '--outdir', self.outdir,
+            f'{self.indir}/batch-1.txt',
+        ])
+        self.assertEqual(0, exit_code)
+        self.assertDataFrameEqual(
+            first=pd.read_csv(f'{self.outdir}/batch-1-run-table.csv'),
+            second=pd.read_csv(f'{self.indir}/run-table.csv'),
+        )
+
+    def test_copy_fastq(self):
+        ids_file = f'{self.workdir}/ids.txt'
+        with open(ids_file, 'w') as fh:
+            fh.write('001-00001-0101-E-X01-01\n')
+        for r in ['R1', 'R2']:
+            with open(f'{self.workdir}/VGH001_N_S1_{r}.fastq.gz', 'w') as fh:
+                fh.write(r)
+
+        exit_code = CommandLine().main([
+            'copy-fastq',
+            '--table', self.table,
+            '--fastq-dir', self.workdir,
+            '--dst-dir', self.outdir,
+            '--per-destination', '1',
+            ids_file,
+        ])
+        self.assertEqual(0, exit_code)
+        self.assertTrue(exists(f'{self.outdir}/001-00001-0101-E-X01-01_R2.fastq.gz'))
+
+    def test_missing_ids(self):
+        ids_file = f'{self.workdir}/ids.txt'
+        with open(ids_file, 'w') as fh:
+            fh.write('001-00001-0101-E-X01-01\n001-00009-0101-E-X01-01\n')
+        for r in ['R1', 'R2']:
+            with open(f'{self.workdir}/VGH001_N_S1_{r}.fastq.gz', 'w') as fh:
+                fh.write(r)
+
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            exit_code = CommandLine().main([
+                'copy-fastq',
+                '--table', self.table,
+                '--fastq-dir', self.workdir,
+                '--dst-dir', self.outdir,
+                ids_file,
+            ])
+        self.assertEqual(1, exit_code)
+        self.assertIn('"001-00009-0101-E-X01-01" of "ids.txt" not found', stderr.getvalue())
+        self.assertNotIn('001-00001-0101-E-X01-01', stderr.getvalue())
+        self.assertTrue(exists(f'{self.outdir}/001-00001-0101-E-X01-01_R2.fastq.gz'))  # the IDs found are copied
+
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            exit_code = CommandLine().main([
+                'build-run-table',
+                '--table', self.table,
+                '--sequencing-batch-table', f'{self.indir}/sequencing-batch-table.csv',
+                '--outdir', self.outdir,
+                ids_file,
+            ])
+        self.assertEqual(1, exit_code)
+        self.assertIn('"001-00009-0101-E-X01-01" of "ids.txt" not found', stderr.getvalue())
+
+    def test_export(self):
+        CommandLine().main([
+            'export',
+            '--table', f'{self.indir}/seq-df.csv',
+            '--sort-by', 'Patient Sequencing Number',
+            '--descending',
+            '--output', f'{self.outdir}/seq-df.pkl',
+        ])
+        actual = pd.read_pickle(f'{self.outdir}/seq-df.pkl')['Patient Sequencing Number'].tolist()
+        self.assertListEqual(sorted(actual, reverse=True), actual)
+
+    def test_no_pyqt(self):
+        code = '; '.join([
+            'import sys',
+            'from src.cli import CommandLine',
+            f'CommandLine().main(["export", "-t", "{self.table}", "-o", "{self.outdir}/table.csv"])',
+            'assert "PyQt5" not in sys.modules',
+        ])
+        subprocess.check_call([sys.executable, '-c', code], stdout=subprocess.DEVNULL)
+
+    def test_lazy_imports(self):
+        code = '; '.join([
+            'import sys',
+            'import src.cli',
+            'assert not any(m in sys.modules for m in ["PyQt5", "pandas", "sqlite3"]), "loaded at startup"',
+        ])
+        subprocess.check_call([sys.executable, '-c', code])
+
+    def test_profile_startup(self):
+        report = ProfileStartup().main(targets={'command line': 'src.cli'})
+        self.assertIn('src.cli', report)
@@ -0,0 +1,204 @@
+import os
+import random
+import hashlib
+from src import fastq
+from src.tools import get_files
+from src.fastq import CopyFile, CopyScheduler, DirectoryIndex, CorrectionIndex, get_directory_index, read_file_names
+from .setup import TestCase
+
+
+class TestCopyFile(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.src = f'{self.workdir}/sample_R1.fastq.gz'
+        self.content = os.urandom(3 * 1024 ** 2 + 7)
+        with open(self.src, 'wb') as fh:
+            fh.write(self.content)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        dst = f'{self.outdir}/sample_R1.fastq.gz'
+        copied = []
+        copy_file = CopyFile()
+        copy_file.BLOCK_SIZE = 1024 ** 2
+        actual = copy_file.main(src=self.src, dst=dst, progress=copied.append)
+
+        self.assertEqual(hashlib.blake2b(self.content).hexdigest(), actual)
+        with open(dst, 'rb') as fh:
+            self.assertEqual(self.content, fh.read())
+        self.assertListEqual([1024 ** 2] * 3 + [7], copied)
+
+    def test_md5_fsync(self):
+        dst = f'{self.outdir}/sample_R1.fastq.gz'
+        actual = CopyFile().main(src=self.src, dst=dst, algorithm='md5', verify='fsync')
+        self.assertEqual(hashlib.md5(self.content).hexdigest(), actual)
+
+    def test_hash_mismatch(self):
+        dst = f'{self.outdir}/sample_R1.fastq.gz'
+        file_hash = fastq.file_hash
+        fastq.file_hash = lambda *args, **kwargs: 'corrupted'
+        try:
+            with self.assertRaises(AssertionError):
+                CopyFile().main(src=self.src, dst=dst)
+        finally:
+            fastq.file_hash = file_hash
+        self.assertFalse(os.path.exists(dst))
+
+    def test_existing_dst(self):
+        dst = f'{self.outdir}/sample_R1.fastq.gz'
+        with open(dst, 'w') as fh:
+            fh.write('existing')
+        with self.assertRaises(FileExistsError):
+            CopyFile().main(src=self.src, dst=dst)
+        self.assertTrue(os.path.exists(dst))
+
+    def test_missing_src_existing_dst(self):
+        dst = f'{self.outdir}/sample_R1.fastq.gz'
+        with open(dst, 'w') as fh:
+            fh.write('existing')
+        with self.assertRaises(FileNotFoundError):
+            CopyFile().main(src=f'{self.workdir}/missing_R1.fastq.gz', dst=dst)
+        self.assertTrue(os.path.exists(dst))  # not created by this copy
+
+
+class TestCopyScheduler(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        jobs = []
+        for i in range(6):
+            src = f'{self.workdir}/sample-{i}_R1.fastq.gz'
+            with open(src, 'wb') as fh:
+                fh.write(os.urandom(1024 * (i + 1)))
+            jobs.append((src, f'{self.outdir}/copied-{i}_R1.fastq.gz'))
+        jobs.append((f'{self.workdir}/missing_R1.fastq.gz', f'{self.outdir}/missing_R1.fastq.gz'))
+
+        progress = []
+        scheduler = CopyScheduler()
+        copy_jobs = scheduler.main(jobs=jobs, progress=lambda *args: progress.append(args))
+
+        for job in copy_jobs[:6]:
+            with open(job.src, 'rb') as a, open(job.dst, 'rb') as b:
+                self.assertEqual(a.read(), b.read())
+        self.assertEqual(1, len(scheduler.get_errors()))  # all errors are reported at the end
+        self.assertEqual(1024 * 21, max(p[0] for p in progress))  # callbacks from threads may interleave
+        self.assertEqual(1024 * 21, progress[-1][1])
+
+    def test_limits(self):
+        jobs = []
+        for i in range(3):
+            src = f'{self.workdir}/sample-{i}_R1.fastq.gz'
+            with open(src, 'wb') as fh:
+                fh.write(os.urandom(1024))
+            jobs.append((src, f'{self.outdir}/copied-{i}_R1.fastq.gz'))
+
+        scheduler = CopyScheduler()
+        scheduler.main(jobs=jobs, max_workers=2, per_source=1, per_destination=1)  # one copy at a time
+        self.assertEqual(0, len(scheduler.get_errors()))
+        self.assertEqual(1, scheduler.per_destination)
+
+        with self.assertRaises(AssertionError):
+            CopyScheduler().main(jobs=jobs, per_destination=0)
+
+
+class TestDirectoryIndex(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        for name in [
+            'VGH001_N_R1.fastq.gz',
+            'VGH001_N_R2.fastq.gz',
+            'VGH001_N2_R1.fastq.gz',
+            'VGH001_T_R1.fastq.gz',
+            'VGH002_N_R1.fastq.gz',
+        ]:
+            open(f'{self.workdir}/{name}', 'w').close()
+        os.makedirs(f'{self.workdir}/VGH001_N_R1.fastq.gz.dir')
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_find(self):
+        index = DirectoryIndex(self.workdir)
+        actual = index.find(startswith='VGH001_N', endswith='_R1.fastq.gz')
+        expected = ['VGH001_N2_R1.fastq.gz', 'VGH001_N_R1.fastq.gz']
+        self.assertListEqual(expected, actual)
+        self.assertListEqual(get_files(self.workdir, 'VGH001_N', '_R1.fastq.gz'), actual)
+        self.assertListEqual([f'{self.workdir}/VGH002_N_R1.fastq.gz'], index.find('VGH002', isfullpath=True))
+
+    def test_get_directory_index(self):
+        index = get_directory_index(self.workdir)
+        self.assertIs(index, get_directory_index(self.workdir))
+
+        open(f'{self.workdir}/VGH003_N_R1.fastq.gz', 'w').close()
+        os.utime(self.workdir, ns=(0, index.mtime_ns + 1))  # make sure the modification is seen
+        new = get_directory_index(self.workdir)
+        self.assertIsNot(index, new)
+        self.assertListEqual(['VGH003_N_R1.fastq.gz'], new.find(startswith='VGH003'))
+
+
+class TestCorrectionIndex(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_find(self):
+        names = [
+            'Xi-cancer_EXTRA_R1.fastq.gz',
+            'Xi-cancer_R1.fastq.gz',
+            'Xi-cancer_R2.fastq.gz',
+            'Xi-cancer_EXTRA_R1.fastq.gz',
+            'md5sum.txt',
+        ]
+        index = CorrectionIndex(names=names, suffixes=['_R1.fastq.gz', '_R2.fastq.gz'])
+        self.assertTupleEqual(('Xi-cancer_EXTRA_R1.fastq.gz', 2), index.find('Xi-cancer', '_R1.fastq.gz'))
+        self.assertTupleEqual(('Xi-cancer_R2.fastq.gz', 1), index.find('Xi-cancer', '_R2.fastq.gz'))
+        self.assertTupleEqual((None, 0), index.find('Li-cancer', '_R1.fastq.gz'))
+
+    def test_same_as_linear_scan(self):
+        rnd = random.Random(0)
+        prefixes = [f'S{i}' for i in range(50)]
+        suffixes = ['_R1.fastq.gz', '_R2.fastq.gz']
+        names = [f'{rnd.choice(prefixes)}{rnd.choice(["", "_x", "0"])}{rnd.choice(suffixes + [".md5"])}' for _ in range(500)]
+        index = CorrectionIndex(names=names, suffixes=suffixes)
+        for prefix in prefixes:
+            for suffix in suffixes:
+                matches = [f for f in names if f.startswith(prefix) and f.endswith(suffix)]
+                expected = (matches[0] if matches else None, len(set(matches)))
+                self.assertTupleEqual(expected, index.find(prefix, suffix))
+
+
+class TestReadFileNames(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        rnd = random.Random(0)
+        tokens = [rnd.choice(['a_R1.fastq.gz', 'bb_R2.fastq.gz', 'd41d8cd98f00b204', 'x']) for _ in range(300)]
+        text = ''.join(t + rnd.choice([' ', '  ', '\t', '\n', '\r\n']) for t in tokens)
+        file = f'{self.workdir}/md5sum.txt'
+        with open(file, 'w', newline='') as fh:
+            fh.write(text)
+
+        with open(file) as fh:
+            expected = [t for t in fh.read().replace('\t', ' ').replace('\n', ' ').split(' ') if t != '']
+        for chunk_size in [1, 7, 1024]:
+            self.assertListEqual(expected, list(read_file_names(file, chunk_size=chunk_size)))
+
+        actual = list(read_file_names(file, suffixes=('_R1.fastq.gz', '_R2.fastq.gz'), chunk_size=5))
+        self.assertListEqual([t for t in expected if t.endswith('.fastq.gz')], actual)
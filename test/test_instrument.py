@@ -0,0 +1,84 @@
+import json
+import inspect
+from os import listdir
+from src.model import Model
+from src.controller import Action
+from src.instrument import INSTRUMENTATION, Instrumentation
+from .setup import TestCase
+
+
+class TestInstrumentation(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        INSTRUMENTATION.clear()
+
+    def tearDown(self):
+        INSTRUMENTATION.log_file = None
+        INSTRUMENTATION.profile_name = None
+        INSTRUMENTATION.clear()
+        self.tear_down()
+
+    def test_model_records(self):
+        model = Model()
+        model.read_sequencing_table(file=f'{self.indir}/sequencing-table.csv')
+        model.import_patient_sample_sheet(file=f'{self.indir}/patient-sample-sheet-batch.csv')
+        model.fill_in_cell_values(cells=[(1, 'Vial'), (2, 'Vial')], value='B')
+        model.undo()
+        model.get_memory_usage()  # getters are not recorded
+
+        names = [r['name'] for r in INSTRUMENTATION.get_records()]
+        expected = [
+            'Model.read_sequencing_table',
+            'Model.import_patient_sample_sheet',
+            'Model.fill_in_cell_values',
+            'Model.undo',
+        ]
+        self.assertListEqual(expected, names)
+        read, = INSTRUMENTATION.get_records('Model.read_sequencing_table')
+        fill, = INSTRUMENTATION.get_records('Model.fill_in_cell_values')
+        undo, = INSTRUMENTATION.get_records('Model.undo')
+        self.assertGreater(read['bytes_read'], 0)
+        self.assertEqual(2, fill['rows_touched'])
+        self.assertGreater(fill['undo_steps'], 0)
+        self.assertGreater(fill['undo_bytes'], 0)
+        self.assertEqual(2, undo['rows_touched'])
+        self.assertEqual(fill['undo_steps'] - 1, undo['undo_steps'])
+
+    def test_error(self):
+        model = Model()
+        with self.assertRaises(KeyError):
+            model.sort_dataframe(by='Not A Column', ascending=True)
+        self.assertIn('KeyError', INSTRUMENTATION.get_records('Model.sort_dataframe')[0]['error'])
+
+    def test_log_and_profile(self):
+        INSTRUMENTATION.log_file = f'{self.outdir}/log.jsonl'
+        INSTRUMENTATION.profile_name = 'Model.sort_dataframe'
+        INSTRUMENTATION.profile_dir = self.outdir
+
+        model = Model()
+        model.read_sequencing_table(file=f'{self.indir}/sequencing-table.csv')
+        model.sort_dataframe(by='ID', ascending=False)
+
+        with open(f'{self.outdir}/log.jsonl') as fh:
+            names = [json.loads(line)['name'] for line in fh]
+        self.assertEqual(['Model.read_sequencing_table', 'Model.sort_dataframe'], names)
+        profiles = [f for f in listdir(self.outdir) if f.endswith('.prof')]
+        self.assertEqual(1, len(profiles))
+        self.assertTrue(profiles[0].startswith('Model.sort_dataframe-'))
+
+    def test_ring_buffer(self):
+        instrumentation = Instrumentation()
+        for i in range(Instrumentation.MAX_RECORDS + 10):
+            instrumentation.record({'name': str(i), 'seconds': 0.})
+        records = instrumentation.get_records()
+        self.assertEqual(Instrumentation.MAX_RECORDS, len(records))
+        self.assertEqual('10', records[0]['name'])
+
+    def test_instrumented_methods(self):
+        getters = ['add_listener', 'get_dataframe', 'get_index', 'get_memory_usage', 'count_recoverable_edits']
+        for name, method in inspect.getmembers(Model, predicate=inspect.isfunction):
+            if not name.startswith('_'):
+                self.assertEqual(name not in getters, getattr(method, 'instrumented', False), name)
+        for action in Action.__subclasses__():
+            self.assertTrue(action.__call__.instrumented, action.__name__)
@@ -0,0 +1,137 @@
+import os
+import shutil
+import pandas as pd
+from src.model import Model
+from src.journal import Journal
+from .setup import TestCase
+
+
+class TestJournal(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.file = f'{self.workdir}/sequencing-table.csv'
+        shutil.copy(f'{self.indir}/sequencing-table.csv', self.file)
+        self.key_file = Journal.KEY_FILE
+        Journal.KEY_FILE = f'{self.workdir}/journal.key'
+
+    def tearDown(self):
+        Journal.KEY_FILE = self.key_file
+        self.tear_down()
+
+    def edit(self, model: Model):
+        model.import_patient_sample_sheet(file=f'{self.indir}/patient-sample-sheet-batch.csv')
+        model.fill_in_cell_values(cells=[(1, 'Vial'), (2, 'Vial')], value='B')
+        model.sort_dataframe(by='ID', ascending=False)
+        model.drop(rows=[0])
+        model.undo()
+
+    def test_replay(self):
+        model = Model(journal_fsync='always')
+        model.read_sequencing_table(file=self.file)
+        self.edit(model)  # then crashes without saving
+
+        new = Model(journal_fsync='always')
+        new.read_sequencing_table(file=self.file, recover=True)
+        pd.testing.assert_frame_equal(model.dataframe, new.dataframe)
+
+        new.undo()  # replayed edits can be undone
+        self.assertEqual(4, len(new.dataframe))
+
+    def test_reread(self):
+        model = Model(journal_fsync='always')
+        model.read_sequencing_table(file=self.file)
+        expected = model.dataframe.copy()
+        self.edit(model)
+        self.assertEqual(0, model.count_recoverable_edits(file=self.file))  # the journal of this session
+
+        model.read_sequencing_table(file=self.file)  # the edits are abandoned
+        pd.testing.assert_frame_equal(expected, model.dataframe)
+        model.close_journal()  # a clean shutdown
+        self.assertEqual(0, Model(journal_fsync='always').count_recoverable_edits(file=self.file))
+
+    def test_not_recovered(self):
+        model = Model(journal_fsync='always')
+        model.read_sequencing_table(file=self.file)
+        expected = model.dataframe.copy()
+        self.edit(model)  # then crashes without saving
+
+        new = Model(journal_fsync='always')
+        self.assertEqual(5, new.count_recoverable_edits(file=self.file))
+        new.read_sequencing_table(file=self.file)  # declined, the journal is dropped
+        pd.testing.assert_frame_equal(expected, new.dataframe)
+        self.assertEqual(0, Model(journal_fsync='always').count_recoverable_edits(file=self.file))
+
+    def test_truncated_record(self):
+        model = Model(journal_fsync='always')
+        model.read_sequencing_table(file=self.file)
+        model.import_patient_sample_sheet(file=f'{self.indir}/patient-sample-sheet-batch.csv')
+        expected = model.dataframe.copy()
+        model.fill_in_cell_values(cells=[(1, 'Vial')], value='B')
+        with open(f'{self.file}.journal', 'r+b') as fh:
+            fh.truncate(fh.seek(0, 2) - 1)  # the last record is cut short by a crash
+
+        new = Model(journal_fsync='always')
+        new.read_sequencing_table(file=self.file, recover=True)
+        pd.testing.assert_frame_equal(expected, new.dataframe)
+
+    def test_save(self):
+        model = Model(journal_fsync='never')
+        model.read_sequencing_table(file=self.file)
+        self.edit(model)
+        model.save_sequencing_table(file=self.file)
+        _, deltas = Journal(table_file=self.file).load()
+        self.assertEqual(0, len(deltas))
+
+        with open(self.file, 'a') as fh:
+            fh.write('\n')  # modified elsewhere, the journal no longer applies
+        model.fill_in_cell_values(cells=[(0, 'Vial')], value='C')
+        self.assertIsNone(Journal(table_file=self.file).load())
+
+    def test_undecodable_journal(self):
+        for content in [b'garbage' * 100, b'\0' * 4096]:  # e.g. zero-filled by a crash
+            with open(f'{self.file}.journal', 'wb') as fh:
+                fh.write(content)
+            model = Model(journal_fsync='always')
+            self.assertEqual(0, model.count_recoverable_edits(file=self.file))
+            model.read_sequencing_table(file=self.file, recover=True)  # the journal is dropped
+            self.assertEqual(1, len(model.dataframe))
+            model.fill_in_cell_values(cells=[(0, 'Vial')], value='B')
+            self.assertEqual(1, Model(journal_fsync='always').count_recoverable_edits(file=self.file))
+
+    def test_journal_of_another_user(self):
+        model = Model(journal_fsync='always')
+        model.read_sequencing_table(file=self.file)
+        self.edit(model)  # then crashes without saving
+
+        Journal.KEY_FILE = f'{self.workdir}/another.key'
+        new = Model(journal_fsync='always')
+        self.assertEqual(0, new.count_recoverable_edits(file=self.file))  # never unpickled
+        new.read_sequencing_table(file=self.file, recover=True)
+        self.assertEqual(1, len(new.dataframe))
+
+    def test_unwritable_journal(self):
+        os.mkdir(f'{self.file}.journal.tmp')  # the journal cannot be written
+        model = Model(journal_fsync='always')
+        model.read_sequencing_table(file=self.file)
+        self.assertIsNone(model.journal)
+
+        model.fill_in_cell_values(cells=[(0, 'Vial')], value='Q')  # editing goes on without the journal
+        self.assertEqual(2, len(model.undo_cache))
+        model.undo()
+        self.assertEqual('X', model.dataframe.loc[0, 'Vial'])
+
+    def test_compact(self):
+        model = Model(journal_fsync='interval')
+        model.read_sequencing_table(file=self.file)
+        model.import_patient_sample_sheet(file=f'{self.indir}/patient-sample-sheet-batch.csv')
+        model.journal.compact(dataframe=model.dataframe.copy(), offset=model.journal.tell())
+        model.fill_in_cell_values(cells=[(1, 'Vial')], value='B')
+
+        base, deltas = Journal(table_file=self.file).load()
+        self.assertNotEqual(self.file, base)  # a snapshot
+        self.assertEqual(1, len(deltas))
+
+        new = Model(journal_fsync='interval')
+        new.read_sequencing_table(file=self.file, recover=True)
+        pd.testing.assert_frame_equal(model.dataframe, new.dataframe)
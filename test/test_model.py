@@ -1,5 +1,9 @@
+import unittest
 import pandas as pd
-from src.model import Model, BuildRunTable
+import src.model
+from importlib.util import find_spec
+from src.model import Model, BuildRunTable, ReadTable, SequencingTableIndex, write_table
+from src.tasks import Task, Cancelled
 from .setup import TestCase
 
 
@@ -56,6 +60,64 @@ class TestModel(TestCase):
         self.assertListEqual(expected, actual)
         self.assertEqual(2, len(model.undo_cache))
 
+    def test_import_multiple_rows(self):
+        model = Model()
+        model.read_sequencing_table(file=f'{self.indir}/sequencing-table.csv')
+        model.import_patient_sample_sheet(file=f'{self.indir}/patient-sample-sheet-batch.csv')
+        actual = model.dataframe['ID'].tolist()
+        expected = [
+            '001-00001-0101-E-X01-01',
+            '001-00002-0101-E-X01-01',  # new patient
+            '001-00001-0102-E-X01-02',  # existing patient, new sample
+            '001-00002-0102-E-X01-02',  # patient added earlier in the same sheet
+            '001-00003-0101-E-X01-01',  # duplicated sample in the sheet is skipped
+        ]
+        self.assertListEqual(expected, actual)
+        self.assertEqual(2, len(model.undo_cache))
+
+    def test_index(self):
+        model = Model()
+        model.read_sequencing_table(file=f'{self.indir}/sequencing-table.csv')
+        model.import_patient_sample_sheet(file=f'{self.indir}/patient-sample-sheet-batch.csv')
+        index = model.get_index()
+        self.assertTrue(index.has_sample('CCY_LAB', 'VGH003', 'VGH003_T'))
+        self.assertEqual(2, index.get_patient_id('CCY_LAB', 'VGH003'))
+        self.assertEqual(2, index.get_sequencing_count(2))
+        self.assertEqual(3, index.max_patient_id)
+
+        model.fill_in_cell_values(cells=[(4, 'Lab Sample ID')], value='VGH004_T')
+        index = model.get_index()
+        self.assertFalse(index.has_sample('CCY_LAB', 'VGH004', 'VGH004_N'))
+        self.assertEqual(1, index.sample_key_to_count[('CCY_LAB', 'VGH004', 'VGH004_T')])
+
+        model.undo()
+        self.assertTrue(model.get_index().has_sample('CCY_LAB', 'VGH004', 'VGH004_N'))
+
+    def test_index_incremental(self):
+        model = Model()
+        model.read_sequencing_table(file=f'{self.indir}/sequencing-table.csv')
+        index = model.get_index()
+        model.import_patient_sample_sheet(file=f'{self.indir}/patient-sample-sheet-batch.csv')
+
+        edits = [
+            lambda: model.sort_dataframe(by='Lab Sample ID', ascending=False),
+            lambda: model.drop(rows=[1, 3]),
+            model.undo,  # rows inserted back in the middle
+            lambda: model.fill_in_cell_values(cells=[(0, 'Lab Patient ID'), (0, 'Patient ID')], value='9'),
+            lambda: model.drop(rows=[0, 1, 2, 3, 4]),
+            model.undo,
+            model.undo,
+            model.redo,
+        ]
+        for edit in edits:
+            edit()
+            self.assertIs(index, model.index)  # updated, not rebuilt
+            expected = SequencingTableIndex().build(model.dataframe)
+            self.assertDictEqual(expected.patient_key_to_patient_ids, index.patient_key_to_patient_ids)
+            self.assertDictEqual(expected.sample_key_to_count, index.sample_key_to_count)
+            self.assertDictEqual(expected.patient_id_to_count, index.patient_id_to_count)
+            self.assertEqual(expected.max_patient_id, index.max_patient_id)
+
     def test_import_nan_exception(self):
         model = Model()
         model.read_sequencing_table(file=f'{self.indir}/sequencing-table.csv')
@@ -63,6 +125,16 @@ class TestModel(TestCase):
             model.import_patient_sample_sheet(file=f'{self.indir}/patient-sample-sheet-nan.csv')
         self.assertEqual(1, len(model.undo_cache))
 
+    def test_cancelled_import(self):
+        model = Model()
+        model.read_sequencing_table(file=f'{self.indir}/sequencing-table.csv')
+        task = Task()
+        task.cancel()
+        with self.assertRaises(Cancelled):
+            model.import_patient_sample_sheet(file=f'{self.indir}/patient-sample-sheet-batch.csv', task=task)
+        self.assertEqual(1, len(model.dataframe))  # nothing is committed
+        self.assertEqual(1, len(model.undo_cache))
+
     def test_undo(self):
         model = Model()
         model.read_sequencing_table(file=f'{self.indir}/sequencing-table.csv')
@@ -76,6 +148,225 @@ class TestModel(TestCase):
         model.redo()
         self.assertEqual(1, len(model.dataframe))
 
+    def test_undo_redo_edits(self):
+        model = Model()
+        model.read_sequencing_table(file=f'{self.indir}/sequencing-table.csv')
+        model.import_patient_sample_sheet(file=f'{self.indir}/patient-sample-sheet-batch.csv')
+        states = [model.dataframe.copy()]
+
+        model.sort_dataframe(by='Lab Sample ID', ascending=False)
+        states.append(model.dataframe.copy())
+        model.fill_in_cell_values(cells=[(0, 'Vial'), (1, 'Sequencing Batch ID')], value='SEQ_BATCH_002')
+        states.append(model.dataframe.copy())
+        model.drop(rows=[1, 3], columns=['Vial'])
+        states.append(model.dataframe.copy())
+
+        for expected in reversed(states[:-1]):
+            model.undo()
+            pd.testing.assert_frame_equal(expected, model.dataframe)
+        for expected in states[1:]:
+            model.redo()
+            pd.testing.assert_frame_equal(expected, model.dataframe)
+
+    def test_undo_memory_budget(self):
+        model = Model(max_undo_bytes=0)
+        model.read_sequencing_table(file=f'{self.indir}/sequencing-table.csv')
+        model.sort_dataframe(by='ID', ascending=True)
+        model.sort_dataframe(by='ID', ascending=False)
+        self.assertEqual(1, len(model.undo_cache))  # only the latest edit is kept
+
+    def test_fill_in_cell_values_by_column(self):
+        model = Model()
+        model.read_sequencing_table(file=f'{self.indir}/sequencing-table.csv')
+        model.import_patient_sample_sheet(file=f'{self.indir}/patient-sample-sheet-batch.csv')
+        expected = model.dataframe.copy()
+
+        model.fill_in_cell_values(cells=[(3, 'Vial'), (1, 'Vial Sequencing Number'), (1, 'Vial')], value='2')
+        self.assertEqual(['2', '2'], model.dataframe.loc[[1, 3], 'Vial'].tolist())
+        self.assertEqual(2, model.dataframe.loc[1, 'Vial Sequencing Number'])  # cast to the integer column
+        self.assertEqual('Int64', model.dataframe['Vial Sequencing Number'].dtype)
+
+        model.undo()  # one step for all columns
+        pd.testing.assert_frame_equal(expected, model.dataframe)
+
+    def test_fill_in_cell_values_error(self):
+        model = Model()
+        model.read_sequencing_table(file=f'{self.indir}/sequencing-table.csv')
+        expected = model.dataframe.copy()
+        with self.assertRaises(AssertionError):
+            model.fill_in_cell_values(cells=[(0, 'Vial'), (0, 'Not A Column')], value='B')
+        with self.assertRaises(AssertionError):
+            model.fill_in_cell_values(cells=[(0, 'Vial'), (len(expected), 'Vial')], value='B')
+        with self.assertRaises(ValueError):  # text in an integer column
+            model.fill_in_cell_values(cells=[(0, 'Vial'), (0, 'Vial Sequencing Number')], value='abc')
+        with self.assertRaises(ValueError):
+            model.fill_in_cell_values(cells=[(0, 'Import Date')], value='not a date')
+        pd.testing.assert_frame_equal(expected, model.dataframe)
+        self.assertEqual(1, len(model.undo_cache))
+
+    def test_fill_in_mapping_file_by_id(self):
+        model = Model()
+        model.read_sequencing_table(file=f'{self.indir}/sequencing-table.csv')
+        expected = model.dataframe.copy()
+
+        unmatched = model.fill_in_mapping_file(file=f'{self.indir}/mapping-id.csv')
+        self.assertEqual(['NOT_AN_ID'], unmatched)
+        self.assertEqual('SEQ_BATCH_010', model.dataframe.loc[0, 'Sequencing Batch ID'])
+        self.assertEqual(2, model.dataframe.loc[0, 'Vial Sequencing Number'])
+        self.assertEqual('Int64', model.dataframe['Vial Sequencing Number'].dtype)
+
+        model.undo()  # one step for all columns
+        pd.testing.assert_frame_equal(expected, model.dataframe)
+
+    def test_fill_in_mapping_file_by_lab_sample_id(self):
+        model = Model()
+        model.read_sequencing_table(file=f'{self.indir}/sequencing-table.csv')
+        model.import_patient_sample_sheet(file=f'{self.indir}/patient-sample-sheet-batch.csv')
+        before = model.dataframe.set_index('Lab Sample ID')['Sequencing Batch ID']
+
+        unmatched = model.fill_in_mapping_file(file=f'{self.indir}/mapping-lab-sample-id.csv')
+        self.assertEqual(['VGH999_T'], unmatched)
+        after = model.dataframe.set_index('Lab Sample ID')['Sequencing Batch ID']
+        self.assertEqual('SEQ_BATCH_020', after['VGH003_N'])
+        self.assertTrue(pd.isna(after['VGH001_T']))  # empty in the mapping file
+        self.assertEqual(before['VGH001_N'], after['VGH001_N'])  # not in the mapping file
+        self.assertEqual(3, len(model.undo_cache))
+
+    def test_fill_in_mapping_file_duplicated(self):
+        model = Model()
+        model.read_sequencing_table(file=f'{self.indir}/sequencing-table.csv')
+        with self.assertRaises(AssertionError):
+            model.fill_in_mapping_file(file=f'{self.indir}/mapping-duplicated.csv')
+        with self.assertRaises(AssertionError):  # no ID or Lab Sample ID
+            model.fill_in_mapping_file(file=f'{self.indir}/sequencing-batch-table.csv')
+        self.assertEqual(1, len(model.undo_cache))
+
+    def test_memory_usage(self):
+        model = Model()
+        model.read_sequencing_table(file=f'{self.indir}/sequencing-table.csv')
+        model.import_patient_sample_sheet(file=f'{self.indir}/patient-sample-sheet-batch.csv')
+        model.get_memory_usage()  # measures all columns
+        model.fill_in_cell_values(cells=[(1, 'Lab'), (3, 'Lab')], value='A_LAB_WITH_A_LONGER_NAME')
+        model.undo()
+        model.get_index()  # rebuilt after Lab was edited
+
+        usage = model.get_memory_usage()
+        self.assertEqual(int(model.dataframe.memory_usage(index=True, deep=True).sum()), usage['table'])
+        self.assertGreater(usage['index'], 0)
+        self.assertEqual(sum(d.nbytes for d in model.undo_cache), usage['undo'])
+        self.assertEqual(sum(d.nbytes for d in model.redo_cache), usage['redo'])
+        self.assertEqual(sum(v for k, v in usage.items() if k != 'total'), usage['total'])
+
+    def test_memory_ceiling(self):
+        model = Model(max_memory_bytes=0)
+        model.read_sequencing_table(file=f'{self.indir}/sequencing-table.csv')
+        model.import_patient_sample_sheet(file=f'{self.indir}/patient-sample-sheet-batch.csv')
+        model.sort_dataframe(by='ID', ascending=False)
+        self.assertEqual(1, len(model.undo_cache))  # the oldest edits are evicted
+
+        model.undo()
+        self.assertEqual(0, len(model.undo_cache))
+        self.assertEqual(1, len(model.redo_cache))  # the latest step each way is kept
+        model.redo()
+        self.assertEqual(1, len(model.undo_cache))
+        self.assertEqual(sum(d.nbytes for d in model.undo_cache), model.undo_bytes)
+
+    def test_change_events(self):
+        model = Model()
+        events = []
+        model.add_listener(events.append)
+
+        model.read_sequencing_table(file=f'{self.indir}/sequencing-table.csv')
+        model.import_patient_sample_sheet(file=f'{self.indir}/patient-sample-sheet-batch.csv')
+        model.fill_in_cell_values(cells=[(1, 'Lab'), (3, 'Lab')], value='OTHER_LAB')
+        model.sort_dataframe(by='ID', ascending=True)
+        model.drop(rows=[0])
+        model.undo()
+
+        actual = [type(e).__name__ for e in events]
+        expected = ['TableReset', 'RowsInserted', 'CellsChanged', 'RowsPermuted', 'RowsRemoved', 'RowsInserted']
+        self.assertListEqual(expected, actual)
+        self.assertListEqual([1, 2, 3, 4], events[1].positions.tolist())
+        self.assertListEqual([1, 3], events[2].rows.tolist())
+
+    def test_dtypes(self):
+        model = Model()
+        model.read_sequencing_table(file=f'{self.indir}/sequencing-table.csv')
+        model.import_patient_sample_sheet(file=f'{self.indir}/patient-sample-sheet-batch.csv')
+        dtypes = model.dataframe.dtypes
+        self.assertEqual('Int64', dtypes['Patient ID'])
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(dtypes['Import Date']))
+        self.assertIsInstance(dtypes['Tissue Type'], pd.CategoricalDtype)
+
+        model.fill_in_cell_values(cells=[(0, 'Tissue Type')], value='Recurrent Tumor')  # a new category
+        model.fill_in_cell_values(cells=[(0, 'Patient ID')], value='7')
+        self.assertEqual('Recurrent Tumor', model.dataframe.loc[0, 'Tissue Type'])
+        self.assertEqual(7, model.dataframe.loc[0, 'Patient ID'])
+        self.assertEqual('Int64', model.dataframe.dtypes['Patient ID'])
+
+        model.undo()
+        model.undo()
+        pd.testing.assert_series_equal(dtypes, model.dataframe.dtypes)
+
+    def test_save_snapshot(self):
+        with open(f'{self.indir}/sequencing-table.csv') as fh:
+            lines = fh.read().splitlines()
+        with open(f'{self.workdir}/sequencing-table.csv', 'w') as fh:
+            fh.write('\n'.join(lines + [lines[1].replace(',1,1,', ',unknown,1,')]) + '\n')
+        model = Model()
+        model.read_sequencing_table(file=f'{self.workdir}/sequencing-table.csv')
+        self.assertNotEqual('Int64', model.dataframe['Patient ID'].dtype)  # text in a number column is kept
+        model.save_sequencing_table(file=f'{self.outdir}/sequencing-table.pkl')
+
+        new = Model()
+        new.read_sequencing_table(file=f'{self.outdir}/sequencing-table.pkl')
+        pd.testing.assert_frame_equal(model.dataframe, new.dataframe)
+
+    @unittest.skipUnless(find_spec('pyarrow'), 'pyarrow is not installed')
+    def test_save_arrow_snapshot(self):
+        model = Model()
+        model.read_sequencing_table(file=f'{self.indir}/sequencing-table.csv')
+        model.import_patient_sample_sheet(file=f'{self.indir}/patient-sample-sheet-batch.csv')
+        for ext in ['feather', 'parquet']:
+            model.save_sequencing_table(file=f'{self.outdir}/sequencing-table.{ext}')
+            new = Model()
+            new.read_sequencing_table(file=f'{self.outdir}/sequencing-table.{ext}')
+            pd.testing.assert_frame_equal(model.dataframe, new.dataframe)
+
+    def test_save_store(self):
+        file = f'{self.outdir}/sequencing-table.sqlite'
+        model = Model()
+        model.read_sequencing_table(file=f'{self.indir}/sequencing-table.csv')
+        model.save_sequencing_table(file=file)
+        model.import_patient_sample_sheet(file=f'{self.indir}/patient-sample-sheet-batch.csv')
+        self.assertEqual(1, model.store_rows)
+        model.save_sequencing_table(file=file)  # only the imported rows are inserted
+        model.fill_in_cell_values(cells=[(2, 'Patient ID')], value='8')
+        self.assertEqual(2, model.store_rows)
+        model.save_sequencing_table(file=file)
+
+        new = Model()
+        new.read_sequencing_table(file=file)
+        pd.testing.assert_frame_equal(model.dataframe, new.dataframe)
+
+    def test_edit_while_saving(self):
+        model = Model()
+        model.read_sequencing_table(file=f'{self.indir}/sequencing-table.csv')
+
+        def write_table(df: pd.DataFrame, file: str):
+            model.fill_in_cell_values(cells=[(0, 'Patient ID')], value=1000)  # patched in place, not locked
+            original(df, file=file)
+
+        original = src.model.write_table
+        src.model.write_table = write_table
+        try:
+            model.save_sequencing_table(file=f'{self.outdir}/sequencing-table.pkl')
+        finally:
+            src.model.write_table = original
+
+        self.assertEqual(1000, model.dataframe.loc[0, 'Patient ID'])
+        self.assertEqual(1, pd.read_pickle(f'{self.outdir}/sequencing-table.pkl').loc[0, 'Patient ID'])
+
     def test_fill_in_cell_values(self):
         model = Model()
         model.read_sequencing_table(file=f'{self.indir}/sequencing-table.csv')
@@ -84,6 +375,33 @@ class TestModel(TestCase):
         self.assertEqual(2, len(model.undo_cache))
 
 
+class TestReadTable(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.file = f'{self.workdir}/sheet.csv'
+        with open(self.file, 'w') as fh:
+            fh.write('Note,Lab Patient ID,Lab,Vial Sequencing Number\nx,007,CCY_LAB,1\ny,8,CCY_LAB,2\n')
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        reader = ReadTable()
+        df = reader.main(
+            file=self.file,
+            columns=['Lab Patient ID', 'Lab', 'Vial Sequencing Number'],
+            dtypes={'Lab Patient ID': 'str', 'Lab': 'category', 'Vial Sequencing Number': 'Int64'})
+        self.assertListEqual(['007', '8'], df['Lab Patient ID'].tolist())  # text is not parsed as numbers
+        self.assertIsInstance(df['Lab'].dtype, pd.CategoricalDtype)
+        self.assertEqual('Int64', df['Vial Sequencing Number'].dtype)
+        self.assertSetEqual({'parse', 'cast'}, set(reader.timings.keys()))
+
+    def test_missing_column(self):
+        with self.assertRaises(AssertionError):
+            ReadTable().main(file=self.file, columns=['Lab', 'Lab Sample ID'])
+
+
 class TestBuildRunTable(TestCase):
 
     def setUp(self):
@@ -116,6 +434,61 @@ class TestBuildRunTable(TestCase):
             second=pd.read_csv(f'{self.indir}/run-table.csv'),
         )
 
+    def test_numeric_sequencing_batch_ids(self):
+        batch_id_to_number = {
+            'NGS1120674-1': '11206741',
+            'NGS1120674': '1120674',
+            'NGS1070824': '1070824',
+            'NGS1030101': '1030101',
+            'OD20221103_CLA385': '20221103',
+            'TS231220015': '231220015',
+        }
+        for name in ['seq-df.csv', 'sequencing-batch-table.csv']:
+            with open(f'{self.indir}/{name}') as fh:
+                text = fh.read()
+            for batch_id, number in batch_id_to_number.items():
+                text = text.replace(batch_id, number)
+            with open(f'{self.workdir}/{name}', 'w') as fh:
+                fh.write(text)
+
+        model = Model()
+        model.read_sequencing_table(file=f'{self.workdir}/seq-df.csv')
+        seq_ids = [
+            '002-00002-0101-E-X01-01',
+            '002-00002-0101-E-X01-99',
+            '002-00002-0103-E-X01-02',
+            '002-00002-0102-E-X01-03',
+            '002-00003-0102-E-X01-03',
+        ]
+        model.build_run_table(
+            seq_ids=seq_ids,
+            r1_suffix='_R1.fastq.gz',
+            r2_suffix='_R2.fastq.gz',
+            sequencing_batch_table_file=f'{self.workdir}/sequencing-batch-table.csv',
+            fastq_correction_file='',
+            output_file=f'{self.outdir}/run-table.csv',
+            use_lab_sample_id=True)
+
+        expected = pd.read_csv(f'{self.indir}/run-table.csv')
+        actual = pd.read_csv(f'{self.outdir}/run-table.csv')
+        self.assertListEqual(expected['BED File'].tolist(), actual['BED File'].tolist())
+
+        seq_df = pd.read_csv(f'{self.workdir}/seq-df.csv')  # not typed
+        unselected = seq_df.iloc[[0]].assign(**{'ID': 'UNSELECTED', 'Sequencing Batch ID': float('nan')})
+        seq_df = pd.concat([seq_df, unselected], ignore_index=True)
+        self.assertEqual('float64', seq_df['Sequencing Batch ID'].dtype)  # e.g. 20221103.0
+        BuildRunTable().main(
+            seq_df=seq_df,
+            seq_ids=seq_ids,
+            r1_suffix='_R1.fastq.gz',
+            r2_suffix='_R2.fastq.gz',
+            sequencing_batch_table_file=f'{self.workdir}/sequencing-batch-table.csv',
+            fastq_correction_file='',
+            output_file=f'{self.outdir}/run-table-floats.csv',
+            use_lab_sample_id=True)
+        actual = pd.read_csv(f'{self.outdir}/run-table-floats.csv')
+        self.assertListEqual(expected['BED File'].tolist(), actual['BED File'].tolist())
+
     def test_tumor_only(self):
         seq_df = pd.read_csv(f'{self.indir}/seq-df.csv')
         seq_ids = [
@@ -161,3 +534,29 @@ class TestBuildRunTable(TestCase):
             first=pd.read_csv(f'{self.outdir}/run-table.csv'),
             second=pd.read_csv(f'{self.indir}/run-table-fastq-correction.csv'),
         )
+
+    def test_store(self):
+        seq_df = pd.read_csv(f'{self.indir}/seq-df.csv')
+        store_file = f'{self.workdir}/seq-df.sqlite'
+        write_table(seq_df, file=store_file)
+        BuildRunTable().main(
+            seq_df=seq_df,
+            seq_ids=[
+                '002-00002-0101-E-X01-01',
+                '002-00002-0101-E-X01-99',
+                '002-00002-0103-E-X01-02',
+                '002-00002-0102-E-X01-03',
+                '002-00003-0102-E-X01-03',
+            ],
+            r1_suffix='_R1.fastq.gz',
+            r2_suffix='_R2.fastq.gz',
+            sequencing_batch_table_file=f'{self.indir}/sequencing-batch-table.csv',
+            fastq_correction_file='',
+            output_file=f'{self.outdir}/run-table.csv',
+            use_lab_sample_id=True,
+            store_file=store_file,  # rows are selected from the store
+        )
+        self.assertDataFrameEqual(
+            first=pd.read_csv(f'{self.outdir}/run-table.csv'),
+            second=pd.read_csv(f'{self.indir}/run-table.csv'),
+        )
@@ -0,0 +1,41 @@
+import pandas as pd
+from src.store import SqliteStore
+from .setup import TestCase
+
+
+class TestSqliteStore(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.file = f'{self.workdir}/table.sqlite'
+        self.df = pd.DataFrame({
+            'ID': ['a', 'b', 'c', 'b'],
+            'Patient ID': pd.array([1, 2, None, 2], dtype='Int64'),
+            'Import Date': pd.to_datetime(['2024-01-01'] * 4),
+        })
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_replace(self):
+        with SqliteStore(self.file, indexes={'idx_id': ['ID']}) as store:
+            store.replace(self.df)
+            store.replace(self.df.iloc[:2])
+            self.assertEqual(2, store.count())
+            actual = store.read(columns=['ID', 'Patient ID'])
+        self.assertListEqual(['a', 'b'], actual['ID'].tolist())
+        self.assertListEqual([1, 2], actual['Patient ID'].tolist())
+
+    def test_append(self):
+        with SqliteStore(self.file) as store:
+            store.replace(self.df.iloc[:3])
+            store.append(self.df.iloc[3:], keep=1)  # rows after the first one are replaced
+            actual = store.read()
+        self.assertListEqual(['a', 'b'], actual['ID'].tolist())
+        self.assertListEqual(['2024-01-01 00:00:00'] * 2, actual['Import Date'].tolist())
+
+    def test_select(self):
+        with SqliteStore(self.file, indexes={'idx_id': ['ID']}) as store:
+            store.replace(self.df)
+            actual = store.select(column='ID', values=['c', 'b', 'x'], columns=['ID', 'Patient ID'])
+        self.assertListEqual(['b', 'c', 'b'], actual['ID'].tolist())  # in the order of the table
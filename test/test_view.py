@@ -0,0 +1,26 @@
+import os
+from .setup import TestCase
+
+
+class TestTable(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        from PyQt5.QtWidgets import QApplication
+        self.app = QApplication.instance() or QApplication([])
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_resize_columns_on_first_rows(self):
+        from src.model import Model
+        from src.view import Table
+        model = Model()
+        table = Table(model)
+        widths = [table.columnWidth(j) for j in range(len(model.dataframe.columns))]
+
+        model.import_patient_sample_sheet(file=f'{self.indir}/patient-sample-sheet-batch.csv')  # rows inserted
+        self.app.processEvents()
+        j = model.dataframe.columns.get_loc('Hospital Research Center')
+        self.assertGreater(table.columnWidth(j), widths[j])